@@ -1,22 +1,188 @@
 from http.server import BaseHTTPRequestHandler
-import os, json, requests, psycopg2, datetime, time
-from urllib.parse import urlparse, parse_qs
-from bs4 import BeautifulSoup
+import os, json, datetime, time, threading, tempfile, codecs, hashlib, itertools, math, contextlib
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from html.parser import HTMLParser
+from urllib.parse import urlparse, parse_qs, urlsplit, urlunsplit, parse_qsl, urlencode
 import re
+from decimal import Decimal, InvalidOperation
+
+# requests (+ urllib3), psycopg2 and bs4 are most of a cold start's import
+# time, so they're imported on first use: load_http() when the first
+# session is created, load_database_driver() on the first connect, bs4 only
+# by the "soup"/"lxml" HTML backends. A 401 needs none of them.
+requests = HTTPAdapter = Retry = HTTPConnectionPool = HTTPSConnectionPool = None
+psycopg2 = None
 
 # ==================================
 # 🔧 CONFIGURATION
 # ==================================
-PINCODES_TO_CHECK = str(os.getenv("PINCODES_TO_CHECK"))
-PINCODES_TO_CHECK = PINCODES_TO_CHECK.split(",") 
-print(f"[config] Pincodes to check: {PINCODES_TO_CHECK}")
+# Comma-separated; parsed and validated on first use (see pincodes_to_check)
+PINCODES_TO_CHECK = os.getenv("PINCODES_TO_CHECK", "")
 DATABASE_URL = os.getenv("DIRECT_URL")
+# Set DB_USE_POOLER=1 to connect through the transaction pooler URL Prisma
+# uses at runtime (DATABASE_URL) instead of the direct connection
+DB_POOLER_URL = os.getenv("DATABASE_URL")
+DB_USE_POOLER = os.getenv("DB_USE_POOLER", "0") == "1"
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+# A kept-open connection idle longer than this (seconds) is pinged before reuse
+DB_HEALTH_CHECK_AFTER = float(os.getenv("DB_HEALTH_CHECK_AFTER", "30"))
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_GROUP_ID = str(os.getenv("TELEGRAM_GROUP_ID")) # Telegram group ID
 CRON_SECRET = os.getenv("CRON_SECRET")
 
-# Flipkart Proxy (AlwaysData)
-FLIPKART_PROXY_URL = "https://rknldeals.alwaysdata.net/flipkart_check"
+# Telegram delivery: alerts are split into messages Telegram accepts and
+# sent before the handler responds (a finished Vercel function may be
+# frozen). Groups take about 20 messages a minute, so parts go out
+# TELEGRAM_SEND_INTERVAL seconds apart, for at most TELEGRAM_DELIVERY_BUDGET
+# seconds per invocation (the handler caps it at what's left of the run's
+# budget, see DEADLINE_RESERVE). What doesn't go out is kept in telegram_outbox
+# and retried by the next invocation, unless it's older than
+# TELEGRAM_OUTBOX_TTL seconds (stale stock news).
+TELEGRAM_SEND_INTERVAL = float(os.getenv("TELEGRAM_SEND_INTERVAL", "3"))
+TELEGRAM_DELIVERY_BUDGET = float(os.getenv("TELEGRAM_DELIVERY_BUDGET", "8"))
+TELEGRAM_MAX_ATTEMPTS = int(os.getenv("TELEGRAM_MAX_ATTEMPTS", "5"))
+TELEGRAM_OUTBOX_TTL = int(os.getenv("TELEGRAM_OUTBOX_TTL", "3600"))
+
+# Flipkart Proxy (AlwaysData). flipkart_proxy.py in the repo root is a
+# self-hostable reference implementation; point this at it to use your own.
+FLIPKART_PROXY_URL = os.getenv("FLIPKART_PROXY_URL", "https://rknldeals.alwaysdata.net/flipkart_check")
+# Products per batched proxy call ({"productIds": [...]}). Off (1) by default:
+# the AlwaysData proxy only takes {"productId"}. Set it (e.g. 20) for a proxy
+# that speaks the batch protocol, such as flipkart_proxy.py.
+FLIPKART_BATCH_SIZE = int(os.getenv("FLIPKART_BATCH_SIZE", "1"))
+# Seconds before probing the proxy for batch support again, after a probe
+# that failed without an answer either way (a 5xx or a network error)
+FLIPKART_PROBE_COOLDOWN = int(os.getenv("FLIPKART_PROBE_COOLDOWN", "300"))
+
+# Concurrency: global cap on in-flight checks, plus a cap per store so one
+# store's slow endpoint can't hog every worker (or get us rate limited).
+MAX_WORKERS = int(os.getenv("CHECK_MAX_WORKERS", "16"))
+STORE_CONCURRENCY = {
+    "croma": int(os.getenv("CROMA_CONCURRENCY", "8")),
+    "flipkart": int(os.getenv("FLIPKART_CONCURRENCY", "4")),
+    "amazon": int(os.getenv("AMAZON_CONCURRENCY", "2")),
+    "reliance_digital": int(os.getenv("RD_CONCURRENCY", "6")),
+    "iqoo": int(os.getenv("IQOO_CONCURRENCY", "4")),
+    "vivo": int(os.getenv("VIVO_CONCURRENCY", "4")),
+    "unicorn": int(os.getenv("UNICORN_CONCURRENCY", "16")),
+}
+
+# HTTP: per-store (connect, read) timeouts in seconds, and how many times a
+# 429/5xx or failed connect is retried (with exponential backoff) per request.
+STORE_TIMEOUTS = {
+    "croma": (5, 10),
+    "flipkart": (5, 25),
+    "amazon": (5, 20),
+    "reliance_digital": (5, 20),
+    "iqoo": (5, 20),
+    "vivo": (5, 20),
+    "unicorn": (5, 10),
+}
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))
+
+# Store health: after BREAKER_THRESHOLD failed calls in a row a store's
+# circuit opens and its remaining checks fail fast; after BREAKER_COOLDOWN
+# seconds one probe call is let through to decide whether it closes again.
+# Requests are also paced per store (requests/second, 0 = unpaced); the
+# rate halves on a 429/503 and creeps back up on successful responses.
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = int(os.getenv("BREAKER_COOLDOWN", "300"))
+STORE_RATE_LIMITS = {
+    "croma": float(os.getenv("CROMA_RATE", "25")),
+    "flipkart": float(os.getenv("FLIPKART_RATE", "10")),
+    "amazon": float(os.getenv("AMAZON_RATE", "4")),
+    "reliance_digital": float(os.getenv("RD_RATE", "20")),
+    "iqoo": float(os.getenv("IQOO_RATE", "8")),
+    "vivo": float(os.getenv("VIVO_RATE", "8")),
+    "unicorn": float(os.getenv("UNICORN_RATE", "20")),
+}
+# Pacing never drops below this fraction of a store's rate
+MIN_RATE_FRACTION = 0.1
+
+# Caches are kept in memory and mirrored to JSON files here, so warm
+# invocations (and anything sharing the instance's /tmp) reuse them.
+CACHE_DIR = os.getenv("CACHE_DIR", tempfile.gettempdir())
+RD_PRICE_TTL = int(os.getenv("RD_PRICE_TTL", "1800"))
+PAGE_STATE_TTL = int(os.getenv("PAGE_STATE_TTL", str(24 * 3600)))
+# Identical store requests (same store, product and pincode) share one
+# answer: concurrent ones wait for the first, and successful answers are
+# reused for RESULT_CACHE_TTL seconds, e.g. by a manual run right after the
+# cron tick. Keep it well under the cron interval; 0 turns reuse off.
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "30"))
+
+# Scheduling: only products whose next check is due are loaded each run,
+# as many as fit in SCHEDULE_BUDGET seconds; the rest carry over.
+SCHEDULED_CHECKS = os.getenv("SCHEDULED_CHECKS", "1") == "1"
+SCHEDULE_BUDGET = float(os.getenv("SCHEDULE_BUDGET", "45"))
+SCHEDULE_MAX_DUE = int(os.getenv("SCHEDULE_MAX_DUE", "5000"))
+SCHEDULE_MAX_INTERVAL = int(os.getenv("SCHEDULE_MAX_INTERVAL", str(6 * 3600)))
+
+# Sharded runs (?run=<id>&shards=<n>): n invocations fired together for one
+# run each claim SHARD_CLAIM_SIZE due products at a time, leased for
+# SHARD_LEASE seconds, until their budget is full. The last shard to finish
+# sends the run's merged alert; a run whose shards haven't all reported
+# SHARD_LEASE seconds after it started is sent by the next sharded run.
+SHARD_CLAIM_SIZE = int(os.getenv("SHARD_CLAIM_SIZE", "100"))
+SHARD_LEASE = int(os.getenv("SHARD_LEASE", "120"))
+
+# Pincode order: each product tries the pincode that last had it in stock
+# first, then the rest by the store's hit rate. Pincodes that reported it
+# out of stock less than PINCODE_NEGATIVE_TTL seconds ago are skipped
+# (never the first one). ADAPTIVE_PINCODES=0 keeps config order.
+ADAPTIVE_PINCODES = os.getenv("ADAPTIVE_PINCODES", "1") == "1"
+PINCODE_NEGATIVE_TTL = int(os.getenv("PINCODE_NEGATIVE_TTL", "600"))
+
+# Deadline: the handler gives each run RUN_TIME_BUDGET seconds (or ?budget=).
+# No new checks start within DEADLINE_RESERVE seconds of the end, which is
+# kept for saving state and sending the alert; in-flight ones are abandoned.
+# Telegram delivery gets whatever of the budget is left after saving, so a
+# run that uses all of it sends less now and leaves the rest to the outbox.
+RUN_TIME_BUDGET = float(os.getenv("RUN_TIME_BUDGET", "50"))
+DEADLINE_RESERVE = float(os.getenv("DEADLINE_RESERVE", "5"))
+# Check interval for hot products (in stock or recently changed), per store
+STORE_BASE_INTERVAL = {
+    "croma": 60,
+    "flipkart": 120,
+    "amazon": 180,
+    "reliance_digital": 60,
+    "iqoo": 300,
+    "vivo": 300,
+    "unicorn": 120,
+}
+# Rough worker-seconds one product check costs (per pincode where relevant);
+# for stores with batch checks, what one batch call costs
+STORE_CHECK_SECONDS = {
+    "croma": 1.0,
+    "flipkart": 4.0,
+    "amazon": 3.0,
+    "reliance_digital": 0.5,
+    "iqoo": 2.0,
+    "vivo": 2.0,
+    "unicorn": 1.0,
+}
+
+_pincodes = None
+
+
+def pincodes_to_check():
+    """
+    PINCODES_TO_CHECK as a list, parsed and validated on the first run
+    rather than at import. Entries that aren't 6-digit pincodes are dropped
+    with a warning; raises ValueError if none are left.
+    """
+    global _pincodes
+    if _pincodes is None:
+        entries = [entry.strip() for entry in PINCODES_TO_CHECK.split(",") if entry.strip()]
+        pincodes = [entry for entry in entries if len(entry) == 6 and entry.isdigit()]
+        for entry in entries:
+            if entry not in pincodes:
+                print(f"[warn] Ignoring invalid pincode in PINCODES_TO_CHECK: {entry!r}")
+        if not pincodes:
+            raise ValueError("PINCODES_TO_CHECK has no valid pincodes")
+        print(f"[config] Pincodes to check: {pincodes}")
+        _pincodes = pincodes
+    return _pincodes
 
 # ==================================
 # 🧠 VERCEL HANDLER
@@ -34,30 +200,56 @@ class handler(BaseHTTPRequestHandler):
             return
 
         try:
-            in_stock_messages, summary = main_logic()
-
-            # ✅ Only send Telegram message if at least one product is available
-            if in_stock_messages:
-                final_message = (
-                    "🔥 *Stock Alert!*\n\n"
-                    + "\n\n".join(in_stock_messages)
-                    + "\n\n"
-                    + summary
-                )
-                send_telegram_message(final_message)
-                print("[info] ✅ Telegram message sent with available products.")
-            else:
-                print("[info] ❌ No products in stock — skipping Telegram notification.")
+            scheduled = query_components.get("scheduled", ["1" if SCHEDULED_CHECKS else "0"])[0] == "1"
+            time_budget = float(query_components.get("budget", [RUN_TIME_BUDGET])[0])
+            detailed = query_components.get("metrics", ["0"])[0] == "1"
+            # Sharded: every invocation of one fan-out passes the same run ID
+            run_id = query_components.get("run", [None])[0]
+            shard = (run_id, max(1, int(query_components.get("shards", ["1"])[0]))) if run_id else None
+            started = time.time()
+            report = run_stock_check(scheduled=scheduled, time_budget=time_budget, shard=shard)
+            summary = report["summary"]
+
+            # ✅ Only send Telegram message for products that came into stock (or got cheaper).
+            # A shard leaves that to whichever shard finishes the run.
+            notifications = report["aggregated"] if shard else [(None, report["alerts"], summary)]
+            for _, alerts, run_summary in notifications:
+                queue_stock_alert(alerts, run_summary)
+            if not any(alerts for _, alerts, _ in notifications):
+                print("[info] ❌ No stock changes — skipping Telegram notification.")
+            # 💬 Send them (and retries left from earlier runs) before responding:
+            # Vercel may freeze the instance as soon as the caller has the body.
+            # Within what's left of the run's budget, so the function doesn't time out
+            delivery_budget = TELEGRAM_DELIVERY_BUDGET
+            if time_budget:
+                delivery_budget = min(delivery_budget, max(0.0, time_budget - (time.time() - started)))
+            deliver_telegram_messages(delivery_budget)
 
             # ✅ Always respond with summary
+            body = json.dumps(
+                {
+                    "status": "ok",
+                    "found": len(report["in_stock"]),
+                    "alerts": len(report["alerts"]),
+                    "carried_over": report["carried_over"],
+                    "skipped": [
+                        {"id": p.get("id"), "name": p["name"], "store": p["storeType"]}
+                        for p in report["skipped"]
+                    ],
+                    "duration": report["duration"],
+                    "breakers": report["breakers"],
+                    "db": report["db"],
+                    **({"shard": {"run": run_id, "finished": [run for run, _, _ in report["aggregated"]]}} if shard else {}),
+                    "metrics": report["metrics"],
+                    **({"calls": call_details(report["calls"])} if detailed else {}),
+                    "summary": summary,
+                }
+            ).encode()
             self.send_response(200)
             self.send_header("Content-type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
             self.end_headers()
-            self.wfile.write(
-                json.dumps(
-                    {"status": "ok", "found": len(in_stock_messages), "summary": summary}
-                ).encode()
-            )
+            self.wfile.write(body)
 
         except Exception as e:
             print(f"[error] {e}")
@@ -66,138 +258,1636 @@ class handler(BaseHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(json.dumps({"error": str(e)}).encode())
 
+# ==================================
+# 🌐 HTTP SESSIONS
+# ==================================
+BROWSER_UA = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/137.0.0.0 Safari/537.36"
+)
+
+# Default headers for every request a store's session makes
+STORE_HEADERS = {
+    "croma": {
+        "accept": "application/json",
+        "content-type": "application/json",
+        "oms-apim-subscription-key": "1131858141634e2abe2efb2b3a2a2a5d",
+        "origin": "https://www.croma.com",
+        "referer": "https://www.croma.com/",
+    },
+    "flipkart": {},
+    "amazon": {
+        "authority": "www.amazon.in",
+        "method": "GET",
+        "scheme": "https",
+        "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+        "accept-language": "en-US,en;q=0.9",
+        "cache-control": "max-age=0",
+        "sec-ch-ua": '"Not_A Brand";v="99", "Google Chrome";v="137", "Chromium";v="137"',
+        "sec-ch-ua-mobile": "?0",
+        "sec-ch-ua-platform": '"Windows"',
+        "upgrade-insecure-requests": "1",
+        "user-agent": BROWSER_UA,
+    },
+    "reliance_digital": {
+        "accept": "application/json, text/plain, */*",
+        "content-type": "application/json",
+        "user-agent": BROWSER_UA,
+        "origin": "https://www.reliancedigital.in",
+        "referer": "https://www.reliancedigital.in/",
+    },
+    "iqoo": {"User-Agent": BROWSER_UA},
+    "vivo": {"User-Agent": BROWSER_UA},
+    "unicorn": {
+        "accept": "application/json, text/plain, */*",
+        "content-type": "application/json",
+        "customer-id": "unicorn",
+        "origin": "https://shop.unicornstore.in",
+        "referer": "https://shop.unicornstore.in/",
+    },
+}
+
+# store -> {"requests": attempts sent, "opened": new TCP/TLS connections}
+CONNECTION_STATS = {}
+_stats_lock = threading.Lock()
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _count_connection(store, key):
+    with _stats_lock:
+        stats = CONNECTION_STATS.setdefault(store, {"requests": 0, "opened": 0})
+        stats[key] += 1
+
+
+def _timed_connection(base):
+    """Connection class that reports socket (DNS + TCP) and TLS setup time."""
+
+    class TimedConnection(base):
+        def _new_conn(self):
+            start = time.perf_counter()
+            try:
+                return super()._new_conn()
+            finally:
+                self.socket_seconds = time.perf_counter() - start
+                add_call_timing("connect", self.socket_seconds)
+
+        def connect(self):
+            self.socket_seconds = 0.0
+            start = time.perf_counter()
+            try:
+                super().connect()
+            finally:
+                add_call_timing("tls", time.perf_counter() - start - self.socket_seconds)
+
+    return TimedConnection
+
+
+def _counting_pool(base, store):
+    """Connection pool class that counts new connections vs. requests sent."""
+
+    class CountingPool(base):
+        ConnectionCls = _timed_connection(base.ConnectionCls)
+
+        def _new_conn(self):
+            _count_connection(store, "opened")
+            return super()._new_conn()
+
+        def _make_request(self, *args, **kwargs):
+            limiter = get_rate_limiter(store)
+            limiter.acquire()
+            _count_connection(store, "requests")
+            call = current_call()
+            setup = call["connect"] + call["tls"] if call else 0.0
+            start = time.perf_counter()
+            response = super()._make_request(*args, **kwargs)
+            limiter.feedback(response.status)
+            if call:
+                # Up to the response headers, minus any connection setup on the way
+                call["ttfb"] += time.perf_counter() - start - (call["connect"] + call["tls"] - setup)
+                call["requests"] += 1
+                call["status"].append(response.status)
+            return response
+
+    return CountingPool
+
+
+_http_lock = threading.Lock()
+
+
+def load_http():
+    """
+    Import requests and urllib3 and define the classes built on them
+    (StoreAdapter, TimedRetry, StoreSession). Once per process; every
+    session is created through here.
+    """
+    global requests, HTTPAdapter, Retry, HTTPConnectionPool, HTTPSConnectionPool
+    global StoreAdapter, TimedRetry, StoreSession
+    with _http_lock:
+        if requests is not None:
+            return
+        import requests as _requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+        from urllib3.util.retry import Retry
+
+        class StoreAdapter(HTTPAdapter):
+            def __init__(self, store, **kwargs):
+                self.store = store
+                super().__init__(**kwargs)
+
+            def init_poolmanager(self, *args, **kwargs):
+                super().init_poolmanager(*args, **kwargs)
+                self.poolmanager.pool_classes_by_scheme = {
+                    "http": _counting_pool(HTTPConnectionPool, self.store),
+                    "https": _counting_pool(HTTPSConnectionPool, self.store),
+                }
+
+        class TimedRetry(Retry):
+            """Retry policy that reports its backoff sleeps, so they aren't counted as download time."""
+
+            def sleep(self, response=None):
+                start = time.perf_counter()
+                super().sleep(response)
+                add_call_timing("backoff", time.perf_counter() - start)
+
+        class StoreSession(_requests.Session):
+            """
+            requests.Session with the store's default timeout applied to every
+            call. Non-streamed requests are coalesced: identical ones share one
+            answer (see coalesce).
+            """
+
+            def __init__(self, store):
+                super().__init__()
+                self.store = store
+                self.timeout = store_config(store).timeout
+
+            def request(self, method, url, **kwargs):
+                kwargs.setdefault("timeout", self.timeout)
+                if kwargs.get("stream"):
+                    return self._send(method, url, **kwargs)
+
+                def fetch():
+                    res = self._send(method, url, **kwargs)
+                    return res, response_snapshot(res), res.status_code == 200
+
+                res, snapshot = coalesce(request_key(self.store, method, url, kwargs), fetch)
+                return res if res is not None else response_from(snapshot)
+
+            def _send(self, method, url, **kwargs):
+                call = current_call()
+                if call is None:
+                    return super().request(method, url, **kwargs)
+
+                call["calls"] += 1
+                before = call["connect"] + call["tls"] + call["ttfb"] + call["backoff"]
+                start = time.perf_counter()
+                res = super().request(method, url, **kwargs)
+                if not kwargs.get("stream"):
+                    # The body has been read; streamed bodies are timed by their reader
+                    elapsed = time.perf_counter() - start
+                    call["download"] += elapsed - (call["connect"] + call["tls"] + call["ttfb"] + call["backoff"] - before)
+                    call["bytes"] += len(res.content)
+                return res
+
+        # Last, so a set `requests` means everything above is defined
+        requests = _requests
+
+
+def get_session(store, retries=True):
+    """
+    Shared keep-alive session for a store. Created once per process, so warm
+    invocations reuse connections too. The pool holds as many connections as
+    the store's checker runs concurrently. With retries=False, a separate
+    session for the store that sends every request exactly once (probes).
+    """
+    load_http()
+    key = store if retries else (store, "once")
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            retry = TimedRetry(
+                total=HTTP_RETRIES,
+                connect=HTTP_RETRIES,
+                read=0,  # a read timeout already burned the full budget
+                status=HTTP_RETRIES,
+                backoff_factor=HTTP_BACKOFF,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=None,  # the store APIs are POST lookups, safe to repeat
+                respect_retry_after_header=False,  # keep the backoff bounded
+                raise_on_status=False,
+            ) if retries else TimedRetry(total=0, raise_on_status=False)
+            adapter = StoreAdapter(
+                store,
+                pool_connections=4,
+                pool_maxsize=store_config(store).concurrency,
+                max_retries=retry,
+            )
+            session = StoreSession(store)
+            session.headers.update(STORE_HEADERS.get(store, {}))
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[key] = session
+        return session
+
+
+def connection_stats():
+    """Per-store counts of connections opened vs. reused since the last reset."""
+    with _stats_lock:
+        return {
+            store: {
+                "opened": stats["opened"],
+                "reused": max(0, stats["requests"] - stats["opened"]),
+            }
+            for store, stats in CONNECTION_STATS.items()
+        }
+
+
+def reset_connection_stats():
+    with _stats_lock:
+        CONNECTION_STATS.clear()
+
+# ==================================
+# 🚦 STORE HEALTH
+# ==================================
+_breakers = {}
+_limiters = {}
+_health_lock = threading.Lock()
+
+
+class CircuitBreaker:
+    """
+    Per-store circuit: "closed" (calls go through), "open" (calls fail fast
+    until `open_until`), or "half_open" (one probe call at a time decides).
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.state = "closed"
+        self.failures = 0  # consecutive failed calls
+        self.open_until = 0.0
+        self.probing = False
+        self.rejected = 0  # calls failed fast this run
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == "open" and time.time() >= self.open_until:
+                self.state = "half_open"
+                self.probing = False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, failed):
+        with self.lock:
+            if not failed:
+                if self.state != "closed":
+                    print(f"[info] 🚦 {self.store} recovered, circuit closed")
+                self.state = "closed"
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= BREAKER_THRESHOLD):
+                print(f"[warn] 🚦 {self.store} circuit open after {self.failures} failures")
+                self.state = "open"
+                self.open_until = time.time() + BREAKER_COOLDOWN
+            self.probing = False
+
+    def release(self):
+        """An allowed call that learned nothing about the store: free the probe slot."""
+        with self.lock:
+            self.probing = False
+
+
+class RateLimiter:
+    """
+    Token bucket (one second of burst) whose rate adapts: halved on a 429
+    or 503 (at most once every two seconds), raised by 10% of the cap per
+    successful response.
+    """
+
+    def __init__(self, max_rate):
+        self.max_rate = max_rate
+        self.min_rate = max_rate * MIN_RATE_FRACTION
+        self.rate = max_rate
+        self.tokens = max(1.0, max_rate)
+        self.updated = time.monotonic()
+        self.last_cut = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.max_rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Reserve a token even if it isn't there yet, then wait for it
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+    def feedback(self, status):
+        if not self.max_rate:
+            return
+        with self.lock:
+            if status in (429, 503):
+                now = time.monotonic()
+                if now - self.last_cut >= 2:
+                    self.rate = max(self.min_rate, self.rate / 2)
+                    self.last_cut = now
+                    print(f"[warn] 🚦 HTTP {status}, pacing down to {self.rate:.1f} req/s")
+            elif status < 500:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.1)
+
+
+def get_breaker(store):
+    with _health_lock:
+        if store not in _breakers:
+            _breakers[store] = CircuitBreaker(store)
+        return _breakers[store]
+
+
+def get_rate_limiter(store):
+    with _health_lock:
+        if store not in _limiters:
+            _limiters[store] = RateLimiter(store_config(store).rate)
+        return _limiters[store]
+
+
+def restore_store_health(rows):
+    """Apply saved (store, state, failures, open_until, rate) rows."""
+    for store, state, failures, open_until, rate in rows:
+        breaker = get_breaker(store)
+        with breaker.lock:
+            breaker.state = state
+            breaker.failures = failures
+            breaker.open_until = open_until.replace(tzinfo=datetime.timezone.utc).timestamp() if open_until else 0.0
+            breaker.probing = False
+        limiter = get_rate_limiter(store)
+        if rate and limiter.max_rate:
+            with limiter.lock:
+                limiter.rate = max(limiter.min_rate, min(limiter.max_rate, rate))
+
+
+def store_health_rows():
+    """(store, state, failures, open_until, rate) for every store seen in this process."""
+    rows = []
+    with _health_lock:
+        stores = sorted(set(_breakers) | set(_limiters))
+    for store in stores:
+        breaker = get_breaker(store)
+        limiter = get_rate_limiter(store)
+        open_until = None
+        if breaker.open_until:
+            open_until = datetime.datetime.fromtimestamp(breaker.open_until, datetime.timezone.utc).replace(tzinfo=None)
+        rows.append((store, breaker.state, breaker.failures, open_until, limiter.rate or None))
+    return rows
+
+# ==================================
+# 🧰 CACHES
+# ==================================
+_caches = []
+
+
+class TTLCache:
+    """Thread-safe key/value cache with per-entry expiry, persisted to CACHE_DIR."""
+
+    def __init__(self, name, ttl, maxsize=10000):
+        self.path = os.path.join(CACHE_DIR, f"stock-check-{name}.json")
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = None  # loaded on first use
+        self.dirty = False
+        self.lock = threading.Lock()
+        _caches.append(self)
+
+    def _load(self):
+        if self.entries is not None:
+            return
+        self.entries = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                now = time.time()
+                self.entries = {k: v for k, v in json.load(f).items() if v[0] > now}
+        except (OSError, ValueError):
+            pass
+
+    def get(self, key, default=None):
+        with self.lock:
+            self._load()
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                return default
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self._load()
+            self.entries[key] = [time.time() + (ttl or self.ttl), value]
+            if len(self.entries) > self.maxsize:
+                # Drop the entries closest to expiry
+                for old in sorted(self.entries, key=lambda k: self.entries[k][0])[: len(self.entries) - self.maxsize]:
+                    del self.entries[old]
+            self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            try:
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self.entries, f)
+                os.replace(tmp_path, self.path)
+                self.dirty = False
+            except OSError as e:
+                print(f"[warn] Could not persist cache {self.path}: {e}")
+
+
+def save_caches():
+    for cache in _caches:
+        cache.save()
+
+# ==================================
+# 🔁 REQUEST COALESCING
+# ==================================
+# Tracking parameters that don't change which page a URL serves: these
+# names exactly, and any name starting with utm_
+_TRACKING_PARAMS = frozenset(("ref", "ref_", "tag", "affid", "affextparam", "gclid", "fbclid"))
+_TRACKING_PREFIX = "utm_"
+_AMAZON_ASIN = re.compile(r"/(?:dp|gp/product|gp/aw/d)/([A-Z0-9]{10})", re.I)
+
+RESULT_CACHE = TTLCache("results", max(RESULT_CACHE_TTL, 1), maxsize=20000)
+_inflight = {}  # request key -> Future of its snapshot
+_inflight_lock = threading.Lock()
+
+
+def page_key(store, url):
+    """
+    The page a product URL really points at: Amazon by ASIN, others without
+    fragments and tracking parameters, so duplicate rows share one fetch.
+    """
+    if store == "amazon":
+        asin = _AMAZON_ASIN.search(url)
+        if asin:
+            return f"amazon GET asin:{asin.group(1).upper()}"
+    parts = urlsplit(url)
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in _TRACKING_PARAMS and not k.lower().startswith(_TRACKING_PREFIX)
+    )
+    return f"{store} GET {parts.netloc.lower()}{parts.path.rstrip('/')}?{urlencode(query)}"
+
+
+def request_key(store, method, url, kwargs):
+    """A store API call by what it asks for: URL, query and (canonical JSON) body."""
+    body = {key: kwargs.get(key) for key in ("params", "json", "data", "headers") if kwargs.get(key)}
+    return f"{store} {method.upper()} {url} {json.dumps(body, sort_keys=True, default=str)}"
+
+
+def coalesce(key, fetch):
+    """
+    Run `fetch()` -> (value, snapshot, reusable) once for concurrent callers
+    with the same key. Returns (value, snapshot): the caller that fetched
+    gets its own value; the others (and, while RESULT_CACHE_TTL lasts,
+    later callers if `reusable`) get value None and the JSON-able snapshot.
+    """
+    call = current_call()
+    if RESULT_CACHE_TTL:
+        snapshot = RESULT_CACHE.get(key)
+        if snapshot is not None:
+            if call is not None:
+                call["shared"] += 1
+            return None, snapshot
+
+    with _inflight_lock:
+        pending = _inflight.get(key)
+        leader = pending is None
+        if leader:
+            pending = _inflight[key] = Future()
+    if not leader:
+        if call is not None:
+            call["shared"] += 1
+        return None, pending.result()
+
+    try:
+        value, snapshot, reusable = fetch()
+    except BaseException as e:
+        pending.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+    pending.set_result(snapshot)
+    if reusable and RESULT_CACHE_TTL:
+        RESULT_CACHE.set(key, snapshot, RESULT_CACHE_TTL)
+    return value, snapshot
+
+
+def response_snapshot(res):
+    return {"status": res.status_code, "url": res.url, "headers": dict(res.headers), "body": res.text}
+
+
+def response_from(snapshot):
+    """A requests.Response carrying a shared snapshot's status, headers and body."""
+    res = requests.Response()
+    res.status_code = snapshot["status"]
+    res.url = snapshot["url"]
+    res.headers = requests.structures.CaseInsensitiveDict(snapshot["headers"])
+    res.encoding = "utf-8"
+    res._content = snapshot["body"].encode("utf-8")
+    return res
+
+# ==================================
+# 🔌 DATABASE CONNECTION
+# ==================================
+# Query parameters Prisma reads from its URLs that libpq would reject
+_PRISMA_URL_PARAMS = {"pgbouncer", "connection_limit", "pool_timeout", "statement_cache_size", "socket_timeout", "schema"}
+
+DB_STATS = {"connects": 0, "reused": 0, "stale": 0, "connect_ms": 0.0}
+_db_stats_lock = threading.Lock()
+
+
+def libpq_url(url):
+    """Strip Prisma's parameters (?pgbouncer=true&connection_limit=1) from a Postgres URL."""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in _PRISMA_URL_PARAMS]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def load_database_driver():
+    """Import psycopg2 (with extras and extensions) on the first connect."""
+    global psycopg2
+    if psycopg2 is None:
+        # NOTE: psycopg2 should be installed if running this locally: pip install psycopg2-binary
+        import psycopg2.extras, psycopg2.extensions
+
+
+def _count_db(key, amount=1):
+    with _db_stats_lock:
+        DB_STATS[key] += amount
+
+
+def reset_db_stats():
+    with _db_stats_lock:
+        for key in DB_STATS:
+            DB_STATS[key] = 0
+
+
+class DatabaseConnection:
+    """
+    The Postgres connection, kept open at module level so warm invocations
+    skip the TCP + TLS + auth handshake. One caller holds it at a time; a
+    caller that finds it busy (a loader still streaming rows) gets a
+    one-off connection instead. Before reusing a connection that sat idle
+    longer than DB_HEALTH_CHECK_AFTER it's pinged, and replaced if the
+    socket went stale.
+
+    psycopg2 never uses server-side prepared statements, so the
+    connection is safe behind a transaction pooler as it is.
+    """
+
+    def __init__(self):
+        self.conn = None
+        self.last_used = 0.0
+        self.lock = threading.Lock()
+
+    def dsn(self):
+        if DB_USE_POOLER and DB_POOLER_URL:
+            return libpq_url(DB_POOLER_URL)
+        return DATABASE_URL
+
+    def connect(self):
+        load_database_driver()
+        start = time.perf_counter()
+        conn = psycopg2.connect(
+            self.dsn(), connect_timeout=DB_CONNECT_TIMEOUT, keepalives=1, keepalives_idle=30
+        )
+        elapsed = time.perf_counter() - start
+        _count_db("connects")
+        _count_db("connect_ms", elapsed * 1000)
+        print(f"[info] Connected to database in {elapsed * 1000:.0f} ms")
+        return conn
+
+    def discard(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except psycopg2.Error:
+                pass
+        self.conn = None
+
+    def healthy(self):
+        if self.conn is None or self.conn.closed:
+            return False
+        if time.time() - self.last_used < DB_HEALTH_CHECK_AFTER:
+            return True
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            self.conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            print(f"[warn] Database connection went stale, reconnecting: {e}")
+            _count_db("stale")
+            self.discard()
+            return False
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """A connection inside a transaction (committed on success, rolled back on error)."""
+        if not self.lock.acquire(blocking=False):
+            conn = self.connect()
+            try:
+                with conn:
+                    yield conn
+            finally:
+                conn.close()
+            return
+
+        try:
+            if self.healthy():
+                _count_db("reused")
+            else:
+                self.conn = self.connect()
+            conn = self.conn
+            try:
+                with conn:
+                    yield conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                self.discard()
+                raise
+            finally:
+                if conn.closed:
+                    self.conn = None
+                elif conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    self.discard()
+                self.last_used = time.time()
+        finally:
+            self.lock.release()
+
+
+_database = DatabaseConnection()
+
+
+def db_transaction():
+    return _database.transaction()
+
+
+def close_database():
+    """Close the kept-open connection, e.g. when a long-running worker stops."""
+    with _database.lock:
+        _database.discard()
+
 # ==================================
 # 🗄️ DATABASE
 # ==================================
-def get_products_from_db():
-    print("[info] Connecting to database...")
-    # NOTE: psycopg2 should be installed if running this locally: pip install psycopg2-binary
-    conn = psycopg2.connect(DATABASE_URL) 
-    cursor = conn.cursor()
-    # Ensure the query selects all necessary columns, including affiliate_link
-    cursor.execute("SELECT name, url, product_id, store_type, affiliate_link FROM products")
-    products = cursor.fetchall()
-    conn.close()
-
-    products_list = [
-        {
-            "name": row[0],
-            "url": row[1],
-            "productId": row[2],
-            "storeType": row[3],
-            "affiliateLink": row[4],
+class ProductRecord:
+    """
+    One product row. Slotted (no per-instance dict) since the whole catalog
+    is held in memory during a run; indexable like the dicts it replaced.
+    """
+
+    __slots__ = (
+        "name", "url", "productId", "storeType", "affiliateLink", "id",
+        "intervalSeconds", "failures", "unicorn",
+    )
+
+    def __init__(self, name, url, productId, storeType, affiliateLink=None, id=None,
+                 intervalSeconds=None, failures=None, unicorn=None):
+        self.name = name
+        self.url = url
+        self.productId = productId
+        self.storeType = storeType
+        self.affiliateLink = affiliateLink
+        self.id = id
+        self.intervalSeconds = intervalSeconds
+        self.failures = failures
+        self.unicorn = unicorn
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+    def keys(self):
+        return self.__slots__
+
+    def __repr__(self):
+        return f"ProductRecord({self.storeType}:{self.id} {self.name!r})"
+
+
+# Columns the loaders select, in ProductRecord order; the Unicorn option
+# IDs ride along for "unicorn" products. An "apple" product (the web app
+# saves apple.com links under its part number) that has a unicorn_variants
+# row is checked as that Unicorn variant.
+PRODUCT_COLUMNS = """
+    p.name, p.url, p.product_id,
+    CASE WHEN p.store_type = 'apple' AND u.product_id IS NOT NULL THEN 'unicorn' ELSE p.store_type END
+        AS store_type,
+    p.affiliate_link, p.id,
+    u.category_id, u.family_id, u.group_ids, u.color_option_id, u.storage_option_id
+"""
+PRODUCT_FETCH_SIZE = int(os.getenv("PRODUCT_FETCH_SIZE", "2000"))
+
+
+def _product_record(row, **extra):
+    unicorn = None
+    if row[6] is not None:
+        unicorn = {
+            "categoryId": row[6],
+            "familyId": row[7],
+            "groupIds": row[8],
+            "colorOptionId": row[9],
+            "storageOptionId": row[10],
         }
-        for row in products
-    ]
-    print(f"[info] Loaded {len(products_list)} products from database.")
+    return ProductRecord(*row[:6], unicorn=unicorn, **extra)
+
+
+def get_products_from_db():
+    """
+    Stream the catalog as ProductRecords, grouped by store, through a
+    server-side cursor PRODUCT_FETCH_SIZE rows at a time, so checking can
+    start on the first store while later rows are still arriving.
+    """
+    count = 0
+    with db_transaction() as conn, conn.cursor(name="products_stream") as cursor:
+        cursor.itersize = PRODUCT_FETCH_SIZE
+        cursor.execute(
+            f"""
+            SELECT {PRODUCT_COLUMNS}
+            FROM products p
+            LEFT JOIN unicorn_variants u ON u.product_id = p.id
+            ORDER BY store_type, p.id
+            """
+        )
+        for row in cursor:
+            count += 1
+            yield _product_record(row)
+    print(f"[info] Loaded {count} products from database.")
+
+
+def _schedule_new_products(cursor):
+    """Products without a schedule yet (just added) are due immediately."""
+    cursor.execute(
+        """
+        INSERT INTO product_schedule (product_id, next_check_at)
+        SELECT p.id, now() - interval '1 second' FROM products p
+        WHERE NOT EXISTS (SELECT 1 FROM product_schedule s WHERE s.product_id = p.id)
+        ON CONFLICT (product_id) DO NOTHING
+        """
+    )
+
+
+def get_due_products(limit):
+    """
+    Load up to `limit` products whose next check is due, most overdue first.
+    Products without a schedule yet (just added) are due immediately.
+    """
+    with db_transaction() as conn, conn.cursor() as cursor:
+        _schedule_new_products(cursor)
+        cursor.execute(
+            f"""
+            SELECT {PRODUCT_COLUMNS}, s.interval_seconds, s.failures
+            FROM product_schedule s
+            JOIN products p ON p.id = s.product_id
+            LEFT JOIN unicorn_variants u ON u.product_id = p.id
+            WHERE s.next_check_at <= now()
+            ORDER BY s.next_check_at
+            LIMIT %s
+            """,
+            (limit,),
+        )
+        products_list = [
+            _product_record(row[:11], intervalSeconds=row[11], failures=row[12])
+            for row in cursor.fetchall()
+        ]
+
+    print(f"[info] Loaded {len(products_list)} due products from database.")
     return products_list
 
+
+def get_products_changed_since(since=None):
+    """
+    Products whose row changed since the `since` watermark (every product
+    for None), each with its schedule, for a caller keeping the catalog in
+    memory (worker.py). Returns ([(ProductRecord, seconds until due)],
+    watermark for the next call).
+
+    Rows are re-read from a few seconds before the watermark: a write that
+    commits late can carry an updated_at older than rows already seen.
+    """
+    changed = " new or changed" if since else ""
+    with db_transaction() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT {PRODUCT_COLUMNS}, s.interval_seconds, s.failures,
+                   GREATEST(EXTRACT(EPOCH FROM s.next_check_at - now()), 0), p.updated_at
+            FROM products p
+            LEFT JOIN unicorn_variants u ON u.product_id = p.id
+            LEFT JOIN product_schedule s ON s.product_id = p.id
+            WHERE %(since)s::timestamp IS NULL OR p.updated_at >= %(since)s::timestamp - interval '10 seconds'
+            ORDER BY p.updated_at
+            """,
+            {"since": since},
+        )
+        products_list = []
+        for row in cursor:
+            products_list.append(
+                (_product_record(row[:11], intervalSeconds=row[11], failures=row[12]), float(row[13] or 0))
+            )
+            since = max(since, row[14]) if since else row[14]
+
+    print(f"[info] Loaded {len(products_list)}{changed} products from database.")
+    return products_list, since
+
+
+def get_product_ids():
+    """IDs of every product, to drop deleted ones from an in-memory catalog."""
+    with db_transaction() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT id FROM products")
+        return {row[0] for row in cursor.fetchall()}
+
+
+def save_schedule(rows):
+    """Bulk-upsert (product_id, interval_seconds, failures, changed) schedule rows."""
+    if not rows:
+        return
+    with db_transaction() as conn, conn.cursor() as cursor:
+        psycopg2.extras.execute_values(
+            cursor,
+            """
+            INSERT INTO product_schedule
+                (product_id, interval_seconds, failures, last_checked_at, next_check_at, last_changed_at)
+            SELECT v.product_id, v.interval_seconds, v.failures, now(),
+                   now() + v.interval_seconds * interval '1 second',
+                   CASE WHEN v.changed THEN now() END
+            FROM (VALUES %s) AS v (product_id, interval_seconds, failures, changed)
+            ON CONFLICT (product_id) DO UPDATE SET
+                interval_seconds = EXCLUDED.interval_seconds,
+                failures = EXCLUDED.failures,
+                last_checked_at = EXCLUDED.last_checked_at,
+                next_check_at = EXCLUDED.next_check_at,
+                last_changed_at = COALESCE(EXCLUDED.last_changed_at, product_schedule.last_changed_at)
+            """,
+            rows,
+            page_size=len(rows),
+        )
+
+
+def claim_due_products(limit, lease):
+    """
+    Lease up to `limit` due products, most overdue first: their next check
+    moves `lease` seconds ahead, and rows another shard is claiming right
+    now are skipped. Returns (products, {id: due_at}).
+    """
+    with db_transaction() as conn, conn.cursor() as cursor:
+        _schedule_new_products(cursor)
+        cursor.execute(
+            f"""
+            WITH claimed AS (
+                UPDATE product_schedule s
+                SET next_check_at = now() + %s * interval '1 second'
+                FROM (
+                    SELECT product_id, next_check_at FROM product_schedule
+                    WHERE next_check_at <= now()
+                    ORDER BY next_check_at
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                ) d
+                WHERE s.product_id = d.product_id
+                RETURNING s.product_id, s.interval_seconds, s.failures, d.next_check_at AS due_at
+            )
+            SELECT {PRODUCT_COLUMNS}, c.interval_seconds, c.failures, c.due_at
+            FROM claimed c
+            JOIN products p ON p.id = c.product_id
+            LEFT JOIN unicorn_variants u ON u.product_id = p.id
+            ORDER BY c.due_at
+            """,
+            (lease, limit),
+        )
+        rows = cursor.fetchall()
+    products = [_product_record(row[:11], intervalSeconds=row[11], failures=row[12]) for row in rows]
+    return products, {row[5]: row[13] for row in rows}
+
+
+def release_products(rows):
+    """Hand leased (product_id, due_at) rows back to the queue, due as before."""
+    if not rows:
+        return
+    with db_transaction() as conn, conn.cursor() as cursor:
+        psycopg2.extras.execute_values(
+            cursor,
+            """
+            UPDATE product_schedule AS s SET next_check_at = v.due_at
+            FROM (VALUES %s) AS v (product_id, due_at)
+            WHERE s.product_id = v.product_id
+            """,
+            rows,
+        )
+
+
+def start_shard_run(run_id, shards):
+    with db_transaction() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO shard_runs (run_id, shards) VALUES (%s, %s) ON CONFLICT (run_id) DO NOTHING",
+            (run_id, shards),
+        )
+
+
+def save_shard_result(run_id, started_at, stats, alerts):
+    with db_transaction() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO shard_results (run_id, started_at, stats, alerts) VALUES (%s, %s, %s, %s)",
+            (run_id, started_at, psycopg2.extras.Json(stats), psycopg2.extras.Json(list(alerts))),
+        )
+
+
+def finish_shard_runs(run_id):
+    """
+    Mark finished runs as aggregated and return them as (run_id, alerts,
+    merged stats): `run_id` once all its shards have reported, and any run
+    still waiting on shards SHARD_LEASE seconds after it started (those
+    shards crashed or timed out). The row lock makes exactly one caller
+    aggregate each run.
+    """
+    with db_transaction() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE shard_runs r SET aggregated_at = now()
+            WHERE r.aggregated_at IS NULL AND (
+                (r.run_id = %s AND (SELECT count(*) FROM shard_results s WHERE s.run_id = r.run_id) >= r.shards)
+                OR r.started_at < now() - %s * interval '1 second'
+            )
+            RETURNING r.run_id, r.shards
+            """,
+            (run_id, SHARD_LEASE),
+        )
+        runs = dict(cursor.fetchall())
+        if not runs:
+            return []
+        cursor.execute(
+            "SELECT run_id, stats, alerts FROM shard_results WHERE run_id = ANY(%s) ORDER BY started_at, id",
+            (list(runs),),
+        )
+        results = {}
+        for result_run, stats, alerts in cursor.fetchall():
+            results.setdefault(result_run, []).append((stats, alerts))
+    return [
+        (finished, [alert for _, alerts in results[finished] for alert in alerts],
+         merge_shard_stats([stats for stats, _ in results[finished]], shards))
+        for finished, shards in runs.items()
+        if finished in results
+    ]
+
+
+def load_pincode_history(product_ids=None):
+    """
+    Per-pincode history from stock_state: the product rows (with whether
+    each is younger than PINCODE_NEGATIVE_TTL) and each store's hit rate.
+    Without `product_ids`, rows for every product are loaded.
+    """
+    with db_transaction() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT product_id, pincode, in_stock, checked_at >= now() - %s * interval '1 second'
+            FROM stock_state
+            {"" if product_ids is None else "WHERE product_id = ANY(%s)"}
+            ORDER BY checked_at
+            """,
+            (PINCODE_NEGATIVE_TTL,) + (() if product_ids is None else (list(product_ids),)),
+        )
+        rows = cursor.fetchall()
+        cursor.execute(
+            """
+            SELECT p.store_type, s.pincode, avg(s.in_stock::int)::float
+            FROM stock_state s
+            JOIN products p ON p.id = s.product_id
+            WHERE s.pincode <> ''
+            GROUP BY p.store_type, s.pincode
+            """
+        )
+        hit_rates = cursor.fetchall()
+    return PincodeHistory(rows, hit_rates)
+
+
+def load_store_health():
+    with db_transaction() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT store, state, failures, open_until, rate FROM store_health")
+        return cursor.fetchall()
+
+
+def save_store_health(rows):
+    """Upsert (store, state, failures, open_until, rate) rows into store_health."""
+    if not rows:
+        return
+    with db_transaction() as conn, conn.cursor() as cursor:
+        psycopg2.extras.execute_values(
+            cursor,
+            """
+            INSERT INTO store_health (store, state, failures, open_until, rate, updated_at)
+            VALUES %s
+            ON CONFLICT (store) DO UPDATE SET
+                state = EXCLUDED.state,
+                failures = EXCLUDED.failures,
+                open_until = EXCLUDED.open_until,
+                rate = EXCLUDED.rate,
+                updated_at = EXCLUDED.updated_at
+            """,
+            rows,
+            template="(%s, %s, %s, %s, %s, now())",
+        )
+
+
+def save_run_metrics(started_at, duration, products, found, alerts, skipped, metrics):
+    """Store one row per run in check_runs, with the per-store metrics as JSON."""
+    with db_transaction() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO check_runs (started_at, duration_ms, products, found, alerts, skipped, metrics)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """,
+            (started_at, int(duration * 1000), products, found, alerts, skipped, psycopg2.extras.Json(metrics)),
+        )
+
+
+def sync_stock_state(rows):
+    """
+    Upsert (product_id, pincode, in_stock, price, checked_at) rows into
+    stock_state in one statement and return the state they replaced, as
+    {product_id: [(pincode, in_stock, price), ...]}.
+    """
+    if not rows:
+        return {}
+    with db_transaction() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT product_id, pincode, in_stock, price FROM stock_state WHERE product_id = ANY(%s)",
+            (list({row[0] for row in rows}),),
+        )
+        previous = {}
+        for product_id, pincode, in_stock, price in cursor.fetchall():
+            previous.setdefault(product_id, []).append((pincode, in_stock, price))
+        _upsert_stock_state(cursor, rows)
+    return previous
+
+
+def save_stock_state(rows):
+    """Upsert stock_state rows without reading back what they replace (see RunState)."""
+    if not rows:
+        return
+    with db_transaction() as conn, conn.cursor() as cursor:
+        _upsert_stock_state(cursor, rows)
+
+
+def _upsert_stock_state(cursor, rows):
+    psycopg2.extras.execute_values(
+        cursor,
+        """
+        INSERT INTO stock_state (product_id, pincode, in_stock, price, checked_at)
+        VALUES %s
+        ON CONFLICT (product_id, pincode) DO UPDATE SET
+            in_stock = EXCLUDED.in_stock,
+            price = COALESCE(EXCLUDED.price, stock_state.price),
+            checked_at = EXCLUDED.checked_at
+        """,
+        rows,
+        page_size=len(rows),
+    )
+
+
+def load_stock_state():
+    """
+    Every stock_state row as (product_id, store_type, pincode, in_stock,
+    price, age in seconds).
+    """
+    with db_transaction() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT s.product_id, p.store_type, s.pincode, s.in_stock, s.price,
+                   extract(epoch FROM now() - s.checked_at)::float
+            FROM stock_state s
+            JOIN products p ON p.id = s.product_id
+            """
+        )
+        return cursor.fetchall()
+
+
+def add_to_outbox(messages):
+    """
+    Queue (chat_id, text, attempts, retry_in, error) messages that couldn't
+    be sent in telegram_outbox, in order, due again in `retry_in` seconds.
+    """
+    if not messages:
+        return
+    with db_transaction() as conn, conn.cursor() as cursor:
+        psycopg2.extras.execute_values(
+            cursor,
+            """
+            INSERT INTO telegram_outbox (chat_id, text, attempts, next_attempt_at, last_error)
+            VALUES %s
+            """,
+            messages,
+            template="(%s, %s, %s, now() + %s * interval '1 second', %s)",
+        )
+
+
+def claim_outbox(lease):
+    """
+    Drop expired messages, then claim the due ones for `lease` seconds (so
+    an overlapping invocation skips them) and return them oldest first, as
+    (id, chat_id, text, attempts).
+    """
+    with db_transaction() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM telegram_outbox WHERE created_at < now() - %s * interval '1 second'",
+            (TELEGRAM_OUTBOX_TTL,),
+        )
+        if cursor.rowcount:
+            print(f"[warn] Dropped {cursor.rowcount} Telegram messages older than {TELEGRAM_OUTBOX_TTL}s")
+        cursor.execute(
+            """
+            UPDATE telegram_outbox SET next_attempt_at = now() + %s * interval '1 second'
+            WHERE id IN (
+                SELECT id FROM telegram_outbox WHERE next_attempt_at <= now()
+                ORDER BY id FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, chat_id, text, attempts
+            """,
+            (lease,),
+        )
+        return sorted(cursor.fetchall())
+
+
+def settle_outbox(done, retries):
+    """Delete delivered (or given up) message ids; reschedule (id, attempts, retry_in, error) retries."""
+    if not done and not retries:
+        return
+    with db_transaction() as conn, conn.cursor() as cursor:
+        if done:
+            cursor.execute("DELETE FROM telegram_outbox WHERE id = ANY(%s)", (done,))
+        if retries:
+            psycopg2.extras.execute_values(
+                cursor,
+                """
+                UPDATE telegram_outbox AS o SET
+                    attempts = v.attempts,
+                    next_attempt_at = now() + v.retry_in * interval '1 second',
+                    last_error = v.error
+                FROM (VALUES %s) AS v (id, attempts, retry_in, error)
+                WHERE o.id = v.id
+                """,
+                retries,
+            )
+
 # ==================================
 # 💬 TELEGRAM MESSAGE
 # ==================================
-def send_telegram_message(message):
+# Telegram's cap on a message's text, counted in UTF-16 code units
+TELEGRAM_MAX_LENGTH = 4096
+
+
+def _telegram_length(text):
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _pack(pieces, separator, limit):
+    """Join consecutive pieces with `separator` while they fit in `limit`."""
+    packed = []
+    for piece in pieces:
+        if packed and _telegram_length(packed[-1] + separator + piece) <= limit:
+            packed[-1] += separator + piece
+        else:
+            packed.append(piece)
+    return packed
+
+
+def _hard_split(text, limit):
+    chunk, size = [], 0
+    for char in text:
+        width = 2 if ord(char) > 0xFFFF else 1
+        if size + width > limit:
+            yield "".join(chunk)
+            chunk, size = [], 0
+        chunk.append(char)
+        size += width
+    if chunk:
+        yield "".join(chunk)
+
+
+def split_telegram_message(text, limit=TELEGRAM_MAX_LENGTH):
+    """
+    Split `text` into messages Telegram accepts, breaking between
+    paragraphs (one alert each), then between lines, so an alert and its
+    Markdown stay whole unless a single line is over the limit.
+    """
+    pieces = []
+    for paragraph in text.split("\n\n"):
+        if _telegram_length(paragraph) <= limit:
+            pieces.append(paragraph)
+            continue
+        for line in _pack(paragraph.split("\n"), "\n", limit):
+            pieces.extend(_hard_split(line, limit) if _telegram_length(line) > limit else [line])
+    return _pack(pieces, "\n\n", limit)
+
+
+class TelegramDelivery:
+    """
+    Sends queued messages over one kept-alive session, at most one every
+    TELEGRAM_SEND_INTERVAL seconds, waiting out 429s (retry_after) while the
+    delivery budget allows. New messages wait in memory; the ones that
+    can't be sent go to telegram_outbox for a later delivery to retry (or
+    stay in memory if the database is unavailable).
+    """
+
+    def __init__(self):
+        self.session = None
+        self.last_sent = 0.0
+        self.pending = []  # (chat_id, text) not yet tried or not in telegram_outbox
+        self.lock = threading.Lock()
+
+    def get_session(self):
+        if self.session is None:
+            load_http()
+            self.session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=1,
+                max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=HTTP_BACKOFF),
+            )
+            self.session.mount("https://", adapter)
+        return self.session
+
+    def send(self, chat_id, text, deadline):
+        """
+        Send one message. Returns None once delivered, else (error, seconds
+        before it's worth retrying, whether to stop sending the rest).
+        """
+        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+        payload = {"chat_id": chat_id, "text": text, "parse_mode": "Markdown", "disable_web_page_preview": True}
+        while True:
+            wait = self.last_sent + TELEGRAM_SEND_INTERVAL - time.time()
+            if time.time() + max(wait, 0) > deadline:
+                return "out of time", 0, True
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                res = self.get_session().post(url, json=payload, timeout=max(0.5, min(10, deadline - time.time())))
+            except requests.RequestException as e:
+                return str(e), 30, True
+            self.last_sent = time.time()
+            if res.status_code == 200:
+                return None
+            try:
+                body = res.json()
+            except ValueError:
+                body = {}
+            description = body.get("description") or res.text[:200]
+            if res.status_code == 429:
+                retry_after = (body.get("parameters") or {}).get("retry_after") or 5
+                if time.time() + retry_after > deadline:
+                    return description, retry_after, True
+                print(f"[warn] Telegram rate limited, retrying in {retry_after}s")
+                time.sleep(retry_after)
+                continue
+            if res.status_code == 400 and "parse_mode" in payload and "entities" in description:
+                # Markdown broken (e.g. by a hard split); send it as plain text
+                del payload["parse_mode"]
+                continue
+            # A 400 is about this message; anything else (bad token, bot removed) about all of them
+            return description, 60, res.status_code != 400
+
+    def deliver(self, budget=TELEGRAM_DELIVERY_BUDGET):
+        """Send the retries due in telegram_outbox, then the new messages held in memory."""
+        if not TELEGRAM_BOT_TOKEN:
+            print("[warn] Missing Telegram config.")
+            return
+        with self.lock:
+            deadline = time.time() + budget
+            try:
+                queued = claim_outbox(int(budget * 2) + 30)
+            except Exception as e:
+                print(f"[warn] Telegram outbox unavailable: {e}")
+                queued = []
+            pending, self.pending = self.pending, []
+            messages = queued + [(None, chat_id, text, 0) for chat_id, text in pending]
+
+            done, retries, held = [], [], []
+            sent = 0
+            stopped = False
+            for message_id, chat_id, text, attempts in messages:
+                error, retry_in, tried = "out of time", 0, False
+                if not stopped:
+                    outcome = self.send(chat_id, text, deadline)
+                    if outcome is None:
+                        done.append(message_id)
+                        sent += 1
+                        continue
+                    error, retry_in, stopped = outcome
+                    tried = error != "out of time"
+                if message_id is None:
+                    held.append((chat_id, text, int(tried), retry_in, error))
+                elif attempts + tried >= TELEGRAM_MAX_ATTEMPTS:
+                    print(f"[error] Dropping Telegram message {message_id} after {attempts + tried} attempts: {error}")
+                    done.append(message_id)
+                else:
+                    retries.append((message_id, attempts + tried, retry_in, error))
+
+            if messages:
+                print(f"[info] ✅ Telegram: {sent} of {len(messages)} messages delivered")
+            try:
+                settle_outbox([i for i in done if i is not None], retries)
+                if held:
+                    add_to_outbox(held)
+            except Exception as e:
+                print(f"[warn] Could not update the Telegram outbox: {e}")
+                self.pending.extend((chat_id, text) for chat_id, text, *_ in held)
+
+
+_telegram = TelegramDelivery()
+
+
+def queue_telegram_message(message):
+    """
+    Split `message` for Telegram and queue the parts for the next
+    deliver_telegram_messages(), which moves any it can't send to the outbox.
+    """
     if not TELEGRAM_BOT_TOKEN or not TELEGRAM_GROUP_ID:
         print("[warn] Missing Telegram config.")
+        return 0
+    parts = [(TELEGRAM_GROUP_ID, part) for part in split_telegram_message(message)]
+    with _telegram.lock:
+        _telegram.pending.extend(parts)
+    return len(parts)
+
+
+def queue_stock_alert(alerts, summary):
+    """Queue the "Stock Alert" message for a run's alerts, if it has any."""
+    if not alerts:
         return
+    final_message = (
+        "🔥 *Stock Alert!*\n\n"
+        + "\n\n".join(alerts)
+        + "\n\n"
+        + summary
+    )
+    parts = queue_telegram_message(final_message)
+    print(f"[info] ✅ Telegram alert queued with newly available products ({parts} messages).")
 
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    payload = {
-        "chat_id": TELEGRAM_GROUP_ID,
-        "text": message,
-        "parse_mode": "Markdown",
-        "disable_web_page_preview": True,
-    }
 
+def deliver_telegram_messages(budget=TELEGRAM_DELIVERY_BUDGET):
+    _telegram.deliver(budget)
+
+# ==================================
+# ✅ CHECK RESULTS
+# ==================================
+# First amount in a price text; a price node may also hold the struck-out MRP
+_PRICE_AMOUNT = re.compile(r"\d[\d,]*(?:\.\d+)?")
+# Anything outside this is a misparse, not a phone's price
+_PRICE_RANGE = (Decimal("1"), Decimal("10000000"))
+
+
+def _parse_price(value):
+    """'₹1,29,900.00' / 129900 / None -> Decimal('129900.00') / None; only the first amount counts"""
+    if value is None:
+        return None
+    match = _PRICE_AMOUNT.search(str(value))
+    if not match:
+        return None
     try:
-        res = requests.post(url, json=payload, timeout=10)
-        if res.status_code == 200:
-            print(f"[info] ✅ Message sent to group {TELEGRAM_GROUP_ID}")
-        else:
-            print(f"[warn] Telegram send failed: {res.text}")
-    except Exception as e:
-        print(f"[error] Telegram error: {e}")
+        price = Decimal(match.group().replace(",", ""))
+    except InvalidOperation:
+        return None
+    return price if _PRICE_RANGE[0] <= price < _PRICE_RANGE[1] else None
+
+
+class StockHit(str):
+    """A checker's in-stock alert message, carrying the price it quotes."""
+
+    def __new__(cls, message, price=None):
+        hit = super().__new__(cls, message)
+        hit.price = _parse_price(price)
+        return hit
+
+
+# The ProductCheck a worker thread is currently running a checker for
+_check_context = threading.local()
+
+
+def record_failure(error):
+    """
+    Checkers call this from their error branches, so the engine can tell
+    "couldn't check" apart from "out of stock".
+    """
+    check = getattr(_check_context, "check", None)
+    if check is not None:
+        with check.lock:
+            if not check.frozen:
+                check.failures += 1
+    call = current_call()
+    if call is not None:
+        call["error"] = str(error)[:200]
 
 # ==================================
-# 🦄 UNICORN CHECKER (iPhone 17, 256GB)
+# ⏱️ INSTRUMENTATION
 # ==================================
-def check_unicorn():
-    """Checks stock for all iPhone 17 (256GB) variants at Unicorn Store."""
-    
-    # --- API CONFIG ---
-    BASE_URL = "https://fe01.beamcommerce.in/get_product_by_option_id"
-    HEADERS = {
-        "accept": "application/json, text/plain, */*",
-        "content-type": "application/json",
-        "customer-id": "unicorn",
-        "origin": "https://shop.unicornstore.in",
-        "referer": "https://shop.unicornstore.in/",
+# One record per checker call (a product at a pincode, or one batch request).
+# Timings are seconds, summed over the HTTP requests the call made:
+# connect = DNS + TCP, tls = handshake, ttfb = request sent -> headers,
+# download = reading the body, parse = HTML extraction, backoff = sleeping
+# between retries.
+CALL_RECORDS = []
+_PHASES = ("total", "connect", "tls", "ttfb", "download", "parse", "backoff")
+_records_lock = threading.Lock()
+_records_run = 0  # bumped by reset_call_records; calls from an earlier run aren't recorded
+
+
+def start_call(store, pincode=None, products=1):
+    call = {
+        "store": store,
+        "pincode": pincode,
+        "products": products,
+        "started": time.perf_counter(),
+        "connect": 0.0, "tls": 0.0, "ttfb": 0.0, "download": 0.0, "parse": 0.0, "backoff": 0.0,
+        "bytes": 0,
+        "calls": 0,  # requests the checker made
+        "requests": 0,  # requests actually sent, counting retries
+        "shared": 0,  # answered by an identical request (in flight or cached)
+        "status": [],
+        "error": None,
+        "run": _records_run,
     }
-    
-    # Fixed product attributes for iPhone 17 (Category 456)
-    CATEGORY_ID = "456" 
-    FAMILY_ID = "94"
-    GROUP_IDS = "57,58"
-    STORAGE_256GB_ID = "250" # 256GB Option ID 
-
-    # Color variants to check (ID 57)
-    COLOR_VARIANTS = {
-        "Lavender": "313",
-        "Sage": "311",
-        "Mist Blue": "312",
-        "White": "314",
-        "Black": "315",
-    }
-    
-    available_messages = []
-    
-    for color_name, color_id in COLOR_VARIANTS.items():
-        variant_name = f"iPhone 17 {color_name} 256GB"
-        
-        payload = {
-            "category_id": CATEGORY_ID,
-            "family_id": FAMILY_ID,
-            "group_ids": GROUP_IDS,
-            "option_ids": f"{color_id},{STORAGE_256GB_ID}"
+    _check_context.call = call
+    return call
+
+
+def finish_call(call, allowed=True):
+    """
+    Close a call record and tell the store's breaker how it went. Only calls
+    the breaker `allowed` and that sent a request of their own count as a
+    success; answers shared with another caller, and follow-up calls such
+    as building an alert message, only ever count as failures.
+    """
+    _check_context.call = None
+    call["total"] = time.perf_counter() - call.pop("started")
+    call["retries"] = max(0, call["requests"] - call["calls"])
+    failed = bool(call["error"]) or bool(call["status"] and (call["status"][-1] == 429 or call["status"][-1] >= 500))
+    breaker = get_breaker(call["store"])
+    if failed:
+        breaker.record(True)
+    elif allowed and call["requests"]:
+        breaker.record(False)
+    elif allowed:
+        breaker.release()
+    with _records_lock:
+        # A straggler left running past an earlier run's deadline
+        if call.pop("run") == _records_run:
+            CALL_RECORDS.append(call)
+
+
+def current_call():
+    return getattr(_check_context, "call", None)
+
+
+def add_call_timing(key, amount):
+    call = current_call()
+    if call is not None:
+        call[key] += amount
+
+
+def reset_call_records():
+    global _records_run
+    with _records_lock:
+        _records_run += 1
+        CALL_RECORDS.clear()
+
+
+def _percentiles(values):
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "max": 0.0}
+    ordered = sorted(values)
+
+    def rank(pct):
+        return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+    return {"p50": round(rank(50) * 1000, 1), "p95": round(rank(95) * 1000, 1), "max": round(ordered[-1] * 1000, 1)}
+
+
+def metrics_summary(records):
+    """Per-store aggregates of the call records; latencies in ms."""
+    by_store = {}
+    for record in records:
+        by_store.setdefault(record["store"], []).append(record)
+
+    summary = {}
+    for store, calls in sorted(by_store.items()):
+        statuses = {}
+        for call in calls:
+            for status in call["status"]:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+        summary[store] = {
+            "content": store_config(store).content,
+            "calls": len(calls),
+            "errors": sum(1 for call in calls if call["error"]),
+            "requests": sum(call["requests"] for call in calls),
+            "retries": sum(call["retries"] for call in calls),
+            "shared": sum(call["shared"] for call in calls),
+            "bytes": sum(call["bytes"] for call in calls),
+            "status": statuses,
+            **{
+                f"{phase}_ms": _percentiles([call[phase] for call in calls])
+                for phase in _PHASES
+            },
         }
+    return summary
 
-        try:
-            res = requests.post(BASE_URL, headers=HEADERS, json=payload, timeout=10)
-            res.raise_for_status()
-            data = res.json()
-            
-            product_data = data.get("data", {}).get("product", {})
-            quantity = product_data.get("quantity", 0)
-            
-            # Format price and SKU
-            price = f"₹{int(product_data.get('price', 0)):,}" if product_data.get('price') else "N/A"
-            sku = product_data.get("sku", "N/A")
-            
-            # Use the main product page URL for linking
-            product_url = "https://shop.unicornstore.in/iphone-17" 
-            
-            if int(quantity) > 0:
-                print(f"[UNICORN] ✅ {variant_name} is IN STOCK ({quantity} units)")
-                message = (
-                    f"✅ *Unicorn*\n"
-                    f"[{variant_name} - {sku}]({product_url})"
-                    f"\n💰 Price: {price}, Qty: {quantity}"
-                )
-                available_messages.append(message)
-            else:
-                dispatch_note = product_data.get("custom_column_4", "Out of Stock").strip()
-                print(f"[UNICORN] ❌ {variant_name} unavailable: {dispatch_note}")
-                
-        except Exception as e:
-            print(f"[error] Unicorn check failed for {variant_name}: {e}")
-    
-    return available_messages
+
+def call_details(records):
+    """The raw call records, rounded for the ?metrics=1 response."""
+    return [
+        {
+            key: round(value * 1000, 1) if key in _PHASES else value
+            for key, value in record.items()
+        }
+        for record in records
+    ]
 
 # ==================================
-# 🛒 CROMA CHECKER
+# 🦄 UNICORN CHECKER
 # ==================================
-def check_croma(product, pincode):
-    url = "https://api.croma.com/inventory/oms/v2/tms/details-pwa/"
+UNICORN_OPTION_URL = "https://fe01.beamcommerce.in/get_product_by_option_id"
+
+
+def check_unicorn(product):
+    """
+    Check one Unicorn Store variant (a colour x storage combination). Its
+    option IDs come from the unicorn_variants table, loaded with the product.
+    """
+    name = product["name"]
+    options = product.get("unicorn")
+    if not options:
+        print(f"[UNICORN] ⚠️ No option IDs for {name}; add a unicorn_variants row.")
+        return None
+
     payload = {
+        "category_id": options["categoryId"],
+        "family_id": options["familyId"],
+        "group_ids": options["groupIds"],
+        "option_ids": f"{options['colorOptionId']},{options['storageOptionId']}",
+    }
+
+    try:
+        res = get_session("unicorn").post(UNICORN_OPTION_URL, json=payload)
+        res.raise_for_status()
+        product_data = res.json().get("data", {}).get("product", {})
+        quantity = product_data.get("quantity", 0)
+
+        # Format price and SKU
+        price = f"₹{int(product_data.get('price', 0)):,}" if product_data.get('price') else "N/A"
+        sku = product_data.get("sku", "N/A")
+
+        if int(quantity) > 0:
+            print(f"[UNICORN] ✅ {name} is IN STOCK ({quantity} units)")
+            return StockHit(
+                f"✅ *Unicorn*\n"
+                f"[{name} - {sku}]({product['affiliateLink'] or product['url']})"
+                f"\n💰 Price: {price}, Qty: {quantity}",
+                product_data.get("price"),
+            )
+
+        dispatch_note = (product_data.get("custom_column_4") or "Out of Stock").strip()
+        print(f"[UNICORN] ❌ {name} unavailable: {dispatch_note}")
+    except Exception as e:
+        print(f"[error] Unicorn check failed for {name}: {e}")
+        record_failure(e)
+    return None
+
+# ==================================
+# 🛒 CROMA CHECKER
+# ==================================
+CROMA_PROMISE_URL = "https://api.croma.com/inventory/oms/v2/tms/details-pwa/"
+CROMA_BATCH_SIZE = int(os.getenv("CROMA_BATCH_SIZE", "20"))
+
+
+def _croma_promise_payload(item_ids, pincode):
+    """One promise line per item, lineId "1", "2", ... in order."""
+    return {
         "promise": {
             "allocationRuleID": "SYSTEM",
             "checkInventory": "Y",
@@ -207,26 +1897,26 @@ def check_croma(product, pincode):
                 "promiseLine": [
                     {
                         "fulfillmentType": "HDEL",
-                        "itemID": product["productId"],
-                        "lineId": "1",
+                        "itemID": item_id,
+                        "lineId": str(line),
                         "requiredQty": "1",
                         "shipToAddress": {"zipCode": pincode},
                         "extn": {"widerStoreFlag": "N"},
                     }
+                    for line, item_id in enumerate(item_ids, 1)
                 ]
             },
         }
     }
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "oms-apim-subscription-key": "1131858141634e2abe2efb2b3a2a2a5d",
-        "origin": "https://www.croma.com",
-        "referer": "https://www.croma.com/",
-    }
 
+
+def _croma_in_stock_message(product, fetch=True):
+    return StockHit(f"✅ *Croma*\n[{product['name']}]({product['affiliateLink'] or product['url']})")
+
+
+def check_croma(product, pincode):
     try:
-        res = requests.post(url, headers=headers, json=payload, timeout=10)
+        res = get_session("croma").post(CROMA_PROMISE_URL, json=_croma_promise_payload([product["productId"]], pincode))
         data = res.json()
 
         lines = (
@@ -239,37 +1929,125 @@ def check_croma(product, pincode):
 
         if lines:
             print(f"[CROMA] ✅ {product['name']} deliverable to {pincode}")
-            return f"✅ *Croma*\n[{product['name']}]({product['affiliateLink'] or product['url']})"
+            return _croma_in_stock_message(product)
 
         print(f"[CROMA] ❌ {product['name']} unavailable at {pincode}")
     except Exception as e:
         print(f"[error] Croma check failed for {product['name']}: {e}")
+        record_failure(e)
     return None
 
+
+def check_croma_batch(products, pincode):
+    """
+    Check up to CROMA_BATCH_SIZE products in one promise call, one line per
+    item. Deliverable lines come back under suggestedOption.option and are
+    matched to items by lineId (or itemID). Returns {itemID: in_stock}, or
+    None if the call failed or the response wasn't recognised. When the
+    response lists unavailable lines, items it mentions nowhere are left
+    out, to be re-checked individually.
+    """
+    item_ids = list(dict.fromkeys(str(p["productId"]) for p in products if p["productId"]))
+    if not item_ids:
+        return {}
+
+    print(f"[CROMA] Checking stock: {len(item_ids)} items for Pincode {pincode}")
+
+    try:
+        res = get_session("croma").post(CROMA_PROMISE_URL, json=_croma_promise_payload(item_ids, pincode))
+        if res.status_code != 200:
+            print(f"[CROMA] ⚠️ Batch request failed ({res.status_code}) at {pincode}, falling back to per-item checks")
+            return None
+        suggested = res.json().get("promise", {}).get("suggestedOption")
+        if not isinstance(suggested, dict):
+            print(f"[CROMA] ⚠️ Unrecognised batch response at {pincode}, falling back to per-item checks")
+            return None
+
+        def line_items(lines):
+            lines = lines or []
+            if isinstance(lines, dict):
+                lines = [lines]
+            found = set()
+            for line in lines:
+                if not isinstance(line, dict):
+                    raise ValueError(f"unexpected promise line {line!r}")
+                line_id = str(line.get("lineId") or "")
+                if line_id.isdigit() and 0 < int(line_id) <= len(item_ids):
+                    found.add(item_ids[int(line_id) - 1])
+                elif str(line.get("itemID")) in item_ids:
+                    found.add(str(line.get("itemID")))
+            return found
+
+        available = line_items((suggested.get("option") or {}).get("promiseLines", {}).get("promiseLine"))
+        unavailable_lines = suggested.get("unavailableLines")
+        if unavailable_lines is None:
+            # Like the single-item check: a line that isn't deliverable is left out
+            statuses = {item_id: item_id in available for item_id in item_ids}
+        else:
+            unavailable = line_items(unavailable_lines.get("unavailableLine"))
+            statuses = {item_id: item_id in available for item_id in available | unavailable}
+
+        for product in products:
+            in_stock = statuses.get(str(product["productId"]))
+            if in_stock is True:
+                print(f"[CROMA] ✅ {product['name']} deliverable to {pincode}")
+            elif in_stock is False:
+                print(f"[CROMA] ❌ {product['name']} unavailable at {pincode}")
+        return statuses
+
+    except Exception as e:
+        print(f"[error] Croma batch check failed at {pincode}: {e}")
+        record_failure(e)
+        return None
+
 # ==================================
 # 🟣 FLIPKART VIA PROXY
 # ==================================
+# Price the batched proxy reported per productId this run, for the alert
+FLIPKART_PRICES = {}
+# Whether the proxy speaks the batch protocol: None until a probe tells,
+# and no probe before `probe_at` (epoch seconds)
+_flipkart_proxy = {"batch": None, "probe_at": 0.0}
+
+
+def _flipkart_listing(data, product_id):
+    return data.get("RESPONSE", {}).get(product_id, {}).get("listingSummary", {})
+
+
+def _flipkart_price(listing):
+    return listing.get("pricing", {}).get("finalPrice", {}).get("decimalValue", None)
+
+
+def _flipkart_in_stock_message(product, fetch=True):
+    price = FLIPKART_PRICES.get(str(product["productId"]))
+    return StockHit(
+        f"✅ *Flipkart*\n[{product['name']}]({product['affiliateLink'] or product['url']})"
+        + (f"\n💰 Price: ₹{price}" if price else ""),
+        price,
+    )
+
+
 def check_flipkart(product, pincode="132001"):
     """Call Flipkart via AlwaysData proxy."""
     try:
         payload = {"productId": product["productId"], "pincode": pincode}
-        res = requests.post(FLIPKART_PROXY_URL, json=payload, timeout=25)
+        res = get_session("flipkart").post(FLIPKART_PROXY_URL, json=payload)
 
         if res.status_code != 200:
             print(f"[FLIPKART] ⚠️ Proxy failed ({res.status_code}) for {product['name']}")
+            record_failure(f"HTTP {res.status_code}")
             return None
 
-        data = res.json()
-        response = data.get("RESPONSE", {}).get(product["productId"], {})
-        listing = response.get("listingSummary", {})
+        listing = _flipkart_listing(res.json(), product["productId"])
         available = listing.get("available", False)
 
         if available:
-            price = listing.get("pricing", {}).get("finalPrice", {}).get("decimalValue", None)
+            price = _flipkart_price(listing)
             print(f"[FLIPKART] ✅ {product['name']} deliverable to {pincode}")
-            return (
+            return StockHit(
                 f"✅ *Flipkart*\n[{product['name']}]({product['affiliateLink'] or product['url']})"
-                + (f"\n💰 Price: ₹{price}" if price else "")
+                + (f"\n💰 Price: ₹{price}" if price else ""),
+                price,
             )
 
         print(f"[FLIPKART] ❌ {product['name']} not deliverable at {pincode}")
@@ -277,8 +2055,477 @@ def check_flipkart(product, pincode="132001"):
 
     except Exception as e:
         print(f"[error] Flipkart proxy check failed for {product['name']}: {e}")
+        record_failure(e)
+        return None
+
+
+def check_flipkart_batch(products, pincode):
+    """
+    Check up to FLIPKART_BATCH_SIZE products in one proxy call, posting
+    {"productIds": [...], "pincode": ...} and reading every entry of the
+    RESPONSE map it returns. Returns {productId: in_stock} for the products
+    the response covered, or None if the call failed.
+
+    Until a batch has succeeded, calls are probes, sent without retries. A
+    4xx, or a 200 without a RESPONSE map, means the proxy doesn't support
+    batches, and later ones go straight to per-product checks. A 5xx or a
+    network error doesn't tell (flipkart_proxy.py answers 502 for any
+    upstream error): batches wait FLIPKART_PROBE_COOLDOWN seconds, then
+    probe again.
+    """
+    probing = _flipkart_proxy["batch"] is None
+    if _flipkart_proxy["batch"] is False or (probing and time.time() < _flipkart_proxy["probe_at"]):
+        return None
+    product_ids = list(dict.fromkeys(str(p["productId"]) for p in products if p["productId"]))
+    if not product_ids:
+        return {}
+
+    print(f"[FLIPKART] Checking stock: {len(product_ids)} products for Pincode {pincode}")
+
+    try:
+        res = get_session("flipkart", retries=not probing).post(
+            FLIPKART_PROXY_URL, json={"productIds": product_ids, "pincode": pincode}
+        )
+        data = None
+        if res.status_code == 200:
+            try:
+                data = res.json()
+            except ValueError:
+                pass
+        if not isinstance(data, dict) or not isinstance(data.get("RESPONSE"), dict):
+            if probing and res.status_code >= 500:
+                print(f"[FLIPKART] ⚠️ Batch probe failed (HTTP {res.status_code}), checking products one by one for now")
+                _flipkart_proxy["probe_at"] = time.time() + FLIPKART_PROBE_COOLDOWN
+            elif probing:
+                print(f"[FLIPKART] ⚠️ Proxy doesn't support batches (HTTP {res.status_code}), checking products one by one")
+                _flipkart_proxy["batch"] = False
+            else:
+                print(f"[FLIPKART] ⚠️ Batch proxy call failed ({res.status_code}) at {pincode}, falling back to per-product checks")
+            return None
+        _flipkart_proxy["batch"] = True
+
+        statuses = {}
+        for product_id in product_ids:
+            if not isinstance(data["RESPONSE"].get(product_id), dict):
+                continue  # not covered: checked on its own
+            listing = _flipkart_listing(data, product_id)
+            statuses[product_id] = bool(listing.get("available", False))
+            if statuses[product_id]:
+                FLIPKART_PRICES[product_id] = _flipkart_price(listing)
+
+        for product in products:
+            in_stock = statuses.get(str(product["productId"]))
+            if in_stock is True:
+                print(f"[FLIPKART] ✅ {product['name']} deliverable to {pincode}")
+            elif in_stock is False:
+                print(f"[FLIPKART] ❌ {product['name']} not deliverable at {pincode}")
+        return statuses
+
+    except Exception as e:
+        print(f"[error] Flipkart batch proxy check failed at {pincode}: {e}")
+        record_failure(e)
+        if probing:
+            _flipkart_proxy["probe_at"] = time.time() + FLIPKART_PROBE_COOLDOWN
         return None
 
+# ==================================
+# 🧪 HTML FIELD EXTRACTION
+# ==================================
+# The few page elements each HTML checker reads, as CSS selectors (the same
+# ones the checkers used with soup.select_one), plus the phrases whose
+# presence anywhere in the page text marks a product out of stock.
+PAGE_FIELDS = {
+    "amazon": {
+        "title": "#productTitle",
+        "price": ".a-price .a-offscreen",
+        "availability": "#availability span",
+    },
+    "iqoo": {
+        "title": "title",
+        "button": 'button:contains("Buy Now"), a:contains("Buy Now")',
+        "price": ".price-tag, .product-price, .current_price, .selling-price",
+        "offers": ".product-offers, .discount-details, .emi-details",
+    },
+    "vivo": {
+        "title": "title",
+        "button": "a.buyNow, .addToCart, .buyButton",
+        "price": ".price-tag, .product-price, .current_price, .selling-price, .js-final-price",
+        "offers": ".product-offers, .discount-details, .emi-details",
+    },
+    "reliance_digital": {
+        "price": '.pdpPrice, .product-price .amount, .final-price, [class*="Price"]',
+    },
+}
+OOS_PHRASES = {
+    "iqoo": ["out of stock", "currently unavailable", "notify me"],
+    "vivo": ["out of stock", "notify me", "currently unavailable"],
+}
+
+# "stream" (default): single-pass tokenizer that only tracks the wanted
+# fields and stops once they're all found. "soup": full BeautifulSoup
+# html.parser tree (the reference). "lxml": BeautifulSoup on lxml, if installed.
+HTML_BACKEND = os.getenv("HTML_BACKEND", "stream")
+# Pages are read in chunks and never past this many (decompressed) bytes
+HTML_MAX_BYTES = int(os.getenv("HTML_MAX_BYTES", str(2 * 1024 * 1024)))
+HTML_CHUNK_SIZE = 32 * 1024
+
+# Elements BeautifulSoup never expects a closing tag for
+_VOID_TAGS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "keygen",
+    "link", "menuitem", "meta", "param", "source", "track", "wbr",
+    "basefont", "bgsound", "command", "frame", "image", "isindex", "nextid", "spacer",
+}
+# Elements whose text get_text() leaves out
+_HIDDEN_TEXT_TAGS = {"script", "style", "template"}
+_SELECTOR_TOKEN_RE = re.compile(r'(?:[^\s"]|"[^"]*")+')
+_SIMPLE_SELECTOR_RE = re.compile(
+    r'([#.])([\w-]+)|\[([\w-]+)\*="([^"]*)"\]|:contains\("([^"]*)"\)|([a-zA-Z][\w-]*)'
+)
+
+
+def _parse_selector(selector):
+    """
+    Parse the small CSS subset PAGE_FIELDS uses: comma-separated groups of
+    descendant compounds made of tag, #id, .class, [attr*="x"] and a final
+    :contains("x"). Returns [(compounds, contains_text), ...].
+    """
+    groups = []
+    for group in selector.split(","):
+        compounds, contains = [], None
+        for token in _SELECTOR_TOKEN_RE.findall(group.strip()):
+            compound = {"tag": None, "id": None, "classes": [], "attr_contains": []}
+            for sign, name, attr, value, text, tag in _SIMPLE_SELECTOR_RE.findall(token):
+                if sign == "#":
+                    compound["id"] = name
+                elif sign == ".":
+                    compound["classes"].append(name)
+                elif attr:
+                    compound["attr_contains"].append((attr, value))
+                elif text:
+                    contains = text
+                elif tag:
+                    compound["tag"] = tag.lower()
+            compounds.append(compound)
+        groups.append((compounds, contains))
+    return groups
+
+
+def _compound_matches(compound, tag, attrs):
+    if compound["tag"] and compound["tag"] != tag:
+        return False
+    if compound["id"] and attrs.get("id") != compound["id"]:
+        return False
+    classes = attrs.get("class", [])
+    if any(c not in classes for c in compound["classes"]):
+        return False
+    for attr, value in compound["attr_contains"]:
+        actual = attrs.get(attr, "")
+        if value not in (" ".join(actual) if isinstance(actual, list) else actual):
+            return False
+    return True
+
+
+class FieldScanner(HTMLParser):
+    """
+    Incremental extractor for PAGE_FIELDS. Feed it HTML in any number of
+    chunks; `done` turns True as soon as every field (and, where relevant,
+    an out-of-stock phrase) has been settled, so callers can stop reading.
+    Field values mirror soup.select_one(): the first match in document
+    order, as {"text": el.get_text(strip=True), "attrs": el.attrs}.
+    """
+
+    def __init__(self, store):
+        super().__init__(convert_charrefs=True)
+        self.selectors = {name: _parse_selector(sel) for name, sel in PAGE_FIELDS.get(store, {}).items()}
+        self.phrases = OOS_PHRASES.get(store, [])
+        self.fields = {}  # settled fields
+        self.candidates = {name: [] for name in self.selectors}
+        self.stack = []  # open elements: (tag, attrs)
+        self.hidden_depth = 0
+        self.data = []
+        self.text_tail = ""
+        self.oos = False
+
+    @property
+    def done(self):
+        return len(self.fields) == len(self.selectors) and (self.oos or not self.phrases)
+
+    def result(self):
+        self._flush()
+        # Whatever's still open is closed by the end of the document
+        while self.stack:
+            self._pop()
+        for name in self.selectors:
+            self._settle(name)
+            self.fields.setdefault(name, None)
+        return dict(self.fields, oos=self.oos)
+
+    # --- tokenizer callbacks ---
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        attrs = {k: (v if v is not None else "") for k, v in attrs}
+        if "class" in attrs:
+            attrs["class"] = attrs["class"].split()  # multi-valued, like bs4
+        self.stack.append((tag, attrs))
+        for name, groups in self.selectors.items():
+            if name in self.fields:
+                continue
+            if self.candidates[name] and not any(contains for _, contains in groups):
+                continue  # first match in document order already started
+            for compounds, contains in groups:
+                if self._matches(compounds):
+                    self.candidates[name].append({
+                        "depth": len(self.stack), "attrs": attrs, "parts": [],
+                        "raw": [], "contains": contains, "open": True,
+                    })
+                    break
+        if tag in _HIDDEN_TEXT_TAGS:
+            self.hidden_depth += 1
+        if tag in _VOID_TAGS:
+            self._pop()
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in _VOID_TAGS and self.stack and self.stack[-1][0] == tag:
+            self._pop()
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if tag in _VOID_TAGS:
+            return
+        for depth in range(len(self.stack), 0, -1):
+            if self.stack[depth - 1][0] == tag:
+                while len(self.stack) >= depth:
+                    self._pop()
+                return
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def unknown_decl(self, data):
+        self._flush()
+        if data.startswith("CDATA["):
+            self.data.append(data[6:])
+            self._flush()
+
+    # --- internals ---
+    def _matches(self, compounds):
+        tag, attrs = self.stack[-1]
+        if not _compound_matches(compounds[-1], tag, attrs):
+            return False
+        depth = len(self.stack) - 1
+        for compound in reversed(compounds[:-1]):
+            while depth > 0 and not _compound_matches(compound, *self.stack[depth - 1]):
+                depth -= 1
+            if depth == 0:
+                return False
+            depth -= 1
+        return True
+
+    def _pop(self):
+        tag, _ = self.stack[-1]
+        depth = len(self.stack)
+        for name, candidates in self.candidates.items():
+            for candidate in candidates:
+                if candidate["open"] and candidate["depth"] == depth:
+                    candidate["open"] = False
+            if candidates and name not in self.fields:
+                self._settle(name)
+        if tag in _HIDDEN_TEXT_TAGS and self.hidden_depth:
+            self.hidden_depth -= 1
+        self.stack.pop()
+
+    def _settle(self, name):
+        """Settle a field once its earliest viable candidate has closed."""
+        candidates = self.candidates[name]
+        while candidates and not candidates[0]["open"]:
+            candidate = candidates.pop(0)
+            if candidate["contains"] is None or candidate["contains"] in "".join(candidate["raw"]):
+                self.fields[name] = {"text": "".join(candidate["parts"]), "attrs": candidate["attrs"]}
+                candidates.clear()
+                return
+
+    def _flush(self):
+        """Hand one text node (everything between two tags) to the open captures."""
+        if not self.data:
+            return
+        text = "".join(self.data)
+        self.data = []
+        stripped = text.strip()
+        for candidates in self.candidates.values():
+            for candidate in candidates:
+                if candidate["open"]:
+                    candidate["raw"].append(text)
+                    if stripped and not self.hidden_depth:
+                        candidate["parts"].append(stripped)
+        if self.phrases and not self.oos and not self.hidden_depth:
+            window = self.text_tail + text.lower()
+            self.oos = any(phrase in window for phrase in self.phrases)
+            self.text_tail = window[-max(len(p) for p in self.phrases):]
+
+
+def _soup_fields(html, store, parser):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, parser)
+    fields = {}
+    for name, selector in PAGE_FIELDS.get(store, {}).items():
+        el = soup.select_one(selector.replace(":contains(", ":-soup-contains("))
+        fields[name] = {"text": el.get_text(strip=True), "attrs": el.attrs} if el else None
+    phrases = OOS_PHRASES.get(store, [])
+    page_text = soup.get_text().lower() if phrases else ""
+    fields["oos"] = any(phrase in page_text for phrase in phrases)
+    return fields
+
+
+def extract_fields(html, store, backend=None):
+    """
+    Pull PAGE_FIELDS[store] (and the out-of-stock phrase flag) out of a page.
+    Returns {field: {"text", "attrs"} or None, ..., "oos": bool}.
+    """
+    backend = backend or HTML_BACKEND
+    if backend == "stream":
+        scanner = FieldScanner(store)
+        for start in range(0, len(html), 65536):
+            scanner.feed(html[start:start + 65536])
+            if scanner.done:
+                break
+        return scanner.result()
+    if backend == "lxml":
+        return _soup_fields(html, store, "lxml")
+    return _soup_fields(html, store, "html.parser")
+
+
+# url -> validators, hash of the page region the fields came from, and the fields
+PAGE_STATE = TTLCache("page-state", PAGE_STATE_TTL, maxsize=5000)
+PAGE_CACHE_STATS = {"not_modified": 0, "unchanged": 0, "parsed": 0}
+
+
+def _count_page_cache(key):
+    with _stats_lock:
+        PAGE_CACHE_STATS[key] += 1
+
+
+def _capped_chunks(res, url):
+    received = 0
+    for chunk in res.iter_content(HTML_CHUNK_SIZE):
+        if received + len(chunk) > HTML_MAX_BYTES:
+            print(f"[warn] {url} exceeded {HTML_MAX_BYTES} bytes, parsing what was read")
+            yield chunk[: HTML_MAX_BYTES - received]
+            return
+        received += len(chunk)
+        yield chunk
+
+
+def fetch_fields(store, url, **kwargs):
+    """
+    GET a page with the store's session and extract its PAGE_FIELDS (see
+    _fetch_fields). Duplicate products pointing at the same page share one
+    fetch. Returns (response, fields); a shared response has no body.
+    """
+    def fetch():
+        res, fields = _fetch_fields(store, url, **kwargs)
+        snapshot = {"status": res.status_code, "url": url, "headers": dict(res.headers), "body": "", "fields": fields}
+        return (res, fields), snapshot, res.status_code in (200, 304)
+
+    value, snapshot = coalesce(page_key(store, url), fetch)
+    return value if value is not None else (response_from(snapshot), snapshot["fields"])
+
+
+def _fetch_fields(store, url, **kwargs):
+    """
+    GET a page with the store's session and extract its PAGE_FIELDS while it
+    downloads. With the stream backend, reading stops as soon as every field
+    is settled; any backend stops at HTML_MAX_BYTES. Returns (response, fields).
+
+    The previous fetch of the URL is remembered: the request is made
+    conditional on its ETag/Last-Modified, and if the bytes the fields were
+    read from come back identical, the old fields are reused unparsed.
+    """
+    state = PAGE_STATE.get(url)
+    headers = {}
+    if state and state.get("etag"):
+        headers["If-None-Match"] = state["etag"]
+    if state and state.get("last_modified"):
+        headers["If-Modified-Since"] = state["last_modified"]
+
+    with get_session(store).get(url, stream=True, headers=headers, **kwargs) as res:
+        read_start = time.perf_counter()
+        if res.status_code == 304 and state:
+            _count_page_cache("not_modified")
+            return res, state["fields"]
+
+        chunks = _capped_chunks(res, url)
+        held = []
+        if state and res.status_code == 200:
+            # Read just as far as the fields were found last time (or one
+            # byte past the end, if they needed the whole page)
+            limit = state["length"] + (1 if state["eof"] else 0)
+            read = 0
+            for chunk in chunks:
+                held.append(chunk)
+                read += len(chunk)
+                if read >= limit:
+                    break
+            region = b"".join(held)
+            enough = len(region) == state["length"] if state["eof"] else len(region) >= state["length"]
+            add_call_timing("bytes", len(region))
+            if enough and hashlib.sha256(region[: state["length"]]).hexdigest() == state["hash"]:
+                add_call_timing("download", time.perf_counter() - read_start)
+                _count_page_cache("unchanged")
+                PAGE_STATE.set(url, dict(state, etag=res.headers.get("ETag"), last_modified=res.headers.get("Last-Modified")))
+                return res, state["fields"]
+
+        _count_page_cache("parsed")
+        # requests assumes ISO-8859-1 for text/* without a charset; pages are UTF-8
+        has_charset = "charset" in res.headers.get("content-type", "").lower()
+        decoder = codecs.getincrementaldecoder((has_charset and res.encoding) or "utf-8")(errors="replace")
+        scanner = FieldScanner(store) if HTML_BACKEND == "stream" else None
+        digest = hashlib.sha256()
+        parts = []
+        received = 0
+        parse_seconds = 0.0
+        eof = True
+
+        for chunk in itertools.chain(held, chunks):
+            received += len(chunk)
+            digest.update(chunk)
+            text = decoder.decode(chunk)
+            if scanner:
+                parse_start = time.perf_counter()
+                scanner.feed(text)
+                parse_seconds += time.perf_counter() - parse_start
+                if scanner.done:
+                    eof = False
+                    break
+            else:
+                parts.append(text)
+        # Leaving the block early closes the connection instead of draining the rest
+
+    parse_start = time.perf_counter()
+    add_call_timing("download", parse_start - read_start - parse_seconds)
+    fields = scanner.result() if scanner else extract_fields("".join(parts), store)
+    add_call_timing("parse", parse_seconds + time.perf_counter() - parse_start)
+    add_call_timing("bytes", received - sum(len(chunk) for chunk in held))
+    if res.status_code == 200:
+        PAGE_STATE.set(url, {
+            "etag": res.headers.get("ETag"),
+            "last_modified": res.headers.get("Last-Modified"),
+            "hash": digest.hexdigest(),
+            "length": received,
+            "eof": eof and received < HTML_MAX_BYTES,
+            "fields": fields,
+        })
+    return res, fields
+
+
+def field_text(fields, name):
+    field = fields.get(name)
+    return field["text"] if field else None
+
 # ==================================
 # 🧾 AMAZON HTML PARSER CHECKER
 # ==================================
@@ -287,37 +2534,13 @@ def check_amazon(product):
     url = product["url"]
     print(f"[AMAZON] Checking: {url}")
 
-    headers = {
-        "authority": "www.amazon.in",
-        "method": "GET",
-        "scheme": "https",
-        "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-        "accept-language": "en-US,en;q=0.9",
-        "cache-control": "max-age=0",
-        "sec-ch-ua": '"Not_A Brand";v="99", "Google Chrome";v="137", "Chromium";v="137"',
-        "sec-ch-ua-mobile": "?0",
-        "sec-ch-ua-platform": '"Windows"',
-        "upgrade-insecure-requests": "1",
-        "user-agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/137.0.0.0 Safari/537.36"
-        ),
-    }
-
     try:
-        res = requests.get(url, headers=headers, timeout=20)
+        res, fields = fetch_fields("amazon", url)
         print(f"[AMAZON] Status code: {res.status_code}")
-        html = res.text
-        soup = BeautifulSoup(html, "html.parser")
 
-        title_el = soup.select_one("#productTitle")
-        price_el = soup.select_one(".a-price .a-offscreen")
-        availability_el = soup.select_one("#availability span")
-
-        title = title_el.get_text(strip=True) if title_el else product["name"]
-        price = price_el.get_text(strip=True) if price_el else None
-        availability = availability_el.get_text(strip=True).lower() if availability_el else ""
+        title = field_text(fields, "title") or product["name"]
+        price = field_text(fields, "price")
+        availability = (field_text(fields, "availability") or "").lower()
 
         available_phrases = [
             "in stock",
@@ -331,10 +2554,11 @@ def check_amazon(product):
 
         if available:
             print(f"[AMAZON] ✅ {title} is available at {price}")
-            return (
+            return StockHit(
                 f"✅ *Amazon*\n"
                 f"[{title}]({product['affiliateLink'] or url})"
-                + (f"\n💰 {price}" if price else "")
+                + (f"\n💰 {price}" if price else ""),
+                price,
             )
         else:
             print(f"[AMAZON] ❌ {title} appears unavailable.")
@@ -343,18 +2567,80 @@ def check_amazon(product):
 
     except Exception as e:
         print(f"[error] Amazon HTML check failed for {product['name']}: {e}")
+        record_failure(e)
         return None
 
 # ==================================
 # 🌐 RELIANCE DIGITAL API CHECKER (MODIFIED TO USE DB ID)
 # ==================================
+RD_INVENTORY_URL = "https://www.reliancedigital.in/ext/raven-api/inventory/multi/articles-v2"
+RD_BATCH_SIZE = int(os.getenv("RD_BATCH_SIZE", "20"))
+RD_OUT_OF_STOCK_ERRORS = ["OutOfStockError", "FaultyArticleError"]
+RD_PRICE_CACHE = TTLCache("rd-prices", RD_PRICE_TTL)
+
+
+def _rd_inventory_payload(article_ids, pincode):
+    return {
+        "articles": [
+            {
+                "article_id": str(article_id),
+                "custom_json": {},
+                "quantity": 1
+            }
+            for article_id in article_ids
+        ],
+        "phone_number": "0",
+        "pincode": str(pincode),
+        "request_page": "pdp"
+    }
+
+
+def _rd_is_in_stock(article):
+    """Available if the article has NO meaningful error type."""
+    error_type = article.get("error", {}).get("type")
+    return not (error_type and error_type in RD_OUT_OF_STOCK_ERRORS)
+
+
+def _rd_fetch_price(product):
+    """
+    Try to extract price from the product page using BS (fallback). Only
+    called for in-stock products; prices are cached per URL for RD_PRICE_TTL.
+    """
+    price = RD_PRICE_CACHE.get(product["url"])
+    if price:
+        return price
+    try:
+        _, fields = fetch_fields(
+            "reliance_digital", product["url"], timeout=(store_config("reliance_digital").timeout[0], 10)
+        )
+        price_text = field_text(fields, "price")
+        if price_text:
+            # Clean up the price string
+            price = price_text.replace('\n', ' ').replace('₹', '').strip()
+            if price:
+                RD_PRICE_CACHE.set(product["url"], price)
+            return price
+    except Exception:
+        pass
+    return None
+
+
+def _rd_in_stock_message(product, fetch=True):
+    price = _rd_fetch_price(product) if fetch else RD_PRICE_CACHE.get(product["url"])
+    return StockHit(
+        f"✅ *Reliance Digital*\n"
+        f"[{product['name']}]({product['affiliateLink'] or product['url']})"
+        + (f"\n💰 Price: ₹{price}" if price else ""),
+        price,
+    )
+
+
 def check_reliance_digital(product, pincode):
     """
     Check stock availability for a Reliance Digital product by querying the 
     inventory API directly using the internal 'article_id' (now stored in productId).
     """
     name = product["name"]
-    url = product["url"]
     # The 'productId' now contains the **internal Article ID** (e.g., '493839312')
     article_id = product["productId"] 
     
@@ -362,37 +2648,12 @@ def check_reliance_digital(product, pincode):
         print(f"[RD] ❌ Cannot check {name}: Missing internal Article ID.")
         return None
 
-    # ----------------------------------------
-    # STEP 2: Check Stock using the Article ID
-    # ----------------------------------------
     print(f"[RD] Checking stock: {name} (ID: {article_id}) for Pincode {pincode}")
 
-    inventory_url = "https://www.reliancedigital.in/ext/raven-api/inventory/multi/articles-v2"
-    
-    inventory_headers = {
-        "accept": "application/json, text/plain, */*",
-        "content-type": "application/json",
-        "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36",
-        "origin": "https://www.reliancedigital.in",
-        "referer": "https://www.reliancedigital.in/",
-    }
-
-    # API Payload 
-    payload = {
-        "articles": [
-            {
-                "article_id": str(article_id),
-                "custom_json": {}, 
-                "quantity": 1
-            }
-        ],
-        "phone_number": "0",
-        "pincode": str(pincode),
-        "request_page": "pdp"
-    }
-
     try:
-        res = requests.post(inventory_url, headers=inventory_headers, json=payload, timeout=20)
+        res = get_session("reliance_digital").post(
+            RD_INVENTORY_URL, json=_rd_inventory_payload([article_id], pincode)
+        )
         res.raise_for_status() 
         data = res.json()
         
@@ -401,42 +2662,70 @@ def check_reliance_digital(product, pincode):
             return None
 
         article = article_data[0]
-        
-        # Determine stock status: Available if there is NO meaningful error type
-        article_error = article.get("error", {})
-        error_type = article_error.get("type")
-        
-        is_in_stock = not (error_type and error_type in ["OutOfStockError", "FaultyArticleError"])
-        
-        # Try to extract price from the product page using BS (fallback)
-        price = None
-        try:
-            res_html = requests.get(url, headers=inventory_headers, timeout=10)
-            soup = BeautifulSoup(res_html.text, "html.parser")
-            price_el = soup.select_one('.pdpPrice, .product-price .amount, .final-price, [class*="Price"]')
-            if price_el:
-                # Clean up the price string
-                price = price_el.get_text(strip=True).replace('\n', ' ').replace('₹', '').strip() 
-        except Exception:
-            pass 
-
-        if is_in_stock:
+
+        if _rd_is_in_stock(article):
             print(f"[RD] ✅ {name} is IN STOCK at {pincode}.")
-            return (
-                f"✅ *Reliance Digital*\n"
-                f"[{name}]({product['affiliateLink'] or url})"
-                + (f"\n💰 Price: ₹{price}" if price else "")
-            )
+            return _rd_in_stock_message(product)
         else:
-            error_message = article_error.get("message", "Stock Error")
+            error_message = article.get("error", {}).get("message", "Stock Error")
             print(f"[RD] ❌ {name} is UNAVAILABLE at {pincode}. (Error: {error_message})")
             return None
 
     except requests.exceptions.RequestException as e:
         print(f"[error] Reliance Digital inventory check failed for {name}: {e}")
+        record_failure(e)
         return None
     except Exception as e:
         print(f"[error] Reliance Digital check failed for {name} (general): {e}")
+        record_failure(e)
+        return None
+
+
+def check_reliance_digital_batch(products, pincode):
+    """
+    Check up to RD_BATCH_SIZE products in one multi-article inventory call.
+    Returns {article_id: in_stock} for every article the response accounted
+    for, or None if the call failed or the response was malformed. Products
+    missing from the result should be re-checked individually.
+    """
+    article_ids = list(dict.fromkeys(str(p["productId"]) for p in products if p["productId"]))
+    if not article_ids:
+        return {}
+
+    print(f"[RD] Checking stock: {len(article_ids)} articles for Pincode {pincode}")
+
+    try:
+        res = get_session("reliance_digital").post(
+            RD_INVENTORY_URL, json=_rd_inventory_payload(article_ids, pincode)
+        )
+        res.raise_for_status()
+        articles = res.json().get("data", {}).get("articles")
+        if not isinstance(articles, list) or not articles:
+            print(f"[RD] ⚠️ Malformed batch response at {pincode}, falling back to per-product checks")
+            return None
+
+        statuses = {}
+        for position, article in enumerate(articles):
+            if not isinstance(article, dict):
+                return None
+            article_id = article.get("article_id")
+            if article_id is None and len(articles) == len(article_ids):
+                # No id echoed back; the API answers in request order
+                article_id = article_ids[position]
+            if article_id is not None:
+                statuses[str(article_id)] = _rd_is_in_stock(article)
+
+        for product in products:
+            in_stock = statuses.get(str(product["productId"]))
+            if in_stock is True:
+                print(f"[RD] ✅ {product['name']} is IN STOCK at {pincode}.")
+            elif in_stock is False:
+                print(f"[RD] ❌ {product['name']} is UNAVAILABLE at {pincode}.")
+        return statuses
+
+    except Exception as e:
+        print(f"[error] Reliance Digital batch check failed at {pincode}: {e}")
+        record_failure(e)
         return None
 
 # ==================================
@@ -447,33 +2736,24 @@ def check_iqoo(product):
     url = product["url"]
     print(f"[IQOO] Checking: {url}")
 
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/137.0.0.0 Safari/537.36"
-        ),
-    }
-
     try:
-        res = requests.get(url, headers=headers, timeout=20)
-        html = res.text
-        soup = BeautifulSoup(html, "html.parser")
+        _, fields = fetch_fields("iqoo", url)
 
         # --- EXTRACT NAME from <title> or fallback ---
-        page_title = soup.find('title')
-        product_name = page_title.get_text(strip=True).split('|')[0].strip() if page_title else product["name"]
+        page_title = field_text(fields, "title")
+        product_name = page_title.split('|')[0].strip() if page_title is not None else product["name"]
         
         # --- KEY SCRAPING LOGIC ---
-        buy_now_button = soup.select_one('button:contains("Buy Now"), a:contains("Buy Now")')
-        out_of_stock_phrases = ["out of stock", "currently unavailable", "notify me"]
-        page_text = soup.get_text().lower()
+        buy_now_button = fields["button"]
+        has_oos_phrase = fields["oos"]
         
         is_available = True
         availability_text = "Status indeterminate."
         
         if buy_now_button:
-            is_disabled = buy_now_button.get('disabled') or 'disabled' in buy_now_button.get('class', []) or 'out-of-stock' in buy_now_button.get('class', [])
+            button_attrs = buy_now_button["attrs"]
+            button_classes = button_attrs.get('class', [])
+            is_disabled = button_attrs.get('disabled') or 'disabled' in button_classes or 'out-of-stock' in button_classes
             
             if is_disabled:
                 is_available = False
@@ -482,20 +2762,17 @@ def check_iqoo(product):
                 is_available = True
                 availability_text = "Active Buy Now button found."
         
-        if not is_available and any(phrase in page_text for phrase in out_of_stock_phrases):
+        if not is_available and has_oos_phrase:
              is_available = False
              availability_text = "Explicit 'out of stock' phrase found in page text."
              
-        if not buy_now_button and any(phrase in page_text for phrase in out_of_stock_phrases):
+        if not buy_now_button and has_oos_phrase:
              is_available = False
              availability_text = "No clear button, but OOS text found."
 
         # --- EXTRACT PRICE AND OFFERS ---
-        price_el = soup.select_one('.price-tag, .product-price, .current_price, .selling-price')
-        price = price_el.get_text(strip=True) if price_el else None
-        
-        offer_el = soup.select_one('.product-offers, .discount-details, .emi-details')
-        offers = offer_el.get_text(strip=True) if offer_el else None
+        price = field_text(fields, "price")
+        offers = field_text(fields, "offers")
         
         price_info = ""
         if price:
@@ -506,10 +2783,11 @@ def check_iqoo(product):
 
         if is_available:
             print(f"[IQOO] ✅ {product_name} is available.")
-            return (
+            return StockHit(
                 f"✅ *iQOO*\n"
                 f"[{product_name}]({product['affiliateLink'] or url})"
-                f"{price_info}"
+                f"{price_info}",
+                price,
             )
         else:
             print(f"[IQOO] ❌ {product_name} appears unavailable. ({availability_text})")
@@ -517,6 +2795,7 @@ def check_iqoo(product):
 
     except Exception as e:
         print(f"[error] iQOO check failed for {product['name']}: {e}")
+        record_failure(e)
         return None
 
 # ==================================
@@ -530,34 +2809,23 @@ def check_vivo(product):
     original_name = product["name"]
     print(f"[VIVO] Checking: {original_name} at {url}")
 
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/137.0.0.0 Safari/537.36"
-        ),
-    }
-
     try:
-        res = requests.get(url, headers=headers, timeout=20)
+        res, fields = fetch_fields("vivo", url)
         print(f"[VIVO] Status code: {res.status_code}")
-        html = res.text
-        soup = BeautifulSoup(html, "html.parser")
 
         # --- EXTRACT NAME from <title> or fallback ---
-        page_title = soup.find('title')
-        product_name = page_title.get_text(strip=True).split('|')[0].strip() if page_title else original_name
+        page_title = field_text(fields, "title")
+        product_name = page_title.split('|')[0].strip() if page_title is not None else original_name
 
         # --- KEY SCRAPING LOGIC ---
-        buy_now_link = soup.select_one('a.buyNow, .addToCart, .buyButton')
-        out_of_stock_phrases = ["out of stock", "notify me", "currently unavailable"]
-        page_text_lower = soup.get_text().lower()
+        buy_now_link = fields["button"]
+        has_oos_phrase = fields["oos"]
         
         is_available = True
         availability_text = "Status indeterminate."
 
         if buy_now_link:
-            is_disabled = 'disabled' in buy_now_link.get('class', [])
+            is_disabled = 'disabled' in buy_now_link["attrs"].get('class', [])
             
             if is_disabled:
                 is_available = False
@@ -566,20 +2834,17 @@ def check_vivo(product):
                 is_available = True
                 availability_text = f"Active Buy Now link found."
         
-        if not is_available and any(phrase in page_text_lower for phrase in out_of_stock_phrases):
+        if not is_available and has_oos_phrase:
              is_available = False
              availability_text = "Explicit 'out of stock' phrase found in page text."
              
-        if not buy_now_link and any(phrase in page_text_lower for phrase in out_of_stock_phrases):
+        if not buy_now_link and has_oos_phrase:
              is_available = False
              availability_text = "No active Buy Now link found."
 
         # --- EXTRACT PRICE AND OFFERS ---
-        price_el = soup.select_one('.price-tag, .product-price, .current_price, .selling-price, .js-final-price')
-        price = price_el.get_text(strip=True) if price_el else None
-        
-        offer_el = soup.select_one('.product-offers, .discount-details, .emi-details')
-        offers = offer_el.get_text(strip=True) if offer_el else None
+        price = field_text(fields, "price")
+        offers = field_text(fields, "offers")
         
         price_info = ""
         if price:
@@ -590,10 +2855,11 @@ def check_vivo(product):
 
         if is_available:
             print(f"[VIVO] ✅ {product_name} is available.")
-            return (
+            return StockHit(
                 f"✅ *Vivo*\n"
                 f"[{product_name}]({product['affiliateLink'] or url})"
-                f"{price_info}"
+                f"{price_info}",
+                price,
             )
         else:
             print(f"[VIVO] ❌ {product_name} appears unavailable. ({availability_text})")
@@ -601,94 +2867,867 @@ def check_vivo(product):
 
     except Exception as e:
         print(f"[error] Vivo check failed for {original_name}: {e}")
+        record_failure(e)
+        return None
+
+# ==================================
+# 📍 PINCODE STRATEGY
+# ==================================
+class PincodeHistory:
+    """What stock_state says about where each product tends to be in stock."""
+
+    def __init__(self, rows, hit_rates):
+        self.last_hit = {}  # product id -> pincode, most recent in-stock row wins
+        self.fresh_negatives = set()  # (product id, pincode)
+        for product_id, pincode, in_stock, fresh in rows:
+            if in_stock:
+                self.last_hit[product_id] = pincode
+            elif fresh:
+                self.fresh_negatives.add((product_id, pincode))
+        self.hit_rates = {}  # store -> {pincode: share of its products in stock there}
+        for store, pincode, rate in hit_rates:
+            self.hit_rates.setdefault(store, {})[pincode] = rate
+
+    def plan(self, product):
+        """
+        (pincodes to check in order, pincodes skipped as recently out of
+        stock). Pincodes are compared stripped, as stock_state stores them.
+        """
+        product_id = product.get("id")
+        rates = self.hit_rates.get(product["storeType"], {})
+        last_hit = self.last_hit.get(product_id)
+        order = sorted(
+            pincodes_to_check(),
+            key=lambda pincode: (pincode.strip() != last_hit, -rates.get(pincode.strip(), 0.0)),
+        )
+        memoized = [
+            pincode for pincode in order[1:]
+            if PINCODE_NEGATIVE_TTL and (product_id, pincode.strip()) in self.fresh_negatives
+        ]
+        return [pincode for pincode in order if pincode not in memoized], memoized
+
+
+# ==================================
+# 🗂️ STORE REGISTRY
+# ==================================
+class StoreChecker:
+    """
+    Everything the engine, sessions and scheduler need to know about a store.
+
+    - `check(product)`, or `check(product, pincode)` for pincode stores
+      (checked per pincode, first in-stock pincode wins): StockHit or None
+    - `batch`: optional multi-product checker for pincode stores.
+      `check(products, pincode)` returns {productId: in_stock} (or None when
+      the response is unusable); `message(product, fetch=True)` builds the
+      alert for a hit; `size` caps products per request.
+    - `content`: "json" API or "html" page (read through fetch_fields)
+    - concurrency, timeout, rate, base_interval and check_seconds come from
+      the per-store settings at the top of the file.
+    """
+
+    def __init__(self, key, label, emoji, check, pincodes=False, batch=None, content="json"):
+        self.key = key
+        self.label = label
+        self.emoji = emoji
+        self.check = check
+        self.pincodes = pincodes
+        self.batch = batch
+        self.content = content
+        self.concurrency = STORE_CONCURRENCY.get(key, 4)
+        self.timeout = STORE_TIMEOUTS.get(key, (5, 20))
+        self.rate = STORE_RATE_LIMITS.get(key, 0)
+        self.base_interval = STORE_BASE_INTERVAL.get(key, 300)
+        self.check_seconds = STORE_CHECK_SECONDS.get(key, 2.0)
+
+
+# In summary order
+STORE_CHECKERS = {}
+
+
+def register_store(key, label, emoji, check, **capabilities):
+    STORE_CHECKERS[key] = StoreChecker(key, label, emoji, check, **capabilities)
+    return STORE_CHECKERS[key]
+
+
+def store_config(store):
+    """The registered StoreChecker, or defaults for a store without a checker."""
+    return STORE_CHECKERS.get(store) or StoreChecker(store, store, "", None)
+
+
+register_store(
+    "croma", "Croma", "🟢", check_croma,
+    pincodes=True,
+    batch={"check": check_croma_batch, "message": _croma_in_stock_message, "size": CROMA_BATCH_SIZE},
+)
+register_store(
+    "flipkart", "Flipkart", "🟣", check_flipkart,
+    pincodes=True,
+    batch=(
+        {"check": check_flipkart_batch, "message": _flipkart_in_stock_message, "size": FLIPKART_BATCH_SIZE}
+        if FLIPKART_BATCH_SIZE > 1 else None
+    ),
+)
+register_store("amazon", "Amazon", "🟡", check_amazon, content="html")
+register_store("unicorn", "Unicorn", "🦄", check_unicorn)
+register_store("iqoo", "iQOO", "📱", check_iqoo, content="html")
+register_store("vivo", "Vivo", "🤳", check_vivo, content="html")
+register_store(
+    "reliance_digital", "R. Digital", "🌐", check_reliance_digital,
+    pincodes=True,
+    batch={"check": check_reliance_digital_batch, "message": _rd_in_stock_message, "size": RD_BATCH_SIZE},
+)
+
+# ==================================
+# ⚙️ CONCURRENT CHECK ENGINE
+# ==================================
+
+
+class ProductCheck:
+    """
+    Tracks the in-flight pincode checks of one product. The result is the hit
+    with the lowest pincode index, i.e. exactly what the serial loop (which
+    stops at the first in-stock pincode) would have returned. `pincodes` is
+    the product's planned order, see PincodeHistory.plan.
+    """
+
+    def __init__(self, product, pincodes, memoized=()):
+        self.product = product
+        self.pincodes = pincodes
+        self.memoized = list(memoized)  # skipped: out of stock there very recently
+        self.failed = set()  # pincodes whose check errored (or failed fast)
+        self.futures = []
+        self.hit_index = None
+        self.result = None
+        self.outcomes = {}  # pincode -> result, for every pincode actually checked
+        self.failures = 0
+        self.changed = False  # availability or price moved since the last run
+        self.frozen = False  # past the deadline: late results are dropped
+        self.lock = threading.Lock()
+
+    @property
+    def complete(self):
+        """A hit, or every pincode answered. False for checks cut off by the deadline."""
+        with self.lock:
+            return bool(self.result) or set(self.outcomes) >= set(self.pincodes)
+
+    def settled_before(self, index):
+        """True once an earlier pincode has reported stock, making `index` moot."""
+        return self.hit_index is not None and self.hit_index < index
+
+    def record_outcome(self, pincode, result, failed=False, failures=0):
+        with self.lock:
+            if self.frozen:
+                return
+            self.outcomes[pincode] = result
+            self.failures += failures
+            if failed:
+                self.failed.add(pincode)
+
+    def record_message(self, message):
+        with self.lock:
+            if not self.frozen:
+                self.result = message
+
+    def record_hit(self, index, result):
+        with self.lock:
+            if self.frozen or self.settled_before(index):
+                return
+            self.hit_index = index
+            self.result = result
+            # Remaining pincodes can't change the outcome; drop the queued ones.
+            for later in self.futures[index + 1:]:
+                later.cancel()
+
+    def freeze(self):
+        """
+        Stop taking results. Checks left running past the deadline would
+        otherwise keep writing while the run reads and saves this one.
+        """
+        with self.lock:
+            self.frozen = True
+
+
+def _past(deadline):
+    return deadline is not None and time.time() >= deadline
+
+
+def _run_one_check(check, checker, index, global_limit, deadline=None):
+    if index and check.futures:
+        # Give the most likely pincode the chance to settle it first. It was
+        # queued earlier on this store's executor, so it's already running.
+        wait(check.futures[:1])
+    if check.settled_before(index) or _past(deadline):
         return None
+    if not get_breaker(check.product["storeType"]).allow():
+        check.record_outcome(check.pincodes[index], None, failed=True, failures=1)
+        return None
+    with global_limit:
+        if check.settled_before(index) or _past(deadline):
+            return None
+        pincode = check.pincodes[index]
+        _check_context.check = check
+        call = start_call(check.product["storeType"], pincode)
+        crashed = 0
+        try:
+            if pincode is None:
+                result = checker(check.product)
+            else:
+                result = checker(check.product, pincode)
+        except Exception as e:
+            print(f"[error] {check.product['storeType']} check crashed for {check.product['name']}: {e}")
+            crashed = 1
+            call["error"] = str(e)[:200]
+            result = None
+        finally:
+            finish_call(call)
+            _check_context.check = None
+    check.record_outcome(pincode, result, failed=bool(call["error"]), failures=crashed)
+    if result:
+        check.record_hit(index, result)
+    return result
+
+
+def _run_batch_checks(store, checks, global_limit, deadline=None):
+    """
+    Walk the planned pincodes for a chunk of products, batching the
+    products that try the same pincode next. Products drop out of later
+    requests once a pincode has them in stock, so each still gets its
+    first in-stock pincode. Products the batch
+    response didn't account for are checked one by one.
+
+    Alert messages (which may need an extra page fetch, e.g. RD's price) are
+    built afterwards, once per in-stock product.
+    """
+    batch = STORE_CHECKERS[store].batch
+    single = STORE_CHECKERS[store].check
+
+    # Round `index` checks every pending product at its index-th planned
+    # pincode, one request per distinct pincode
+    for index in range(max(len(check.pincodes) for check in checks)):
+        pending = [check for check in checks if check.hit_index is None and index < len(check.pincodes)]
+        if not pending or _past(deadline):
+            break
+        by_pincode = {}
+        for check in pending:
+            by_pincode.setdefault(check.pincodes[index], []).append(check)
+
+        for pincode, group in by_pincode.items():
+            if _past(deadline):
+                break
+            statuses = None
+            if get_breaker(store).allow():
+                with global_limit:
+                    call = start_call(store, pincode, products=len(group))
+                    try:
+                        statuses = batch["check"]([check.product for check in group], pincode)
+                    finally:
+                        finish_call(call)
+            statuses = statuses or {}
+
+            for check in group:
+                in_stock = statuses.get(str(check.product["productId"]))
+                if in_stock is None:
+                    _run_one_check(check, single, index, global_limit, deadline)
+                    continue
+                check.record_outcome(pincode, in_stock)
+                if in_stock:
+                    check.record_hit(index, True)
+
+    for check in checks:
+        if check.result is True:
+            call = start_call(store, None)
+            try:
+                check.record_message(batch["message"](check.product))
+            finally:
+                finish_call(call, allowed=False)
+
+
+# Largest group of one store's products queued at once while streaming
+SUBMIT_GROUP_SIZE = 500
+
+
+def run_checks(products, max_workers=None, deadline=None, history=None):
+    """
+    Group products by store and fan out every (product, pincode) check over
+    per-store thread pools sized and run as the store's StoreChecker
+    declares, bounded by a global limit of `max_workers` concurrent checks.
+    Returns a ProductCheck (None for unsupported stores) per product, in
+    input order; `.result` holds the alert message or None.
+
+    With a `deadline` (epoch seconds), checks that haven't started by then
+    are skipped and running ones are abandoned; see ProductCheck.complete.
+    With a PincodeHistory, pincodes are tried in its planned order.
+    `products` may be a stream in any store order: each store's products
+    are queued in groups of SUBMIT_GROUP_SIZE, the rest once it ends.
+    """
+    max_workers = max_workers or MAX_WORKERS
+    global_limit = threading.BoundedSemaphore(max_workers)
+    executors = {}
+    checks = []
+    futures = []
+    not_done = set()
+
+    def submit(key, group):
+        store = STORE_CHECKERS[key]
+        executor = executors.get(key)
+        if executor is None:
+            executors[key] = executor = ThreadPoolExecutor(
+                max_workers=max(1, min(store.concurrency, max_workers)),
+                thread_name_prefix=f"check-{key}",
+            )
+
+        if store.batch:
+            size = max(1, store.batch["size"])
+            for start in range(0, len(group), size):
+                futures.append(
+                    executor.submit(_run_batch_checks, key, group[start:start + size], global_limit, deadline)
+                )
+            return
+
+        # Every product's first pincode is queued before anyone's second,
+        # so a hit there usually cancels the rest before they start.
+        for check in group:
+            check.futures.append(executor.submit(_run_one_check, check, store.check, 0, global_limit, deadline))
+        for check in group:
+            for index in range(1, len(check.pincodes)):
+                check.futures.append(
+                    executor.submit(_run_one_check, check, store.check, index, global_limit, deadline)
+                )
+        futures.extend(future for check in group for future in check.futures)
+
+    try:
+        # One bucket per store, so batches and first-pincode-first ordering
+        # hold however the stores are interleaved (due order mixes them)
+        buckets = {}
+        for product in products:
+            store = STORE_CHECKERS.get(product["storeType"])
+            if not store or not store.check:
+                checks.append(None)
+                continue
+            if not store.pincodes:
+                check = ProductCheck(product, [None])
+            elif history:
+                check = ProductCheck(product, *history.plan(product))
+            else:
+                check = ProductCheck(product, list(pincodes_to_check()))
+            checks.append(check)
+
+            bucket = buckets.setdefault(store.key, [])
+            bucket.append(check)
+            if len(bucket) >= SUBMIT_GROUP_SIZE:
+                submit(store.key, buckets.pop(store.key))
+        for key, bucket in buckets.items():
+            submit(key, bucket)
+
+        _, not_done = wait(futures, timeout=None if deadline is None else max(0, deadline - time.time()))
+    finally:
+        if deadline is not None:
+            for check in checks:
+                if check:
+                    check.freeze()
+        for executor in executors.values():
+            # Past the deadline, leave stragglers running rather than wait on them
+            executor.shutdown(wait=deadline is None, cancel_futures=deadline is not None)
+
+    if not_done:
+        print(f"[warn] ⏰ Deadline reached with {len(not_done)} checks still queued or running.")
+        # Batched hits whose message wasn't built yet: use what's at hand
+        for check in checks:
+            if check and check.result is True:
+                check.result = STORE_CHECKERS[check.product["storeType"]].batch["message"](check.product, fetch=False)
+    return checks
+
+# ==================================
+# 📈 STOCK STATE & CHANGE ALERTS
+# ==================================
+def _stock_state_rows(checks):
+    checked_at = datetime.datetime.now(datetime.timezone.utc)
+    rows = {}
+    for check in checks:
+        if not check or check.product.get("id") is None:
+            continue
+        for pincode, outcome in check.outcomes.items():
+            if pincode in check.failed:
+                continue  # unknown, keep what was there
+            in_stock = bool(outcome)
+            price = getattr(outcome, "price", None)
+            if in_stock and price is None and pincode == check.pincodes[check.hit_index]:
+                price = getattr(check.result, "price", None)
+            rows[(check.product["id"], (pincode or "").strip())] = in_stock, price
+    return [(product_id, pincode, in_stock, price, checked_at) for (product_id, pincode), (in_stock, price) in rows.items()]
+
+
+def stock_changes(checks, state=None):
+    """
+    Record this run's availability in stock_state and return the alerts
+    worth sending: products that went out -> in stock, or got cheaper.
+    Falls back to every in-stock product if the state can't be read.
+    With `state` (a RunState), the previous state comes from its copy.
+    """
+    hits = [check for check in checks if check and check.result]
+    try:
+        rows = _stock_state_rows(checks)
+        if state is None:
+            previous = sync_stock_state(rows)
+        else:
+            stores = {check.product.get("id"): check.product["storeType"] for check in checks if check}
+            previous = state.sync_stock_state(rows, stores)
+    except Exception as e:
+        print(f"[warn] Stock state unavailable, alerting on everything in stock: {e}")
+        return [check.result for check in hits]
+
+    alerts = []
+    for check in checks:
+        if not check:
+            continue
+        before = previous.get(check.product.get("id"), [])
+        was_in_stock = any(in_stock for _, in_stock, _ in before)
+        if not check.result:
+            check.changed = was_in_stock and check.complete and not check.failures
+            continue
+        old_prices = [price for _, in_stock, price in before if in_stock and price is not None]
+        new_price = getattr(check.result, "price", None)
+        if not was_in_stock:
+            check.changed = True
+            alerts.append(check.result)
+        elif new_price is not None and old_prices and new_price < min(old_prices):
+            print(f"[info] 📉 Price drop for {check.product['name']}: {min(old_prices)} -> {new_price}")
+            check.changed = True
+            alerts.append(check.result)
+    print(f"[info] {len(alerts)} of {len(hits)} in-stock products changed since the last run.")
+    return alerts
+
+
+class RunState:
+    """
+    What a long-running caller (worker.py) keeps between run_stock_check
+    calls instead of reading it back from Postgres every run:
+    - store health: loaded once, after that the breakers and rate limiters
+      in memory carry over (it's still saved every run)
+    - stock_state: loaded whole once, then kept in step with what each run
+      writes; the pincode history and the stock changes come from it. This
+      assumes nothing else writes stock_state meanwhile, so reload() it now
+      and then
+    - run metrics: added up and saved as one check_runs row per
+      `metrics_interval` seconds, not one per run
+    """
+
+    def __init__(self, metrics_interval=300):
+        self.health_loaded = False
+        self.stock = None  # (product_id, pincode) -> [store, in_stock, price, checked_at (epoch)]
+        self.metrics_interval = metrics_interval
+        self.totals = None  # [started_at, duration, products, found, alerts, skipped] of unsaved runs
+        self.totals_since = 0.0
+        self.records = []
+
+    def reload(self):
+        """Read stock_state again on next use."""
+        self.stock = None
+
+    def restore_health(self):
+        if not self.health_loaded:
+            restore_store_health(load_store_health())
+            self.health_loaded = True
+
+    def _load_stock(self):
+        if self.stock is None:
+            now = time.time()
+            self.stock = {
+                (product_id, pincode): [store, in_stock, price, now - age]
+                for product_id, store, pincode, in_stock, price, age in load_stock_state()
+            }
+        return self.stock
+
+    def pincode_history(self):
+        """load_pincode_history, from the copy in memory."""
+        stock = self._load_stock()
+        fresh_after = time.time() - PINCODE_NEGATIVE_TTL
+        entries = sorted(stock.items(), key=lambda entry: entry[1][3])
+        rows = [
+            (product_id, pincode, in_stock, checked_at >= fresh_after)
+            for (product_id, pincode), (_, in_stock, _, checked_at) in entries
+        ]
+        totals = {}
+        for (_, pincode), (store, in_stock, _, _) in entries:
+            if pincode:
+                total = totals.setdefault((store, pincode), [0, 0])
+                total[0] += in_stock
+                total[1] += 1
+        hit_rates = [(store, pincode, hits / count) for (store, pincode), (hits, count) in totals.items()]
+        return PincodeHistory(rows, hit_rates)
+
+    def sync_stock_state(self, rows, stores):
+        """sync_stock_state, reading the replaced state from memory. `stores`: product id -> store."""
+        stock = self._load_stock()
+        product_ids = {row[0] for row in rows}
+        previous = {}
+        for (product_id, pincode), (_, in_stock, price, _) in stock.items():
+            if product_id in product_ids:
+                previous.setdefault(product_id, []).append((pincode, in_stock, price))
+        save_stock_state(rows)
+        now = time.time()
+        for product_id, pincode, in_stock, price, _ in rows:
+            old = stock.get((product_id, pincode))
+            if price is None and old:
+                price = old[2]
+            stock[(product_id, pincode)] = [stores.get(product_id), in_stock, price, now]
+        return previous
+
+    def add_run(self, started_at, duration, products, found, alerts, skipped, records):
+        """Count a run towards the next check_runs row, saving it once the interval is up."""
+        if self.totals is None:
+            self.totals = [started_at, 0.0, 0, 0, 0, 0]
+            self.totals_since = time.time()
+        for position, value in enumerate((duration, products, found, alerts, skipped), 1):
+            self.totals[position] += value
+        self.records.extend(records)
+        if time.time() - self.totals_since >= self.metrics_interval:
+            self.save_metrics()
+
+    def save_metrics(self):
+        """Save the runs added since the last save as one check_runs row (duration: their total)."""
+        if self.totals is None:
+            return
+        save_run_metrics(*self.totals, metrics_summary(self.records))
+        self.totals = None
+        self.records = []
+
+# ==================================
+# 🗓️ SCHEDULER
+# ==================================
+def _check_cost(product, selected=0):
+    """
+    Estimated worker-seconds for one more of the product's store, with
+    `selected` of them already taken. A batched store pays for a whole batch
+    call (per pincode) with the first product of each batch and nothing for
+    the rest, i.e. ceil(products / batch size) calls in all.
+    """
+    store = store_config(product["storeType"])
+    if store.batch and selected % max(1, store.batch["size"]):
+        return 0.0
+    return store.check_seconds * (len(pincodes_to_check()) if store.pincodes else 1)
+
+
+def fit_to_budget(products, budget, used=None):
+    """
+    Take due products (most overdue first) while each store's estimated
+    work still fits its share of the budget: `budget` seconds times the
+    store's concurrency. Returns (selected, carried_over_count).
+
+    `used` ({store: [seconds, products]}) carries the accounting across
+    calls, for products that arrive in chunks.
+    """
+    used = {} if used is None else used
+    selected = []
+    for product in products:
+        store = product["storeType"]
+        seconds, taken = used.get(store, (0.0, 0))
+        cost = _check_cost(product, taken)
+        capacity = budget * store_config(store).concurrency
+        if (selected or used) and seconds + cost > capacity:
+            continue
+        used[store] = [seconds + cost, taken + 1]
+        selected.append(product)
+    return selected, len(products) - len(selected)
+
+
+def next_interval(product, check):
+    """
+    Seconds until the product's next check. In-stock or just-changed
+    products stay at the store's base interval; products that keep coming
+    back out of stock back off exponentially, as do failing checks.
+    """
+    base = store_config(product["storeType"]).base_interval
+    previous = product.get("intervalSeconds") or base
+    if check is None:
+        return SCHEDULE_MAX_INTERVAL, 0  # nothing can check this store
+    if check.failures and not check.result:
+        failures = (product.get("failures") or 0) + 1
+        return min(SCHEDULE_MAX_INTERVAL, base * 2 ** failures), failures
+    if check.result or check.changed:
+        return base, 0
+    return min(SCHEDULE_MAX_INTERVAL, max(base, previous * 2)), 0
+
+
+def schedule_rows(products, checks):
+    rows = []
+    for product, check in zip(products, checks):
+        if product.get("id") is None or (check and not check.complete):
+            continue  # cut off by the deadline: stays due
+        interval, failures = next_interval(product, check)
+        rows.append((product["id"], int(interval), failures, bool(check and check.changed)))
+    return rows
+
+# ==================================
+# 🧩 SHARDED RUNS
+# ==================================
+def claim_shard(budget):
+    """
+    Claim this shard's slice of the due products, SHARD_CLAIM_SIZE at a
+    time, until its stores' budgets are full (see fit_to_budget) or nothing
+    is due. Claimed products are leased for SHARD_LEASE seconds, so shards
+    running at the same time get disjoint slices and a crashed shard's
+    products come due again. Products claimed past the budget are handed
+    back. Returns (products, {id: due_at}, carried_over_count).
+    """
+    used = {}
+    selected, overflow, due = [], [], {}
+    while len(selected) < SCHEDULE_MAX_DUE:
+        chunk, chunk_due = claim_due_products(SHARD_CLAIM_SIZE, SHARD_LEASE)
+        due.update(chunk_due)
+        fitting, _ = fit_to_budget(chunk, budget, used)
+        selected.extend(fitting)
+        taken = {product["id"] for product in fitting}
+        overflow.extend(product for product in chunk if product["id"] not in taken)
+        if len(chunk) < SHARD_CLAIM_SIZE or not fitting:
+            break
+    if overflow:
+        release_products([(product["id"], due[product["id"]]) for product in overflow])
+    print(f"[info] 🧩 Claimed {len(selected)} due products ({len(overflow)} handed back).")
+    return selected, due, len(overflow)
+
+
+def merge_shard_stats(results, shards):
+    """One run's stats from its shards' stats, earliest-started shard first."""
+    merged = {"counts": {}, "totals": {}, "tripped": {}, "shards": f"{len(results)}/{shards}", "duration": 0}
+    for stats in results:
+        for key in ("counts", "totals"):
+            for store, count in stats[key].items():
+                merged[key][store] = merged[key].get(store, 0) + count
+        for store, info in stats["tripped"].items():
+            failed_fast = merged["tripped"].get(store, {}).get("failed_fast", 0) + info["failed_fast"]
+            merged["tripped"][store] = dict(info, failed_fast=failed_fast)
+        for key in ("found", "pages_fetched", "pages_reused", "pincodes_planned", "pincodes_checked", "shared", "skipped"):
+            merged[key] = merged.get(key, 0) + stats[key]
+        merged["duration"] = max(merged["duration"], stats["duration"])
+    # What's still due is what the last shard to claim had to leave
+    merged["carried_over"] = results[-1]["carried_over"]
+    return merged
 
 # ==================================
 # 🚀 MAIN LOGIC
 # ==================================
-def main_logic():
+def _collect(iterable, into):
+    """Pass a stream through, keeping each item in `into`."""
+    for item in iterable:
+        into.append(item)
+        yield item
+
+
+def format_summary(stats):
+    """The run summary: one line per registered store, then the run's totals."""
+    timestamp = datetime.datetime.now().strftime("%d %b %Y %I:%M %p")
+    counts, totals = stats["counts"], stats["totals"]
+    return (
+        "".join(
+            f"{store.emoji} *{store.label}:* {counts.get(key, 0)}/{totals.get(key, 0)}\n"
+            for key, store in STORE_CHECKERS.items()
+        )
+        + f"📦 *Total:* {stats['found']} available\n"
+        + (f"🧩 *Shards:* {stats['shards']}\n" if stats.get("shards") else "")
+        + (f"♻️ *Pages unchanged:* {stats['pages_reused']}/{stats['pages_fetched']}\n" if stats["pages_fetched"] else "")
+        + (f"📍 *Pincode checks:* {stats['pincodes_checked']}/{stats['pincodes_planned']}\n" if stats["pincodes_planned"] else "")
+        + (f"🔁 *Shared requests:* {stats['shared']}\n" if stats["shared"] else "")
+        + (f"🗓 *Due, carried over:* {stats['carried_over']}\n" if stats["carried_over"] else "")
+        + (f"⏰ *Skipped (out of time):* {stats['skipped']}\n" if stats["skipped"] else "")
+        + "".join(
+            f"🚦 *{store_config(store).label} circuit {info['state'].replace('_', '-')}:* "
+            f"{info['failed_fast']} checks failed fast\n"
+            for store, info in stats["tripped"].items()
+        )
+        + f"🕒 *Checked:* {timestamp}\n"
+        f"⏱ *Time taken:* {stats['duration']}s"
+    )
+
+
+def run_stock_check(max_workers=None, scheduled=False, time_budget=None, shard=None, products=None, state=None):
+    """
+    One full stock check. Returns a report dict: `in_stock` (every alert
+    message), `alerts` (only the ones that changed since the last run),
+    `skipped` (products the time budget cut off) and `summary`.
+
+    With `scheduled`, only products that are due (and fit in
+    SCHEDULE_BUDGET) are checked, and their next check time is updated.
+    With `time_budget` (seconds), no check starts later than
+    DEADLINE_RESERVE seconds before the budget runs out.
+
+    With `shard` (run_id, shards), this invocation is one of `shards`
+    running the same run: it claims its own slice of the due products (see
+    claim_shard) and, if it finishes the run, the report's `aggregated`
+    holds the merged alerts and summary of every shard.
+
+    With `products`, those are checked instead of loading any (worker.py
+    passes the due part of its in-memory catalog) and rescheduled as with
+    `scheduled`. The report's `schedule` has the rows that were saved.
+
+    With `state` (a RunState kept across calls), store health, pincode
+    history and the previous stock state come from memory, and run metrics
+    are saved per its interval.
+    """
     start_time = time.time()
+    started_at = datetime.datetime.now(datetime.timezone.utc)
+    deadline = None
+    if time_budget:
+        deadline = start_time + max(time_budget - DEADLINE_RESERVE, time_budget / 2)
     print("[info] Starting stock check...")
-    products = get_products_from_db()
+    pincodes_to_check()
+    reset_connection_stats()
+    reset_db_stats()
+    reset_call_records()
+    for key in PAGE_CACHE_STATS:
+        PAGE_CACHE_STATS[key] = 0
+    FLIPKART_PRICES.clear()
+    try:
+        if state is None:
+            restore_store_health(load_store_health())
+        else:
+            state.restore_health()
+    except Exception as e:
+        print(f"[warn] Could not load store health, keeping in-memory state: {e}")
+    for breaker in list(_breakers.values()):
+        breaker.rejected = 0
+    carried_over = None
+    budget = min(SCHEDULE_BUDGET, time_budget) if time_budget else SCHEDULE_BUDGET
+    due = {}
+    if products is not None:
+        scheduled = True
+    elif shard:
+        # No fallback to the whole catalog: every shard would check all of it
+        start_shard_run(*shard)
+        products, due, carried_over = claim_shard(budget)
+        scheduled = True
+    elif scheduled:
+        try:
+            products, carried_over = fit_to_budget(get_due_products(SCHEDULE_MAX_DUE), budget)
+        except Exception as e:
+            print(f"[warn] Scheduler unavailable, checking the whole catalog: {e}")
+            scheduled = False
+    if not scheduled:
+        products = get_products_from_db()
     in_stock = []
-    
-    # Initialize all counters, including Reliance Digital (RD)
-    croma_count = flip_count = amazon_count = unicorn_count = iqoo_count = vivo_count = rd_count = 0
-    croma_total = flip_total = amazon_total = unicorn_total = iqoo_total = vivo_total = rd_total = 0
+    counts = {store: 0 for store in STORE_CHECKERS}
+    totals = dict(counts)
 
     # ----------------------------------------------------
-    # Check Unicorn stock separately for iPhone 17 variants
+    # Check all DB products concurrently
     # ----------------------------------------------------
-    
-    
-    # ----------------------------------------------------
-    # Loop through DB products
-    # ----------------------------------------------------
-    for product in products:
-        result = None
-        if product["storeType"] == "croma":
-            croma_total += 1
-            for pincode in PINCODES_TO_CHECK:
-                result = check_croma(product, pincode)
-                if result:
-                    croma_count += 1
-                    in_stock.append(result)
-                    break
-        elif product["storeType"] == "flipkart":
-            flip_total += 1
-            for pincode in PINCODES_TO_CHECK:
-                result = check_flipkart(product, pincode)
-                if result:
-                    flip_count += 1
-                    in_stock.append(result)
-                    break
-        elif product["storeType"] == "amazon":
-            amazon_total += 1
-            result = check_amazon(product)
-            if result:
-                amazon_count += 1
-                in_stock.append(result)
-        elif product["storeType"] == "iqoo":
-            iqoo_total += 1
-            result = check_iqoo(product)
-            if result:
-                iqoo_count += 1
-                in_stock.append(result)
-        elif product["storeType"] == "vivo":
-            vivo_total += 1
-            result = check_vivo(product)
-            if result:
-                vivo_count += 1
-                in_stock.append(result)
-        elif product["storeType"] == "reliance_digital":
-            rd_total += 1
-            # Check RD against all pincodes until a hit is found
-            for pincode in PINCODES_TO_CHECK:
-                # The product['productId'] now contains the internal Article ID
-                result = check_reliance_digital(product, pincode)
-                if result:
-                    rd_count += 1
-                    in_stock.append(result)
-                    break
+    history = None
+    if ADAPTIVE_PINCODES:
+        try:
+            if state is not None:
+                history = state.pincode_history()
+            else:
+                # The full catalog is streamed, so take the history for all of it
+                history = load_pincode_history([p["id"] for p in products] if scheduled else None)
+        except Exception as e:
+            print(f"[warn] Pincode history unavailable, using config order: {e}")
+    loaded = []
+    checks = run_checks(_collect(products, loaded), max_workers=max_workers, deadline=deadline, history=history)
+    products = loaded
+    skipped = [check.product for check in checks if check and not check.complete]
+    pincode_checks = [check for check in checks if check and STORE_CHECKERS[check.product["storeType"]].pincodes]
+
+    # Collect in DB order so the output matches a serial run exactly
+    for check in checks:
+        if not check:
+            continue
+        store = check.product["storeType"]
+        totals[store] += 1
+        if check.result:
+            counts[store] += 1
+            in_stock.append(check.result)
+
+    alerts = stock_changes(checks, state)
+    schedule = schedule_rows(products, checks) if scheduled else []
+    if schedule:
+        try:
+            save_schedule(schedule)
+        except Exception as e:
+            print(f"[warn] Could not save the check schedule: {e}")
+    if shard and skipped:
+        # Hand the products this shard ran out of time for back to the queue
+        try:
+            release_products([(product["id"], due[product["id"]]) for product in skipped])
+        except Exception as e:
+            print(f"[warn] Could not release skipped products, they'll be due when the lease ends: {e}")
 
+    try:
+        save_store_health(store_health_rows())
+    except Exception as e:
+        print(f"[warn] Could not save store health: {e}")
+    tripped = {
+        store: {"state": breaker.state, "failed_fast": breaker.rejected}
+        for store, breaker in sorted(_breakers.items())
+        if breaker.state != "closed" or breaker.rejected
+    }
 
+    with _records_lock:
+        records = list(CALL_RECORDS)
     duration = round(time.time() - start_time, 2)
-    timestamp = datetime.datetime.now().strftime("%d %b %Y %I:%M %p")
+    stats = {
+        "counts": counts,
+        "totals": totals,
+        "found": len(in_stock),
+        "pages_fetched": sum(PAGE_CACHE_STATS.values()),
+        "pages_reused": PAGE_CACHE_STATS["not_modified"] + PAGE_CACHE_STATS["unchanged"],
+        "pincodes_planned": sum(len(check.pincodes) + len(check.memoized) for check in pincode_checks),
+        "pincodes_checked": sum(len(check.outcomes) for check in pincode_checks),
+        "shared": sum(call["shared"] for call in records),
+        "carried_over": carried_over or 0,
+        "skipped": len(skipped),
+        "tripped": tripped,
+        "duration": duration,
+    }
+    summary = format_summary(stats)
 
-    # Final Summary (Vivo, iQOO, and RD lines added)
-    summary = (
-        f"🟢 *Croma:* {croma_count}/{croma_total}\n"
-        f"🟣 *Flipkart:* {flip_count}/{flip_total}\n"
-        f"🟡 *Amazon:* {amazon_count}/{amazon_total}\n"
-        f"🦄 *Unicorn:* {unicorn_count}/{unicorn_total} (256GB)\n"
-        f"📱 *iQOO:* {iqoo_count}/{iqoo_total}\n"
-        f"🤳 *Vivo:* {vivo_count}/{vivo_total}\n"
-        f"🌐 *R. Digital:* {rd_count}/{rd_total}\n"
-        f"📦 *Total:* {len(in_stock)} available\n"
-        f"🕒 *Checked:* {timestamp}\n"
-        f"⏱ *Time taken:* {duration}s"
-    )
+    save_caches()
+
+    metrics = metrics_summary(records)
+    try:
+        if state is None:
+            save_run_metrics(started_at, duration, len(products), len(in_stock), len(alerts), len(skipped), metrics)
+        else:
+            state.add_run(started_at, duration, len(products), len(in_stock), len(alerts), len(skipped), records)
+    except Exception as e:
+        print(f"[warn] Could not save run metrics: {e}")
+
+    aggregated = []
+    if shard:
+        try:
+            save_shard_result(shard[0], started_at, stats, alerts)
+            aggregated = [
+                (run_id, run_alerts, format_summary(run_stats))
+                for run_id, run_alerts, run_stats in finish_shard_runs(shard[0])
+            ]
+        except Exception as e:
+            print(f"[warn] Could not record shard results: {e}")
 
     print(f"[info] ✅ Found {len(in_stock)} products in stock.")
+    for store, http in connection_stats().items():
+        print(f"[info] HTTP {store}: {http['opened']} connections opened, {http['reused']} reused")
+    with _db_stats_lock:
+        db_stats = dict(DB_STATS, connect_ms=round(DB_STATS["connect_ms"], 1))
+    print(
+        f"[info] DB: {db_stats['connects']} connections opened ({db_stats['connect_ms']} ms), "
+        f"{db_stats['reused']} reused, {db_stats['stale']} stale"
+    )
     print("[info] Summary:\n" + summary)
-    return in_stock, summary
+    return {
+        "in_stock": in_stock,
+        "alerts": alerts,
+        "summary": summary,
+        "carried_over": carried_over or 0,
+        "skipped": skipped,
+        "duration": duration,
+        "metrics": metrics,
+        "calls": records,
+        "breakers": tripped,
+        "db": db_stats,
+        "aggregated": aggregated,
+        "schedule": schedule,
+    }
+
+
+def main_logic(max_workers=None, time_budget=None):
+    report = run_stock_check(max_workers=max_workers, time_budget=time_budget)
+    return report["in_stock"], report["summary"]
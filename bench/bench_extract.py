@@ -0,0 +1,61 @@
+"""
+Micro-benchmark for the HTML field extraction backends in api/check.py.
+
+Parses a saved product page with every available backend and reports the
+parse time and peak Python memory per page, and whether the extracted
+fields match the BeautifulSoup html.parser reference.
+
+    python bench/bench_extract.py [page.html] [--runs 20]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+import check  # noqa: E402
+
+BACKENDS = ["soup", "stream"]
+try:
+    import lxml  # noqa: F401
+    BACKENDS.insert(1, "lxml")
+except ImportError:
+    pass
+
+
+def measure(html, store, backend, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        check.extract_fields(html, store, backend)
+    elapsed = (time.perf_counter() - start) / runs
+
+    tracemalloc.start()
+    check.extract_fields(html, store, backend)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("page", nargs="?", default=os.path.join(root, "scraped_page.html"))
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(args.page, encoding="utf-8") as f:
+        html = f.read()
+    print(f"{os.path.basename(args.page)}: {len(html.encode()) / 1024:.0f} KB, {args.runs} runs\n")
+    print(f"{'store':<18}{'backend':<9}{'ms/page':>9}{'peak KB':>10}  same as soup")
+
+    for store in check.PAGE_FIELDS:
+        reference = check.extract_fields(html, store, "soup")
+        for backend in BACKENDS:
+            elapsed, peak = measure(html, store, backend, args.runs)
+            same = check.extract_fields(html, store, backend) == reference
+            print(f"{store:<18}{backend:<9}{elapsed * 1000:>9.1f}{peak / 1024:>10.0f}  {'yes' if same else 'NO'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Memory benchmark for loading the product catalog in api/check.py.
+
+Compares the old loader (fetchall() into tuples, then a list of dicts) with
+the streaming one (server-side cursor into slotted ProductRecords) on a
+synthetic catalog, each in a fresh child process. Reports the peak Python
+allocations (tracemalloc), the peak RSS growth over the idle process and
+the load time.
+
+    python bench/bench_products.py --products 100000
+    python bench/bench_products.py --products 100000 --dsn postgresql://localhost/scratch
+
+Without --dsn the rows come from an in-process generator, so only the
+Python-side representation is compared. With --dsn they are loaded into a
+scratch schema of that database (dropped afterwards) and read back through
+psycopg2, which includes the driver's result buffers in the RSS figure.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH, "..", "api"))
+
+STORES = ["croma", "flipkart", "amazon", "reliance_digital", "iqoo", "vivo", "unicorn"]
+SCHEMA = "bench_products"
+
+
+def synthetic_rows(count):
+    """Rows shaped like PRODUCT_COLUMNS, with fresh string objects like a driver returns."""
+    for i in range(count):
+        store = STORES[i % len(STORES)]
+        unicorn = ("456", "94", "57,58", str(311 + i % 5), "250") if store == "unicorn" else (None,) * 5
+        yield (
+            f"Apple iPhone 17 Pro Max {256 * (1 + i % 4)}GB Cosmic Orange #{i}",
+            f"https://www.example-{store}.in/apple-iphone-17-pro-max-cosmic-orange/p/{900000000 + i}",
+            str(900000000 + i),
+            store,
+            f"https://fkrt.it/aff{i:08d}" if i % 3 == 0 else None,
+            i + 1,
+        ) + unicorn
+
+
+def legacy_load(rows):
+    """What get_products_from_db did before: every row as a tuple, then as a dict."""
+    rows = list(rows)
+    products = [
+        {
+            "name": row[0],
+            "url": row[1],
+            "productId": row[2],
+            "storeType": row[3],
+            "affiliateLink": row[4],
+            "id": row[5],
+        }
+        for row in rows
+    ]
+    return products
+
+
+def rss_kib():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def seed(dsn, count):
+    import psycopg2
+    import psycopg2.extras
+
+    conn = psycopg2.connect(dsn)
+    with conn, conn.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}")
+        cursor.execute(
+            f"""
+            CREATE TABLE {SCHEMA}.products (
+                id INTEGER PRIMARY KEY, name TEXT, url TEXT, product_id TEXT,
+                store_type TEXT, affiliate_link TEXT
+            );
+            CREATE TABLE {SCHEMA}.unicorn_variants (
+                product_id INTEGER PRIMARY KEY, category_id TEXT, family_id TEXT, group_ids TEXT,
+                color_option_id TEXT, storage_option_id TEXT
+            )
+            """
+        )
+        rows = list(synthetic_rows(count))
+        psycopg2.extras.execute_values(
+            cursor,
+            f"INSERT INTO {SCHEMA}.products (name, url, product_id, store_type, affiliate_link, id) VALUES %s",
+            [row[:6] for row in rows],
+            page_size=5000,
+        )
+        psycopg2.extras.execute_values(
+            cursor,
+            f"INSERT INTO {SCHEMA}.unicorn_variants VALUES %s",
+            [(row[5],) + row[6:] for row in rows if row[6] is not None],
+            page_size=5000,
+        )
+    conn.close()
+
+
+def scoped_dsn(dsn):
+    separator = "&" if "?" in dsn else "?"
+    return f"{dsn}{separator}options=-csearch_path%3D{SCHEMA}"
+
+
+def run_child(args):
+    os.environ["DIRECT_URL"] = scoped_dsn(args.dsn) if args.dsn else ""
+    import contextlib
+    import check
+
+    if args.dsn:
+        import psycopg2
+
+        def source():
+            conn = psycopg2.connect(check.DATABASE_URL)
+            cursor = conn.cursor()
+            cursor.execute("SELECT name, url, product_id, store_type, affiliate_link, id FROM products")
+            try:
+                yield from cursor.fetchall()
+            finally:
+                conn.close()
+    else:
+        def source():
+            return synthetic_rows(args.products)
+
+    baseline = rss_kib()
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        if args.mode == "legacy":
+            products = legacy_load(source())
+        elif args.dsn:
+            products = list(check.get_products_from_db())
+        else:
+            products = [check._product_record(row) for row in source()]
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(json.dumps({
+        "mode": args.mode,
+        "products": len(products),
+        "seconds": elapsed,
+        "peak_mb": peak / 2 ** 20,
+        "rss_mb": (rss_kib() - baseline) / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--dsn", help="Postgres to load the catalog from (uses a scratch schema)")
+    parser.add_argument("--mode", choices=["legacy", "stream"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        return run_child(args)
+
+    if args.dsn:
+        seed(args.dsn, args.products)
+    try:
+        print(f"{'loader':>8} {'products':>9} {'seconds':>8} {'peak MB':>8} {'rss MB':>7}")
+        for mode in ("legacy", "stream"):
+            command = [sys.executable, os.path.abspath(__file__), "--mode", mode, "--products", str(args.products)]
+            if args.dsn:
+                command += ["--dsn", args.dsn]
+            output = subprocess.run(command, stdout=subprocess.PIPE, text=True, check=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{mode:>8} {result['products']:>9} {result['seconds']:>8.2f} "
+                  f"{result['peak_mb']:>8.1f} {result['rss_mb']:>7.1f}")
+    finally:
+        if args.dsn:
+            import psycopg2
+
+            conn = psycopg2.connect(args.dsn)
+            with conn, conn.cursor() as cursor:
+                cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
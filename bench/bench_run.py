@@ -0,0 +1,275 @@
+"""
+End-to-end throughput benchmark for api/check.py, fully offline.
+
+Starts the stand-in store server (bench/standin.py), then for every catalog
+size runs main_logic in a fresh child process against a synthetic catalog
+held in an in-memory fake of the products table (no Postgres needed). Store
+traffic is redirected to the stand-in at the transport adapter, so sessions,
+retries, pooling and parsing all run as in production.
+
+Reports wall time, requests/sec, CPU time and peak RSS per size:
+
+    python bench/bench_run.py --sizes 10,100,1000,10000 --pincodes 2
+    python bench/bench_run.py --sizes 500 --store amazon:latency=800,errors=0.05 --runs 2
+
+With --runs N every child runs N checks back to back and reports the last
+one (page caches and stock state warm).
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH)
+import standin  # noqa: E402
+
+DEFAULT_MIX = "croma=4,flipkart=2,amazon=1,reliance_digital=2,iqoo=1,vivo=1"
+
+PRODUCT_URLS = {
+    "croma": "https://www.croma.com/p/{id}",
+    "flipkart": "https://www.flipkart.com/p/itm{id}",
+    "amazon": "https://www.amazon.in/dp/B0{id:08d}",
+    "reliance_digital": "https://www.reliancedigital.in/product/{id}",
+    "iqoo": "https://shop.iqoo.com/in/product/{id}",
+    "vivo": "https://shop.vivo.com/in/product/{id}",
+    "unicorn": "https://www.apple.com/in/shop/buy-iphone/iphone-17/{id}",
+}
+
+
+def synthetic_catalog(size, mix, duplicates=0.0):
+    """
+    `size` products spread over the stores by the weights in `mix`. A
+    `duplicates` fraction of them repeat an earlier product of the same
+    store (same product ID and URL, their own affiliate link).
+    """
+    weights = []
+    for part in mix.split(","):
+        store, _, weight = part.partition("=")
+        weights += [store] * int(weight or 1)
+    catalog = []
+    for i in range(size):
+        store = weights[i % len(weights)]
+        source = i
+        while source >= len(weights) and (source * 7919) % 100 < duplicates * 100:
+            source -= len(weights)
+        catalog.append({
+            "name": f"Bench Phone {i}",
+            "url": PRODUCT_URLS[store].format(id=source),
+            "productId": str(100000 + source),
+            "storeType": store,
+            "affiliateLink": f"https://aff.example/{i}" if source != i else None,
+            "id": i + 1,
+        })
+    return catalog
+
+
+class FakeDatabase:
+    """In-memory stand-in for the tables api/check.py reads and writes."""
+
+    def __init__(self, products):
+        self.products = products
+        self.stock_state = {}
+        self.schedule = {}
+        self.store_health = {}
+        self.runs = []
+
+    def install(self, check):
+        self.check = check
+        # Shaped like the loaders' rows: store-ordered records with Unicorn options joined in
+        self.products = sorted(
+            (check.ProductRecord(**product, unicorn=self.unicorn_options(product))
+             for product in self.products),
+            key=lambda product: (product["storeType"], product["id"]),
+        )
+        check.get_products_from_db = lambda: iter(self.products)
+        check.get_due_products = self.get_due_products
+        check.save_schedule = self.save_schedule
+        check.sync_stock_state = self.sync_stock_state
+        check.save_run_metrics = lambda *row: self.runs.append(row)
+        check.load_store_health = lambda: list(self.store_health.values())
+        check.save_store_health = lambda rows: self.store_health.update((row[0], row) for row in rows)
+        check.load_pincode_history = self.load_pincode_history
+
+    def get_due_products(self, limit):
+        now = time.time()
+        due = [
+            self.check.ProductRecord(
+                **{key: product[key] for key in product.keys() if key not in ("intervalSeconds", "failures")},
+                intervalSeconds=self.schedule.get(product["id"], (0, 60, 0))[1],
+                failures=self.schedule.get(product["id"], (0, 60, 0))[2],
+            )
+            for product in self.products
+            if self.schedule.get(product["id"], (0,))[0] <= now
+        ]
+        return due[:limit]
+
+    def save_schedule(self, rows):
+        now = time.time()
+        for product_id, interval, failures, _ in rows:
+            self.schedule[product_id] = (now + interval, interval, failures)
+
+    def sync_stock_state(self, rows):
+        previous = {}
+        for product_id, pincode, in_stock, price, _ in rows:
+            key = (product_id, pincode)
+            if key in self.stock_state:
+                previous.setdefault(product_id, []).append((pincode,) + self.stock_state[key][:2])
+        for product_id, pincode, in_stock, price, checked_at in rows:
+            old_price = self.stock_state.get((product_id, pincode), (None, None))[1]
+            self.stock_state[(product_id, pincode)] = (
+                in_stock, price if price is not None else old_price, checked_at.timestamp()
+            )
+        return previous
+
+    @staticmethod
+    def unicorn_options(product):
+        # Every Unicorn product is an iPhone 17 colour x storage combination
+        if product["storeType"] != "unicorn":
+            return None
+        return {
+            "categoryId": "456",
+            "familyId": "94",
+            "groupIds": "57,58",
+            "colorOptionId": str(311 + product["id"] % 5),
+            "storageOptionId": str(250 + product["id"] // 5),
+        }
+
+    def load_pincode_history(self, product_ids=None):
+        product_ids = set(product_ids) if product_ids is not None else None
+        fresh_after = time.time() - self.check.PINCODE_NEGATIVE_TTL
+        entries = sorted(self.stock_state.items(), key=lambda item: item[1][2])
+        rows = [
+            (product_id, pincode, in_stock, checked_at >= fresh_after)
+            for (product_id, pincode), (in_stock, _, checked_at) in entries
+            if product_ids is None or product_id in product_ids
+        ]
+        stores = {product["id"]: product["storeType"] for product in self.products}
+        totals = {}
+        for (product_id, pincode), (in_stock, _, _) in self.stock_state.items():
+            if pincode:
+                total = totals.setdefault((stores[product_id], pincode), [0, 0])
+                total[0] += in_stock
+                total[1] += 1
+        hit_rates = [(store, pincode, hits / count) for (store, pincode), (hits, count) in totals.items()]
+        return self.check.PincodeHistory(rows, hit_rates)
+
+
+def redirect_to(check, address):
+    """Send every store request to the stand-in, tagged with the host it was meant for."""
+    check.load_http()
+    send = check.StoreAdapter.send
+
+    def send_to_standin(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.headers["X-Bench-Host"] = parts.netloc
+        request.url = urlunsplit(("http", address, parts.path, parts.query, ""))
+        return send(self, request, **kwargs)
+
+    check.StoreAdapter.send = send_to_standin
+
+
+def run_child(args):
+    """One catalog size, in this (fresh) process. Prints a JSON result line."""
+    os.environ["PINCODES_TO_CHECK"] = ",".join(str(110001 + i) for i in range(args.pincodes))
+    os.environ["SCHEDULED_CHECKS"] = "0"
+    # Every run does the work, even with --runs
+    os.environ.setdefault("RESULT_CACHE_TTL", "0")
+    os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="bench-cache-"))
+    os.environ.pop("DIRECT_URL", None)
+    sys.path.insert(0, os.path.join(BENCH, "..", "api"))
+    import check
+
+    redirect_to(check, args.address)
+    FakeDatabase(synthetic_catalog(args.size, args.mix, args.duplicates)).install(check)
+
+    log = sys.stdout if args.verbose else open(os.devnull, "w")
+    for _ in range(args.runs):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(log):
+            in_stock, _ = check.main_logic(max_workers=args.workers)
+        wall = time.perf_counter() - start
+        after = resource.getrusage(resource.RUSAGE_SELF)
+
+    requests_sent = sum(stats.get("requests", 0) for stats in check.CONNECTION_STATS.values())
+    print(json.dumps({
+        "products": args.size,
+        "pincodes": args.pincodes,
+        "wall": wall,
+        "requests": requests_sent,
+        "found": len(in_stock),
+        "cpu": (after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime),
+        "peak_rss_mb": after.ru_maxrss / 1024,  # KiB on Linux
+    }))
+
+
+def start_standin(args):
+    command = [sys.executable, os.path.join(BENCH, "standin.py"), "--port", "0",
+               "--stock-rate", str(args.stock_rate), "--seed", str(args.seed), "--page", args.page]
+    if args.fixtures:
+        command += ["--fixtures", args.fixtures]
+    for spec in args.store or []:
+        command += ["--store", spec]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    port = server.stdout.readline().split()[-1]
+    return server, f"127.0.0.1:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,100,1000", help="comma-separated catalog sizes")
+    parser.add_argument("--pincodes", type=int, default=2)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="store weights, e.g. croma=4,amazon=1")
+    parser.add_argument("--duplicates", type=float, default=0.0,
+                        help="fraction of products repeating an earlier one's product ID / URL")
+    parser.add_argument("--workers", type=int, help="max_workers for run_checks")
+    parser.add_argument("--runs", type=int, default=1, help="checks per child; the last one is reported")
+    parser.add_argument("--json", action="store_true", help="print one JSON result per line")
+    parser.add_argument("--verbose", action="store_true", help="keep the checkers' log output")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--address", help=argparse.SUPPRESS)
+    standin.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(args)
+
+    server, address = start_standin(args)
+    try:
+        if not args.json:
+            print(f"# {datetime.datetime.now():%Y-%m-%d %H:%M} stand-in at {address}, mix {args.mix}")
+            print(f"{'products':>9} {'pincodes':>8} {'wall s':>8} {'requests':>9} {'req/s':>8} "
+                  f"{'cpu s':>7} {'rss MB':>7} {'found':>6}")
+        for size in [int(size) for size in args.sizes.split(",")]:
+            command = [sys.executable, os.path.abspath(__file__), "--child", "--size", str(size),
+                       "--address", address, "--pincodes", str(args.pincodes), "--mix", args.mix,
+                       "--runs", str(args.runs), "--duplicates", str(args.duplicates)]
+            if args.workers:
+                command += ["--workers", str(args.workers)]
+            if args.verbose:
+                command.append("--verbose")
+            lines = subprocess.run(command, stdout=subprocess.PIPE, text=True, check=True).stdout.strip().splitlines()
+            if args.verbose:
+                print("\n".join(lines[:-1]))
+            result = json.loads(lines[-1])
+            if args.json:
+                print(json.dumps(result))
+                continue
+            print(f"{result['products']:>9} {result['pincodes']:>8} {result['wall']:>8.2f} "
+                  f"{result['requests']:>9} {result['requests'] / result['wall']:>8.1f} "
+                  f"{result['cpu']:>7.2f} {result['peak_rss_mb']:>7.1f} {result['found']:>6}")
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
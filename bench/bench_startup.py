@@ -0,0 +1,165 @@
+"""
+Cold-start benchmark for api/check.py.
+
+Every run starts a fresh Python process that imports api/check.py and
+serves its Vercel handler, like a cold invocation, then sends it requests.
+Reports, per mode (medians over --runs processes):
+
+    import ms   cumulative import time of the module (from -X importtime)
+    cold ms     process start to the first byte of the first response
+    warm ms     time to first byte of the --requests responses after that
+
+    python bench/bench_startup.py
+    python bench/bench_startup.py --runs 10 --modes lazy
+    python bench/bench_startup.py --dsn postgresql://localhost/scratch
+
+Modes: "lazy" imports api/check.py as it is; "eager" imports requests,
+psycopg2 and bs4 first, the way the module used to at load time.
+Requests hit the 401 path (wrong secret) unless --dsn is given. With --dsn
+they are authorized unscheduled runs against that database, and its
+products really are checked, so point it at a scratch database. Telegram
+delivery is off in the child.
+"""
+import argparse
+import datetime
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+API = os.path.join(BENCH, "..", "api")
+SECRET = "bench"
+EAGER_IMPORTS = "import requests, psycopg2, psycopg2.extras, psycopg2.extensions, bs4"
+
+
+def child_env(args):
+    env = dict(os.environ)
+    env.update(
+        PYTHONPATH=API,
+        CRON_SECRET=SECRET,
+        PINCODES_TO_CHECK=env.get("PINCODES_TO_CHECK", "110001"),
+        DIRECT_URL=args.dsn or "",
+        TELEGRAM_DELIVERY_BUDGET="0",
+        CACHE_DIR=tempfile.mkdtemp(prefix="bench-cache-"),
+    )
+    return env
+
+
+def parse_importtime(stderr):
+    """[(depth, module, cumulative us)] from -X importtime output, in print order."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((depth, name.strip(), int(cumulative)))
+    return entries
+
+
+def import_profile(mode, env):
+    """(ms the statement's top-level imports took, their slowest direct imports)."""
+    statement = "import check" if mode == "lazy" else f"{EAGER_IMPORTS}; import check"
+    command = [sys.executable, "-X", "importtime", "-c"]
+    startup = {name for _, name, _ in parse_importtime(
+        subprocess.run(command + ["pass"], env=env, stderr=subprocess.PIPE, text=True).stderr
+    )}
+    entries = parse_importtime(
+        subprocess.run(command + [statement], env=env, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.PIPE, text=True, check=True).stderr
+    )
+    total = 0
+    children = []
+    for depth, name, cumulative in entries:
+        if name in startup:
+            continue
+        if depth == 0:
+            total += cumulative
+            if name != "check":
+                children.append((cumulative, name))
+        elif depth == 1:
+            children.append((cumulative, name))
+    return total / 1000, sorted(children, reverse=True)
+
+
+def first_byte(port, path):
+    """Seconds from connecting to the first response byte; the response is read to the end."""
+    start = time.perf_counter()
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        sock.sendall(f"GET {path} HTTP/1.0\r\nHost: localhost\r\n\r\n".encode())
+        sock.recv(1)
+        elapsed = time.perf_counter() - start
+        while sock.recv(65536):
+            pass
+    return elapsed
+
+
+def measure(mode, args, env):
+    """(cold seconds, [warm seconds]) for one fresh process."""
+    path = f"/?secret={SECRET}&scheduled=0" if args.dsn else "/?secret=wrong"
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--modes", mode]
+    start = time.perf_counter()
+    server = subprocess.Popen(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        port = int(server.stdout.readline())
+        cold = time.perf_counter() - start + first_byte(port, path)
+        warm = [first_byte(port, path) for _ in range(args.requests)]
+    finally:
+        server.kill()
+        server.wait()
+    return cold, warm
+
+
+def run_child(mode):
+    """Import the handler (eagerly or not) and serve it, printing the port."""
+    if mode == "eager":
+        exec(EAGER_IMPORTS)
+    from http.server import HTTPServer
+
+    import check
+
+    server = HTTPServer(("127.0.0.1", 0), check.handler)
+    print(server.server_port, flush=True)
+    sys.stdout = sys.stderr  # the handler's logging stays off the port line
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="lazy,eager", help="comma-separated: lazy, eager")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per mode")
+    parser.add_argument("--requests", type=int, default=20, help="warm requests per process")
+    parser.add_argument("--top", type=int, default=5, help="slowest imports listed per mode")
+    parser.add_argument("--dsn", help="Postgres to run authorized checks against (a scratch one)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(args.modes)
+
+    env = child_env(args)
+    print(f"# {datetime.datetime.now():%Y-%m-%d %H:%M} {args.runs} runs per mode, "
+          f"{'authorized runs' if args.dsn else '401 path'}")
+    print(f"{'mode':>6} {'import ms':>10} {'cold ms':>8} {'warm ms':>8}")
+    slowest = {}
+    for mode in args.modes.split(","):
+        imports, cold, warm = [], [], []
+        for _ in range(args.runs):
+            total, slowest[mode] = import_profile(mode, env)
+            imports.append(total)
+            first, rest = measure(mode, args, env)
+            cold.append(first)
+            warm.extend(rest)
+        print(f"{mode:>6} {statistics.median(imports):>10.1f} {statistics.median(cold) * 1000:>8.1f} "
+              f"{(statistics.median(warm) if warm else 0) * 1000:>8.1f}")
+    for mode, children in slowest.items():
+        listed = ", ".join(f"{name} {us / 1000:.1f}" for us, name in children[: args.top])
+        print(f"# {mode} slowest imports (ms): {listed}")
+
+
+if __name__ == "__main__":
+    main()
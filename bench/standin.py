@@ -0,0 +1,310 @@
+"""
+Local stand-in for every store API api/check.py talks to.
+
+Answers the Croma promise API, the Flipkart proxy (and the upstream call
+flipkart_proxy.py makes), the Reliance Digital inventory API, Unicorn's
+option lookup and the Amazon / iQOO / Vivo / Reliance Digital product
+pages. Pages replay a recorded page (by default the
+checked-in scraped_page.html) with a small store-specific block injected
+after <body>, so the checkers see a real-sized document.
+
+Requests are routed by the X-Bench-Host header (the store host the checker
+meant to reach; bench_run.py sets it) and fall back to the path. Whether a
+product is in stock is a stable hash of (seed, store, product, pincode), so
+two runs with the same seed see the same catalog.
+
+Each store has a latency / jitter / error-rate / body-size profile:
+
+    python bench/standin.py --port 8800 --store croma:latency=120,jitter=40,errors=0.02
+    python bench/standin.py --store amazon:size=900000,etag=1 --stock-rate 0.3
+
+On start it prints "listening on <port>" and serves until killed.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Latency and jitter in ms, errors as a fraction of requests answered 503,
+# size in bytes (0 keeps the recorded body), etag=1 to answer conditional GETs
+DEFAULT_PROFILES = {
+    "croma": {"latency": 80, "jitter": 30, "errors": 0.0, "size": 0, "etag": 0},
+    "flipkart": {"latency": 250, "jitter": 100, "errors": 0.0, "size": 0, "etag": 0},
+    "amazon": {"latency": 300, "jitter": 100, "errors": 0.0, "size": 0, "etag": 0},
+    "reliance_digital": {"latency": 120, "jitter": 40, "errors": 0.0, "size": 0, "etag": 0},
+    "unicorn": {"latency": 100, "jitter": 30, "errors": 0.0, "size": 0, "etag": 0},
+    "iqoo": {"latency": 200, "jitter": 60, "errors": 0.0, "size": 0, "etag": 0},
+    "vivo": {"latency": 200, "jitter": 60, "errors": 0.0, "size": 0, "etag": 0},
+}
+
+STORE_HOSTS = {
+    "api.croma.com": "croma",
+    "rknldeals.alwaysdata.net": "flipkart",
+    "2.rome.api.flipkart.com": "flipkart",
+    "www.amazon.in": "amazon",
+    "amazon.in": "amazon",
+    "www.reliancedigital.in": "reliance_digital",
+    "fe01.beamcommerce.in": "unicorn",
+    "shop.iqoo.com": "iqoo",
+    "shop.vivo.com": "vivo",
+}
+
+# Injected right after <body>, so it's the first match for each checker's selectors
+PAGE_BLOCKS = {
+    "amazon": (
+        '<span id="productTitle"> {name} </span>'
+        '<div class="a-price"><span class="a-offscreen">₹{price:,}</span></div>'
+        '<div id="availability"><span> {availability} </span></div>'
+    ),
+    "iqoo": '<div class="product-price">₹{price:,}</div><button class="buy-now{disabled}"{attr}>Buy Now</button>',
+    "vivo": '<div class="product-price">₹{price:,}</div><a class="buyNow{disabled}" href="#">Buy Now</a>',
+    "reliance_digital": '<div class="pdpPrice">₹{price:,}</div>',
+}
+
+
+def in_stock(seed, store, product_id, pincode, rate):
+    digest = hashlib.md5(f"{seed}:{store}:{product_id}:{pincode}".encode()).digest()
+    return int.from_bytes(digest[:4], "big") / 2 ** 32 < rate
+
+
+def price_for(store, product_id):
+    digest = hashlib.md5(f"{store}:{product_id}".encode()).digest()
+    return 10000 + int.from_bytes(digest[:3], "big") % 140000
+
+
+class StandIn:
+    def __init__(self, page, profiles, stock_rate=0.2, seed=0, fixtures=None):
+        self.profiles = profiles
+        self.stock_rate = stock_rate
+        self.seed = seed
+        self.pages = {}
+        for store in PAGE_BLOCKS:
+            path = os.path.join(fixtures, f"{store}.html") if fixtures else None
+            with open(path if path and os.path.exists(path) else page, "rb") as f:
+                self.pages[store] = f.read().decode("utf-8", "replace")
+        self.requests = {}
+        self.lock = threading.Lock()
+
+    def count(self, store, status):
+        with self.lock:
+            stats = self.requests.setdefault(store, {})
+            stats[status] = stats.get(status, 0) + 1
+
+    def delay(self, store):
+        profile = self.profiles[store]
+        wait = profile["latency"] + random.uniform(-profile["jitter"], profile["jitter"])
+        if wait > 0:
+            time.sleep(wait / 1000)
+
+    def failed(self, store):
+        return random.random() < self.profiles[store]["errors"]
+
+    def stocked(self, store, product_id, pincode=""):
+        return in_stock(self.seed, store, product_id, pincode, self.stock_rate)
+
+    # --- API responses (shaped like the fields the checkers read) ---
+
+    def croma(self, payload):
+        lines = payload["promise"]["promiseLines"]["promiseLine"]
+        deliverable = [
+            line for line in lines
+            if self.stocked("croma", line["itemID"], line["shipToAddress"]["zipCode"])
+        ]
+        if not deliverable:
+            return {"promise": {"suggestedOption": {}}}
+        return {"promise": {"suggestedOption": {"option": {"promiseLines": {"promiseLine": [
+            {"itemID": line["itemID"], "lineId": line["lineId"], "fulfillmentType": line["fulfillmentType"]}
+            for line in deliverable
+        ]}}}}}
+
+    def flipkart(self, payload):
+        # The proxy protocol ({"productId"} or {"productIds"} + "pincode"),
+        # or the upstream serviceability call flipkart_proxy.py makes
+        if "requestContext" in payload:
+            product_ids = [item["productId"] for item in payload["requestContext"]["products"]]
+            pincode = payload["locationContext"]["pincode"]
+        else:
+            product_ids = payload.get("productIds") or [payload["productId"]]
+            pincode = payload.get("pincode", "")
+        response = {}
+        for product_id in product_ids:
+            available = self.stocked("flipkart", product_id, pincode)
+            listing = {"available": available}
+            if available:
+                listing["pricing"] = {"finalPrice": {"decimalValue": str(price_for("flipkart", product_id))}}
+            response[product_id] = {"listingSummary": listing}
+        return {"RESPONSE": response}
+
+    def reliance_digital(self, payload):
+        articles = []
+        for article in payload["articles"]:
+            entry = {"article_id": article["article_id"], "quantity": 1}
+            if not self.stocked("reliance_digital", article["article_id"], payload["pincode"]):
+                entry["error"] = {"type": "OutOfStockError", "message": "Out of stock"}
+            articles.append(entry)
+        return {"data": {"articles": articles}}
+
+    def unicorn(self, payload):
+        option_ids = payload.get("option_ids", "")
+        stocked = self.stocked("unicorn", option_ids)
+        return {"data": {"product": {
+            "quantity": 3 if stocked else 0,
+            "price": price_for("unicorn", option_ids),
+            "sku": f"SKU-{option_ids.replace(',', '-')}",
+            "custom_column_4": "" if stocked else "Out of Stock",
+        }}}
+
+    def page(self, store, path):
+        product_id = path.rstrip("/").rsplit("/", 1)[-1]
+        stocked = self.stocked(store, product_id)
+        block = PAGE_BLOCKS[store].format(
+            name=f"Bench Phone {product_id}",
+            price=price_for(store, product_id),
+            availability="In stock" if stocked else "Currently out of stock.",
+            disabled="" if stocked else " disabled",
+            attr="" if stocked else " disabled",
+        )
+        html = self.pages[store]
+        body_tag = re.search(r"<body[^>]*>", html)
+        at = body_tag.end() if body_tag else 0
+        return html[:at] + block + html[at:]
+
+
+def resize(body, size, html):
+    """Pad (or, for pages, trim) a response body to about `size` bytes."""
+    if not size or len(body) >= size and not html:
+        return body
+    if len(body) >= size:
+        return body[:size]
+    filler = size - len(body)
+    if html:
+        return body + b"<!--" + b"x" * max(0, filler - 7) + b"-->"
+    return body[:-1] + b',"_padding":"' + b"x" * max(0, filler - 15) + b'"}'
+
+
+def make_handler(standin):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def store(self):
+            host = self.headers.get("X-Bench-Host") or ""
+            if host in STORE_HOSTS:
+                return STORE_HOSTS[host]
+            # Without the header: /<store>/...
+            first = urlparse(self.path).path.strip("/").split("/", 1)[0]
+            return first if first in standin.profiles else None
+
+        def reply(self, store, status, body=b"", content_type="application/json", etag=None):
+            standin.count(store or "unknown", status)
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            if etag:
+                self.send_header("ETag", etag)
+            self.end_headers()
+            if body:
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the checker stopped reading early
+
+        def do_POST(self):
+            store = self.store()
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            if store not in ("croma", "flipkart", "reliance_digital", "unicorn"):
+                return self.reply(store, 404)
+            standin.delay(store)
+            if standin.failed(store):
+                return self.reply(store, 503)
+            body = json.dumps(getattr(standin, store)(payload)).encode()
+            self.reply(store, 200, resize(body, standin.profiles[store]["size"], html=False))
+
+        def do_GET(self):
+            store = self.store()
+            if store not in PAGE_BLOCKS:
+                return self.reply(store, 404)
+            standin.delay(store)
+            if standin.failed(store):
+                return self.reply(store, 503)
+            profile = standin.profiles[store]
+            body = resize(standin.page(store, urlparse(self.path).path).encode(), profile["size"], html=True)
+            etag = None
+            if profile["etag"]:
+                etag = '"%s"' % hashlib.md5(body).hexdigest()
+                if self.headers.get("If-None-Match") == etag:
+                    return self.reply(store, 304, etag=etag)
+            self.reply(store, 200, body, "text/html; charset=utf-8", etag)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def parse_profiles(specs):
+    """["croma:latency=120,errors=0.1", ...] -> DEFAULT_PROFILES with overrides."""
+    profiles = {store: dict(profile) for store, profile in DEFAULT_PROFILES.items()}
+    for spec in specs or []:
+        store, _, settings = spec.partition(":")
+        if store not in profiles:
+            raise SystemExit(f"unknown store {store!r}")
+        for setting in filter(None, settings.split(",")):
+            key, _, value = setting.partition("=")
+            if key not in profiles[store]:
+                raise SystemExit(f"unknown setting {key!r} for {store}")
+            profiles[store][key] = float(value) if key in ("latency", "jitter", "errors") else int(value)
+    return profiles
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Checkers hang up mid-page once they have their fields
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+def serve(standin, port=0):
+    """Start the stand-in on a background thread; returns the server."""
+    server = StandInServer(("127.0.0.1", port), make_handler(standin))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    parser.add_argument("--page", default=os.path.join(ROOT, "scraped_page.html"), help="recorded product page")
+    parser.add_argument("--fixtures", help="directory with <store>.html pages overriding --page")
+    parser.add_argument("--store", action="append", metavar="STORE:KEY=VALUE,...", help="profile override")
+    parser.add_argument("--stock-rate", type=float, default=0.2, help="fraction of product/pincodes in stock")
+    parser.add_argument("--seed", type=int, default=0, help="changes which products are in stock")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=0)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    standin = StandIn(args.page, parse_profiles(args.store), args.stock_rate, args.seed, args.fixtures)
+    server = serve(standin, args.port)
+    print(f"listening on {server.server_port}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(json.dumps(standin.requests), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
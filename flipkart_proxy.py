@@ -0,0 +1,131 @@
+"""
+Reference implementation of the Flipkart proxy api/check.py calls
+(FLIPKART_PROXY_URL), to self-host next to the AlwaysData one or run
+locally:
+
+    python flipkart_proxy.py --port 8700
+    FLIPKART_PROXY_URL=http://127.0.0.1:8700/flipkart_check ...
+
+POST /flipkart_check with {"productId": "...", "pincode": "..."}, or
+{"productIds": [...], "pincode": "..."} to check several products in one
+round trip. The answer is Flipkart's own serviceability response shape,
+{"RESPONSE": {productId: {"listingSummary": {...}}}}, merged over however
+many upstream calls the products took (--upstream-batch per call, run
+--workers at a time). Products the upstream didn't answer for are left
+out, so the client checks them on their own. Upstream failures answer 502.
+
+For offline testing, point --upstream at bench/standin.py:
+
+    python bench/standin.py --port 8800
+    python flipkart_proxy.py --upstream http://127.0.0.1:8800/flipkart/api/3/product/serviceability
+"""
+import argparse
+import json
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.adapters import HTTPAdapter
+
+UPSTREAM_URL = "https://2.rome.api.flipkart.com/api/3/product/serviceability"
+UPSTREAM_HEADERS = {
+    "Content-Type": "application/json",
+    "Origin": "https://www.flipkart.com",
+    "Referer": "https://www.flipkart.com/",
+    "X-User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36 FKUA/website/42/website/Desktop"
+    ),
+}
+MAX_PRODUCTS = 200
+
+
+class FlipkartClient:
+    """Keep-alive session to the serviceability API, chunking large requests."""
+
+    def __init__(self, upstream, batch, workers, timeout):
+        self.upstream = upstream
+        self.batch = batch
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(UPSTREAM_HEADERS)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upstream")
+
+    def fetch(self, product_ids, pincode):
+        payload = {
+            "requestContext": {"products": [{"productId": product_id} for product_id in product_ids]},
+            "locationContext": {"pincode": pincode},
+        }
+        res = self.session.post(self.upstream, json=payload, timeout=self.timeout)
+        res.raise_for_status()
+        return res.json().get("RESPONSE") or {}
+
+    def check(self, product_ids, pincode):
+        chunks = [product_ids[i:i + self.batch] for i in range(0, len(product_ids), self.batch)]
+        response = {}
+        for part in self.executor.map(lambda chunk: self.fetch(chunk, pincode), chunks):
+            response.update(part)
+        return {"RESPONSE": {product_id: response[product_id] for product_id in product_ids if product_id in response}}
+
+
+def make_handler(client):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.path.split("?", 1)[0].rstrip("/") != "/flipkart_check":
+                return self.reply(404, {"error": "not found"})
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                product_ids = payload.get("productIds") or [payload["productId"]]
+                product_ids = list(dict.fromkeys(str(product_id) for product_id in product_ids))
+                pincode = str(payload["pincode"])
+            except (ValueError, KeyError, TypeError, AttributeError):
+                return self.reply(400, {"error": "expected {productId or productIds, pincode}"})
+            if len(product_ids) > MAX_PRODUCTS:
+                return self.reply(400, {"error": f"at most {MAX_PRODUCTS} productIds per request"})
+            try:
+                self.reply(200, client.check(product_ids, pincode))
+            except (requests.RequestException, ValueError) as e:
+                self.reply(502, {"error": f"upstream: {e}"})
+
+        def log_message(self, fmt, *args):
+            print(f"[proxy] {self.address_string()} {fmt % args}")
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--upstream", default=UPSTREAM_URL, help="Flipkart serviceability API URL")
+    parser.add_argument("--upstream-batch", type=int, default=20, help="products per upstream call")
+    parser.add_argument("--workers", type=int, default=4, help="upstream calls in flight per request")
+    parser.add_argument("--timeout", type=float, default=20, help="upstream timeout, seconds")
+    args = parser.parse_args()
+
+    client = FlipkartClient(args.upstream, max(1, args.upstream_batch), args.workers, args.timeout)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(client))
+    server.daemon_threads = True
+    print(f"[proxy] listening on {args.host}:{server.server_port}, upstream {args.upstream}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
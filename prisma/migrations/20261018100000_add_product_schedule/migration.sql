@@ -0,0 +1,17 @@
+-- CreateTable
+CREATE TABLE "product_schedule" (
+    "product_id" INTEGER NOT NULL,
+    "next_check_at" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "interval_seconds" INTEGER NOT NULL DEFAULT 60,
+    "failures" INTEGER NOT NULL DEFAULT 0,
+    "last_checked_at" TIMESTAMP(3),
+    "last_changed_at" TIMESTAMP(3),
+
+    CONSTRAINT "product_schedule_pkey" PRIMARY KEY ("product_id")
+);
+
+-- CreateIndex
+CREATE INDEX "product_schedule_next_check_at_idx" ON "product_schedule"("next_check_at");
+
+-- AddForeignKey
+ALTER TABLE "product_schedule" ADD CONSTRAINT "product_schedule_product_id_fkey" FOREIGN KEY ("product_id") REFERENCES "products"("id") ON DELETE CASCADE ON UPDATE CASCADE;
@@ -0,0 +1,16 @@
+-- CreateTable
+CREATE TABLE "check_runs" (
+    "id" SERIAL NOT NULL,
+    "started_at" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "duration_ms" INTEGER NOT NULL,
+    "products" INTEGER NOT NULL,
+    "found" INTEGER NOT NULL,
+    "alerts" INTEGER NOT NULL,
+    "skipped" INTEGER NOT NULL DEFAULT 0,
+    "metrics" JSONB NOT NULL,
+
+    CONSTRAINT "check_runs_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE INDEX "check_runs_started_at_idx" ON "check_runs"("started_at");
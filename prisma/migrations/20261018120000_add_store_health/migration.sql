@@ -0,0 +1,11 @@
+-- CreateTable
+CREATE TABLE "store_health" (
+    "store" TEXT NOT NULL,
+    "state" TEXT NOT NULL DEFAULT 'closed',
+    "failures" INTEGER NOT NULL DEFAULT 0,
+    "open_until" TIMESTAMP(3),
+    "rate" DOUBLE PRECISION,
+    "updated_at" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT "store_health_pkey" PRIMARY KEY ("store")
+);
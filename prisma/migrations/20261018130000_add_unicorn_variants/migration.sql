@@ -0,0 +1,14 @@
+-- CreateTable
+CREATE TABLE "unicorn_variants" (
+    "product_id" INTEGER NOT NULL,
+    "category_id" TEXT NOT NULL,
+    "family_id" TEXT NOT NULL,
+    "group_ids" TEXT NOT NULL,
+    "color_option_id" TEXT NOT NULL,
+    "storage_option_id" TEXT NOT NULL,
+
+    CONSTRAINT "unicorn_variants_pkey" PRIMARY KEY ("product_id")
+);
+
+-- AddForeignKey
+ALTER TABLE "unicorn_variants" ADD CONSTRAINT "unicorn_variants_product_id_fkey" FOREIGN KEY ("product_id") REFERENCES "products"("id") ON DELETE CASCADE ON UPDATE CASCADE;
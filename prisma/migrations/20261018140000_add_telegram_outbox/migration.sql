@@ -0,0 +1,15 @@
+-- CreateTable
+CREATE TABLE "telegram_outbox" (
+    "id" SERIAL NOT NULL,
+    "chat_id" TEXT NOT NULL,
+    "text" TEXT NOT NULL,
+    "attempts" INTEGER NOT NULL DEFAULT 0,
+    "last_error" TEXT,
+    "next_attempt_at" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "created_at" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT "telegram_outbox_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE INDEX "telegram_outbox_next_attempt_at_idx" ON "telegram_outbox"("next_attempt_at");
@@ -0,0 +1,29 @@
+-- CreateTable
+CREATE TABLE "shard_runs" (
+    "run_id" TEXT NOT NULL,
+    "shards" INTEGER NOT NULL,
+    "started_at" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "aggregated_at" TIMESTAMP(3),
+
+    CONSTRAINT "shard_runs_pkey" PRIMARY KEY ("run_id")
+);
+
+-- CreateTable
+CREATE TABLE "shard_results" (
+    "id" SERIAL NOT NULL,
+    "run_id" TEXT NOT NULL,
+    "started_at" TIMESTAMP(3) NOT NULL,
+    "stats" JSONB NOT NULL,
+    "alerts" JSONB NOT NULL,
+
+    CONSTRAINT "shard_results_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE INDEX "shard_runs_aggregated_at_started_at_idx" ON "shard_runs"("aggregated_at", "started_at");
+
+-- CreateIndex
+CREATE INDEX "shard_results_run_id_idx" ON "shard_results"("run_id");
+
+-- AddForeignKey
+ALTER TABLE "shard_results" ADD CONSTRAINT "shard_results_run_id_fkey" FOREIGN KEY ("run_id") REFERENCES "shard_runs"("run_id") ON DELETE CASCADE ON UPDATE CASCADE;
@@ -0,0 +1,5 @@
+-- AlterTable
+ALTER TABLE "products" ADD COLUMN "updated_at" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP;
+
+-- CreateIndex
+CREATE INDEX "products_updated_at_idx" ON "products"("updated_at");
@@ -0,0 +1,22 @@
+-- Seed the iPhone 17 256GB variants api/check.py used to check from
+-- hard-coded option IDs, as "unicorn" products with their unicorn_variants
+-- rows (category 456, family 94, groups 57,58; 256GB is option 250).
+INSERT INTO "products" ("name", "url", "product_id", "store_type")
+SELECT v.name, 'https://shop.unicornstore.in/iphone-17', v.product_id, 'unicorn'
+FROM (VALUES
+    ('(Unicorn) iPhone 17 Lavender 256GB', 'iphone-17-313-250'),
+    ('(Unicorn) iPhone 17 Sage 256GB', 'iphone-17-311-250'),
+    ('(Unicorn) iPhone 17 Mist Blue 256GB', 'iphone-17-312-250'),
+    ('(Unicorn) iPhone 17 White 256GB', 'iphone-17-314-250'),
+    ('(Unicorn) iPhone 17 Black 256GB', 'iphone-17-315-250')
+) AS v ("name", "product_id")
+WHERE NOT EXISTS (
+    SELECT 1 FROM "products" p WHERE p."store_type" = 'unicorn' AND p."product_id" = v.product_id
+);
+
+INSERT INTO "unicorn_variants"
+    ("product_id", "category_id", "family_id", "group_ids", "color_option_id", "storage_option_id")
+SELECT p."id", '456', '94', '57,58', split_part(p."product_id", '-', 3), split_part(p."product_id", '-', 4)
+FROM "products" p
+WHERE p."store_type" = 'unicorn' AND p."product_id" LIKE 'iphone-17-%'
+ON CONFLICT ("product_id") DO NOTHING;
@@ -0,0 +1,147 @@
+"""
+FieldScanner (the default "stream" HTML backend) against the BeautifulSoup
+html.parser reference it replaces: same fields, same out-of-stock flag.
+"""
+import os
+
+import pytest
+
+import check
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+PAGES = {
+    "amazon": """
+        <html><head><title>Amazon.in</title></head><body>
+        <span class="a-offscreen">₹1 (outside .a-price)</span>
+        <h1 id="title"><span id="productTitle">  Apple iPhone 17 (256 GB)  </span></h1>
+        <div class="a-section a-price aok-align-center" data-a-color="price">
+          <span class="a-offscreen">₹82,900.00</span><span aria-hidden="true">₹82,900</span>
+        </div>
+        <div class="a-price"><span class="a-offscreen">₹89,900.00</span></div>
+        <div id="availability"><span class="a-size-medium a-color-success"> In stock </span></div>
+        </body></html>
+    """,
+    "iqoo": """
+        <html><head><title>iQOO 13 | Official Store</title>
+        <script>var labels = {oos: "Out of stock"};</script></head><body>
+        <button class="cart">Add to Cart</button>
+        <a class="cta" href="/buy"><span>Buy</span> <b>Now</b></a>
+        <button class="primary" data-sku="13">Buy Now</button>
+        <div class="product-price"><span class="selling-price">₹54,999</span><s>₹59,999</s></div>
+        <div class="emi-details">No cost EMI from ₹4,584/month</div>
+        </body></html>
+    """,
+    "vivo": """
+        <html><head><title>vivo X200 Pro</title></head><body>
+        <div class="buyButton disabled">Notify Me</div>
+        <p class="js-final-price">₹94,999</p>
+        <ul class="product-offers"><li>Bank offer</li><li>Exchange bonus</li></ul>
+        </body></html>
+    """,
+    "reliance_digital": """
+        <html><body>
+        <div class="pdp__PriceSection">
+          <span class="TextWeb__Text-sc-1cyx778-0 amount">₹29,999</span>
+        </div>
+        <div class="pdpPrice">₹34,999</div>
+        <div class="product-price"><span class="amount">₹31,999</span></div>
+        </body></html>
+    """,
+}
+
+MALFORMED = {
+    "unclosed capture": ("iqoo", '<title>t</title><div class="price-tag">₹1,999<span>off</div><p>after'),
+    "unclosed at eof": ("vivo", '<title>t<p class="js-final-price">₹9,999<div>trailing'),
+    "stray end tags": ("amazon", '</b></span><div class="a-price"></i><span class="a-offscreen">₹5</span></div>'),
+    "unquoted attributes": ("vivo", "<a class=buyNow href=/buy>Buy</a><p class=js-final-price>₹7</p>"),
+    "self-closed non-void": ("iqoo", '<div class="price-tag"/>₹3<a>Buy Now</a><title>t</title>'),
+    "nested same tag": ("amazon", '<div class="a-price"><div><span class="a-offscreen">₹1<span>2</span></span></div></div>'),
+    "void tags": ("iqoo", '<div class="product-price">₹4<br>,999<img src=x><input value=1></div>'),
+    "entities": ("vivo", '<p class="js-final-price">&#8377;1,23,456&nbsp;&amp; more</p>'),
+    "comment and cdata": ("vivo", '<p class="js-final-price"><!-- ₹0 -->₹8<![CDATA[ raw ]]></p>'),
+    "out of stock in a script": ("iqoo", "<title>t</title><script>'out of stock'</script><a>Buy Now</a>"),
+    "out of stock across tags": ("vivo", "<title>t</title><p>Currently <b>unavailable</b></p>"),
+    "contains spans children": ("iqoo", "<title>t</title><a><i>Buy</i> Now</a>"),
+    "contains never matches": ("iqoo", "<title>t</title><button>Buy</button><a>Now</a>"),
+    "attribute substring": ("reliance_digital", '<div class="xPricex">₹1</div><div class="pdpPrice">₹2</div>'),
+    "attribute substring on another attr": ("reliance_digital", '<div id="Price">₹1</div><div class="finalPrice">₹2</div>'),
+    "empty page": ("amazon", ""),
+    "fields missing": ("vivo", "<html><body><p>nothing here</p></body></html>"),
+}
+
+
+def stream_fields(html, store, chunk=None):
+    if chunk is None:
+        return check.extract_fields(html, store, "stream")
+    scanner = check.FieldScanner(store)
+    for start in range(0, len(html), chunk):
+        scanner.feed(html[start:start + chunk])
+    return scanner.result()
+
+
+@pytest.mark.parametrize("store", sorted(PAGES))
+def test_store_selectors_match_soup(store):
+    html = PAGES[store]
+    assert stream_fields(html, store) == check.extract_fields(html, store, "soup")
+
+
+@pytest.mark.parametrize("store", sorted(PAGES))
+@pytest.mark.parametrize("chunk", [1, 7, 64])
+def test_chunked_feeding_matches_soup(store, chunk):
+    html = PAGES[store]
+    assert stream_fields(html, store, chunk) == check.extract_fields(html, store, "soup")
+
+
+@pytest.mark.parametrize("name", sorted(MALFORMED))
+def test_malformed_html_matches_soup(name):
+    store, html = MALFORMED[name]
+    assert stream_fields(html, store) == check.extract_fields(html, store, "soup")
+
+
+def test_first_match_in_document_order():
+    fields = stream_fields(PAGES["reliance_digital"], "reliance_digital")
+    assert check.field_text(fields, "price") == "₹29,999"
+    fields = stream_fields(PAGES["amazon"], "amazon")
+    assert check.field_text(fields, "price") == "₹82,900.00"
+
+
+def test_contains_skips_earlier_non_matching_elements():
+    fields = stream_fields(PAGES["iqoo"], "iqoo")
+    assert check.field_text(fields, "button") == "BuyNow"
+    assert fields["button"]["attrs"] == {"class": ["cta"], "href": "/buy"}
+
+
+@pytest.mark.parametrize("store", ["amazon", "iqoo", "vivo", "reliance_digital"])
+def test_recorded_page_matches_soup(store):
+    with open(os.path.join(ROOT, "scraped_page.html"), encoding="utf-8") as f:
+        html = f.read()
+    assert stream_fields(html, store) == check.extract_fields(html, store, "soup")
+
+
+def test_stops_once_every_field_is_settled():
+    head = PAGES["amazon"].replace("</body></html>", "")
+    tail = "<div><span class='a-offscreen'>late</span>" * 5000
+    scanner = check.FieldScanner("amazon")
+    scanner.feed(head)
+    assert scanner.done
+    # What follows can't change the answer
+    assert scanner.result() == check.extract_fields(head + tail, "amazon", "soup")
+
+
+def test_waits_for_an_out_of_stock_phrase():
+    html = '<title>t</title><a>Buy Now</a><p class="price-tag">₹1</p><p class="emi-details">x</p>'
+    scanner = check.FieldScanner("iqoo")
+    scanner.feed(html)
+    assert not scanner.done  # a phrase could still turn up
+    scanner.feed("<p>Notify me</p>")
+    assert scanner.done
+    assert scanner.result()["oos"] is True
+
+
+def test_open_candidate_is_not_settled_early():
+    scanner = check.FieldScanner("vivo")
+    scanner.feed('<title>t</title><a class="buyNow">B</a><div class="product-offers">o</div><p class="js-final-price">₹1')
+    assert not scanner.done
+    scanner.feed(",999</p>")
+    assert check.field_text(scanner.result(), "price") == "₹1,999"
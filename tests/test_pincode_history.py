@@ -0,0 +1,63 @@
+import pytest
+
+import check
+
+PINCODES = ["110001", "400001", "560001"]
+
+
+@pytest.fixture(autouse=True)
+def pincodes(monkeypatch):
+    monkeypatch.setattr(check, "_pincodes", list(PINCODES))
+    monkeypatch.setattr(check, "PINCODE_NEGATIVE_TTL", 600)
+
+
+def product(product_id=1, store="croma"):
+    return check.ProductRecord(f"p{product_id}", "https://example.com", str(product_id), store, id=product_id)
+
+
+def test_no_history_keeps_config_order():
+    assert check.PincodeHistory([], []).plan(product()) == (PINCODES, [])
+
+
+def test_last_hit_goes_first():
+    history = check.PincodeHistory([(1, "560001", True, False)], [])
+    assert history.plan(product()) == (["560001", "110001", "400001"], [])
+
+
+def test_most_recent_hit_wins():
+    rows = [(1, "400001", True, False), (1, "560001", True, False)]  # oldest first
+    assert check.PincodeHistory(rows, []).plan(product())[0][0] == "560001"
+
+
+def test_rest_by_store_hit_rate():
+    rates = [("croma", "400001", 0.1), ("croma", "560001", 0.6), ("amazon", "110001", 0.9)]
+    history = check.PincodeHistory([], rates)
+    assert history.plan(product())[0] == ["560001", "400001", "110001"]
+    # Another store's rates don't apply
+    assert history.plan(product(store="reliance_digital"))[0] == PINCODES
+
+
+def test_fresh_negatives_are_skipped_but_never_the_first():
+    rows = [(1, "110001", False, True), (1, "400001", False, True), (1, "560001", False, False)]
+    pincodes, memoized = check.PincodeHistory(rows, []).plan(product())
+    assert pincodes == ["110001", "560001"]
+    assert memoized == ["400001"]
+
+
+def test_negatives_only_count_for_their_product():
+    rows = [(2, "400001", False, True)]
+    assert check.PincodeHistory(rows, []).plan(product(1)) == (PINCODES, [])
+
+
+def test_negative_ttl_zero_skips_nothing(monkeypatch):
+    monkeypatch.setattr(check, "PINCODE_NEGATIVE_TTL", 0)
+    rows = [(1, "400001", False, True)]
+    assert check.PincodeHistory(rows, []).plan(product()) == (PINCODES, [])
+
+
+def test_every_pincode_is_planned_or_memoized():
+    rows = [(1, "560001", True, False), (1, "110001", False, True)]
+    rates = [("croma", "400001", 0.5)]
+    pincodes, memoized = check.PincodeHistory(rows, rates).plan(product())
+    assert pincodes[0] == "560001"
+    assert sorted(pincodes + memoized) == sorted(PINCODES)
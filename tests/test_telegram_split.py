@@ -0,0 +1,51 @@
+import check
+
+ALERT = "✅ *Croma*\n[Apple iPhone 17 (256 GB)](https://www.croma.com/p/312345)\n💰 Price: ₹82,900"
+
+
+def lengths(parts):
+    return [check._telegram_length(part) for part in parts]
+
+
+def test_short_message_is_one_part():
+    assert check.split_telegram_message("hello\n\nworld") == ["hello\n\nworld"]
+
+
+def test_splits_between_alerts():
+    text = "\n\n".join([ALERT] * 100)
+    parts = check.split_telegram_message(text, limit=500)
+    assert len(parts) > 1
+    assert max(lengths(parts)) <= 500
+    # Every alert stays whole, and in order
+    assert "\n\n".join(parts) == text
+    assert all(part.count(ALERT) == part.count("✅") for part in parts)
+
+
+def test_long_paragraph_splits_between_lines():
+    lines = [f"line {i} 📦 *bold*" for i in range(200)]
+    parts = check.split_telegram_message("\n".join(lines), limit=300)
+    assert max(lengths(parts)) <= 300
+    assert "\n".join(parts).split("\n") == lines
+
+
+def test_overlong_line_is_cut_hard():
+    line = "x" * 1000
+    parts = check.split_telegram_message(line, limit=300)
+    assert lengths(parts) == [300, 300, 300, 100]
+    assert "".join(parts) == line
+
+
+def test_limit_counts_utf16_code_units():
+    # Each 🔥 is two UTF-16 code units and is never cut in half
+    line = "🔥" * 300
+    parts = check.split_telegram_message(line, limit=101)
+    assert max(lengths(parts)) <= 101
+    assert "".join(parts) == line
+    assert all(len(part) == 50 for part in parts[:-1])
+
+
+def test_default_limit_is_telegrams():
+    text = "\n\n".join([ALERT] * 200)
+    parts = check.split_telegram_message(text)
+    assert max(lengths(parts)) <= check.TELEGRAM_MAX_LENGTH
+    assert "\n\n".join(parts) == text
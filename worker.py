@@ -0,0 +1,201 @@
+"""
+Long-running stock checker: api/check.py's checks in a continuous loop,
+for a host that can keep a process up (VM, container, systemd service)
+instead of the Vercel cron hitting the handler.
+
+    python worker.py
+    python worker.py --once    # one pass over whatever is due, then exit
+
+It reads the same environment as api/check.py. Between passes, it keeps
+in memory:
+- the store sessions (and their connection pools) and the Postgres connection
+- the catalog, with every product's next check time
+- store health, stock state and pincode history (check.RunState), read
+  from Postgres once instead of every pass
+
+So don't run the Vercel cron against the same database alongside it.
+Each pass checks the products that are due, as many as fit in
+WORKER_PASS_BUDGET seconds, and then:
+- saves their schedule and stock state as a cron run would
+- queues and delivers the alerts
+- sleeps until the next product is due
+
+Run metrics go to check_runs as one row per WORKER_METRICS_INTERVAL
+seconds. Every WORKER_REFRESH seconds the catalog picks up new and edited
+products (products.updated_at watermark) and drops deleted ones. Every
+WORKER_FULL_RELOAD seconds it's reloaded whole, and so is the stock state.
+
+SIGTERM / SIGINT stop it after the current pass, which a deadline bounds
+to WORKER_PASS_BUDGET seconds. A second signal exits at once. If RSS
+grows past WORKER_MAX_RSS_MB, it also stops after the pass, with exit
+status 75, for the supervisor to restart it.
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "api"))
+import check  # noqa: E402
+
+WORKER_PASS_BUDGET = float(os.getenv("WORKER_PASS_BUDGET", "20"))
+WORKER_REFRESH = float(os.getenv("WORKER_REFRESH", "60"))
+WORKER_FULL_RELOAD = float(os.getenv("WORKER_FULL_RELOAD", "3600"))
+WORKER_MAX_SLEEP = float(os.getenv("WORKER_MAX_SLEEP", "15"))
+WORKER_METRICS_INTERVAL = float(os.getenv("WORKER_METRICS_INTERVAL", "300"))
+WORKER_MAX_RSS_MB = int(os.getenv("WORKER_MAX_RSS_MB", "512"))  # 0: no limit
+MIN_SLEEP = 1.0
+EXIT_RESTART = 75  # EX_TEMPFAIL
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # peak, KiB on Linux
+
+
+class Catalog:
+    """The products, by id, and when each one is next due (epoch seconds)."""
+
+    def __init__(self):
+        self.products = {}
+        self.due_at = {}
+        self.watermark = None
+        self.refreshed_at = 0.0
+        self.reloaded_at = 0.0
+
+    def refresh(self, full=False):
+        now = time.time()
+        rows, watermark = check.get_products_changed_since(None if full else self.watermark)
+        if full:
+            products = {product["id"]: product for product, _ in rows}
+            self.products = products
+            self.due_at = {product_id: due for product_id, due in self.due_at.items() if product_id in products}
+            self.reloaded_at = now
+        else:
+            for product, _ in rows:
+                self.products[product["id"]] = product
+            for product_id in set(self.products) - check.get_product_ids():
+                del self.products[product_id]
+                self.due_at.pop(product_id, None)
+        for product, due_in in rows:
+            # An in-memory due time is as new as the saved schedule, or newer
+            self.due_at.setdefault(product["id"], now + due_in)
+        self.watermark = watermark or self.watermark
+        self.refreshed_at = now
+
+    def due(self, now):
+        """Due products, most overdue first."""
+        due = sorted((due_at, product_id) for product_id, due_at in self.due_at.items() if due_at <= now)
+        return [self.products[product_id] for _, product_id in due]
+
+    def reschedule(self, rows, now):
+        for product_id, interval, failures, _ in rows:
+            product = self.products.get(product_id)
+            if product is None:
+                continue  # deleted meanwhile
+            product["intervalSeconds"] = interval
+            product["failures"] = failures
+            self.due_at[product_id] = now + interval
+
+    def next_due(self):
+        return min(self.due_at.values(), default=None)
+
+
+class Worker:
+    def __init__(self):
+        self.catalog = Catalog()
+        self.state = check.RunState(WORKER_METRICS_INTERVAL)
+        self.stopping = threading.Event()
+        self.exit_status = 0
+
+    def stop(self, signum=None, frame=None):
+        if signum is not None:
+            print(f"[info] Received {signal.Signals(signum).name}, stopping after the current pass...")
+            # A second signal exits at once
+            signal.signal(signum, signal.SIG_DFL)
+        self.stopping.set()
+
+    def refresh(self, now):
+        full = now - self.catalog.reloaded_at >= WORKER_FULL_RELOAD
+        if not full and now - self.catalog.refreshed_at < WORKER_REFRESH:
+            return
+        try:
+            self.catalog.refresh(full=full)
+            if full:
+                self.state.reload()
+        except Exception as e:
+            print(f"[warn] Could not refresh the catalog, keeping {len(self.catalog.products)} products: {e}")
+            self.catalog.refreshed_at = now  # retry at the next interval, not every pass
+
+    def run_pass(self):
+        """Check what's due. Returns how many products were checked."""
+        now = time.time()
+        self.refresh(now)
+        products, carried_over = check.fit_to_budget(self.catalog.due(now), WORKER_PASS_BUDGET)
+        if not products:
+            return 0
+        print(f"[info] {len(products)} products due ({carried_over} more carried over)")
+        report = check.run_stock_check(products=products, time_budget=WORKER_PASS_BUDGET, state=self.state)
+        self.catalog.reschedule(report["schedule"], time.time())
+        if report["alerts"]:
+            check.queue_stock_alert(report["alerts"], report["summary"])
+        check.deliver_telegram_messages()
+        return len(products)
+
+    def sleep(self):
+        """Until the next product is due or the catalog needs a refresh."""
+        now = time.time()
+        wake = min(now + WORKER_MAX_SLEEP, self.catalog.refreshed_at + WORKER_REFRESH)
+        next_due = self.catalog.next_due()
+        if next_due is not None:
+            wake = min(wake, next_due)
+        self.stopping.wait(max(MIN_SLEEP, wake - now))
+
+    def run(self, once=False):
+        print(f"[info] Worker started (pid {os.getpid()})")
+        while not self.stopping.is_set():
+            try:
+                self.run_pass()
+            except Exception as e:
+                print(f"[error] Pass failed: {e}")
+            if once:
+                break
+            if WORKER_MAX_RSS_MB and rss_mb() > WORKER_MAX_RSS_MB:
+                print(f"[warn] RSS {rss_mb():.0f} MB is over WORKER_MAX_RSS_MB, exiting for a restart")
+                self.exit_status = EXIT_RESTART
+                break
+            self.sleep()
+        self.shutdown()
+        return self.exit_status
+
+    def shutdown(self):
+        check.save_caches()
+        try:
+            self.state.save_metrics()
+        except Exception as e:
+            print(f"[warn] Could not save run metrics: {e}")
+        check.deliver_telegram_messages()
+        check.close_database()
+        print("[info] Worker stopped.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="run one pass, then exit")
+    args = parser.parse_args()
+
+    worker = Worker()
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    sys.exit(worker.run(once=args.once))
+
+
+if __name__ == "__main__":
+    main()